@@ -67,7 +67,9 @@ namespace hakoniwa.ar.bridge
                 }
 
                 // 現在の状態を文字列として取得し、HeartBeatResponseに設定
-                var reply = new HeartBeatResponse(state_manager.GetState().ToString());
+                var deviceId = packet.Data.ContainsKey("device_id") ? packet.Data["device_id"] as string : null;
+                var reply = new HeartBeatResponse(state_manager.GetState().ToString(), deviceId,
+                    HeartBeatResponse.ProbeValue(packet.Data, "nonce"), HeartBeatResponse.ProbeValue(packet.Data, "ts"));
                 udp_service.SendPacket(reply);
                 //Console.WriteLine($"Heartbeat response sent with state: {state_manager.GetState().ToString()} to {serverUri}");
             }
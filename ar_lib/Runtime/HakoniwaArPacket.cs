@@ -68,9 +68,33 @@ namespace hakoniwa.ar.bridge
 
     public class HeartBeatResponse : BasePacket
     {
-        public HeartBeatResponse(string status) : base("data", "heartbeat_response")
+        public HeartBeatResponse(string status, string deviceId = null, long? nonce = null, long? ts = null) : base("data", "heartbeat_response")
         {
             Data["status"] = status;
+            // ブリッジの共有UDPポートでの振り分け用に、HeartBeatRequestのdevice_idをそのまま返す
+            if (deviceId != null)
+            {
+                Data["device_id"] = deviceId;
+            }
+            // ブリッジのRTT計測用に、HeartBeatRequestのnonce/tsをそのまま返す
+            if (nonce != null)
+            {
+                Data["nonce"] = nonce;
+                if (ts != null)
+                {
+                    Data["ts"] = ts;
+                }
+            }
+        }
+
+        // HeartBeatRequestのデータからnonce/tsを取り出す (古いブリッジは送らないのでnull)
+        public static long? ProbeValue(Dictionary<string, object> data, string key)
+        {
+            if (data == null || !data.ContainsKey(key) || data[key] == null)
+            {
+                return null;
+            }
+            return Convert.ToInt64(data[key]);
         }
     }
 
@@ -0,0 +1,372 @@
+import re
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+from asset_lib.impl.comm.packet import BasePacket, HeartBeatRequest, HeartBeatResponse, EventRequest, PositioningRequest, Vec3, decode_json
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+
+class PacketCodec:
+    name = ""
+
+    def encode(self, packet: BasePacket) -> bytes:
+        """
+        Encode a packet, reusing the bytes cached on the packet until it is invalidated.
+
+        The RTT probe (nonce/ts) of a HeartBeatRequest changes on every send, so it is not
+        part of the cached bytes; it is appended to them instead.
+        """
+        wire = packet._wire
+        raw = wire.get(self.name)
+        if raw is None:
+            raw = self.encode_body(packet)
+            wire[self.name] = raw
+        if isinstance(packet, HeartBeatRequest) and packet.nonce is not None:
+            return self.append_probe(raw, packet)
+        return raw
+
+    def encode_uncached(self, packet: BasePacket) -> bytes:
+        """Full serialization, bypassing the cache."""
+        raw = self.encode_body(packet)
+        if isinstance(packet, HeartBeatRequest) and packet.nonce is not None:
+            return self.append_probe(raw, packet)
+        return raw
+
+    def encode_body(self, packet: BasePacket) -> bytes:
+        """The cacheable encoding (everything but a HeartBeatRequest's probe)."""
+        raise NotImplementedError
+
+    def append_probe(self, raw: bytes, packet: HeartBeatRequest) -> bytes:
+        """Add the probe of packet to its encode_body() bytes."""
+        raise NotImplementedError
+
+    def encode_sequenced(self, packet: BasePacket, seq: int, ts: int) -> bytes:
+        """Encode a packet wrapped in a sequence envelope (the cached body is reused as is)."""
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> BasePacket:
+        raise NotImplementedError
+
+class JsonCodec(PacketCodec):
+    """UTF-8 JSON encoding (the original wire format, understood by every AR app)."""
+    name = CODEC_JSON
+
+    # エンベロープはボディをパースせずに読めるよう、オブジェクトの先頭に固定の形で置く
+    ENVELOPE_PREFIX = re.compile(rb'\{"seq":(\d{1,10}),"ts":(\d{1,10}),')
+    ENVELOPE_PEEK = 32
+
+    def encode_body(self, packet: BasePacket) -> bytes:
+        if isinstance(packet, HeartBeatRequest):
+            return packet.body_json().encode('utf-8')
+        return packet.to_json().encode('utf-8')
+
+    def append_probe(self, raw: bytes, packet: HeartBeatRequest) -> bytes:
+        # "data"はto_dict()の最後のキーなので、末尾の"}}"の前にnonceとtsを足す (json.dumpsと同じ区切り)
+        ts = b'%d' % packet.ts if packet.ts is not None else b'null'
+        return b'%s, "nonce": %d, "ts": %s}}' % (raw[:-2], packet.nonce, ts)
+
+    def encode_sequenced(self, packet: BasePacket, seq: int, ts: int) -> bytes:
+        # {"seq":N,"ts":T, + キャッシュ済みボディの"{"以降
+        return b'{"seq":%d,"ts":%d,%s' % (seq, ts, self.encode(packet)[1:])
+
+    @classmethod
+    def read_envelope(cls, data: Union[bytes, memoryview]) -> Optional[Tuple[int, int]]:
+        match = cls.ENVELOPE_PREFIX.match(bytes(data[:cls.ENVELOPE_PEEK]))
+        if match is None:
+            return None
+        return int(match.group(1)) & 0xFFFFFFFF, int(match.group(2)) & 0xFFFFFFFF
+
+    def decode(self, data: bytes) -> BasePacket:
+        decoded = decode_json(data)
+        if decoded is None:
+            raise ValueError("Unknown JSON packet type")
+        return decoded[1]
+
+class BinaryCodec(PacketCodec):
+    """
+    Fixed-layout binary encoding.
+
+    Header (8 bytes, little endian):
+      magic(2s) version(B) kind(B) flags(B) reserved(B) length(H)
+    With FLAG_SEQUENCE set, an envelope seq(I) ts_ms(I) follows the header and the body
+    starts after it (length counts the body only). The body layout is determined by kind. Strings are encoded as u8 length + UTF-8,
+    poses as frame_type string + 6 x float32 (position xyz, orientation xyz).
+    """
+    name = CODEC_BINARY
+
+    MAGIC = b'HK'
+    VERSION = 1
+    HEADER = struct.Struct('<2sBBBBH')
+    HEADER_SIZE = HEADER.size
+    ENVELOPE = struct.Struct('<II')
+    FLAG_SEQUENCE = 0x01
+
+    KIND_HEARTBEAT_REQUEST = 1
+    KIND_HEARTBEAT_RESPONSE = 2
+    KIND_EVENT_PLAY_START = 3
+    KIND_EVENT_RESET = 4
+    KIND_POSITION = 5
+
+    # kind => UdpComm buffer queue name
+    QUEUE_NAMES: Dict[int, str] = {
+        KIND_HEARTBEAT_REQUEST: "heartbeat_request",
+        KIND_HEARTBEAT_RESPONSE: "heartbeat_response",
+        KIND_EVENT_PLAY_START: "play_start",
+        KIND_EVENT_RESET: "reset",
+        KIND_POSITION: "position",
+    }
+
+    _U8 = struct.Struct('<B')
+    _U16 = struct.Struct('<H')
+    _SPEED = struct.Struct('<2f')
+    _VEC6 = struct.Struct('<6f')
+    # ハートビートのRTT計測用 nonce (u32), ts (u32)
+    _PROBE = struct.Struct('<II')
+
+    @classmethod
+    def is_binary(cls, data: Union[bytes, memoryview]) -> bool:
+        return data[:2] == cls.MAGIC
+
+    @classmethod
+    def body_offset(cls, flags: int) -> int:
+        return cls.HEADER_SIZE + cls.ENVELOPE.size if flags & cls.FLAG_SEQUENCE else cls.HEADER_SIZE
+
+    @classmethod
+    def parse_header(cls, data: bytes) -> Optional[Tuple[int, int, int]]:
+        """
+        Validate the header without touching the body.
+
+        Returns (kind, flags, body_length), or None if the datagram must be dropped
+        (short, unsupported version, unknown kind or truncated body).
+        """
+        if len(data) < cls.HEADER_SIZE:
+            return None
+        magic, version, kind, flags, _, length = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+        if kind not in cls.QUEUE_NAMES:
+            return None
+        if len(data) < cls.body_offset(flags) + length:
+            return None
+        return kind, flags, length
+
+    @classmethod
+    def read_envelope(cls, data: Union[bytes, memoryview]) -> Optional[Tuple[int, int]]:
+        if len(data) < cls.HEADER_SIZE + cls.ENVELOPE.size or not data[4] & cls.FLAG_SEQUENCE:
+            return None
+        return cls.ENVELOPE.unpack_from(data, cls.HEADER_SIZE)
+
+    @classmethod
+    def peek_queue_name(cls, data: Union[bytes, memoryview]) -> Optional[str]:
+        """Queue name from the header kind, without decoding the body."""
+        return cls.QUEUE_NAMES.get(data[3]) if len(data) >= cls.HEADER_SIZE else None
+
+    def encode_body(self, packet: BasePacket) -> bytes:
+        body = bytearray()
+        if isinstance(packet, PositioningRequest):
+            kind = self.KIND_POSITION
+            self._pack_vec_pose(body, packet.frame_type, packet.position, packet.orientation)
+        elif isinstance(packet, HeartBeatResponse):
+            kind = self.KIND_HEARTBEAT_RESPONSE
+            self._pack_str(body, packet.status)
+            self._pack_trailer(body, packet.device_id, packet.nonce, packet.ts)
+        elif isinstance(packet, EventRequest):
+            kind = self.KIND_EVENT_PLAY_START if packet.event_type == "play_start" else self.KIND_EVENT_RESET
+        elif isinstance(packet, HeartBeatRequest):
+            kind = self.KIND_HEARTBEAT_REQUEST
+            self._pack_heartbeat_request(body, packet)
+        else:
+            raise ValueError(f"Packet is not supported by binary codec: {type(packet).__name__}")
+        return bytes(self.HEADER.pack(self.MAGIC, self.VERSION, kind, 0, 0, len(body)) + body)
+
+    def append_probe(self, raw: bytes, packet: HeartBeatRequest) -> bytes:
+        # プローブはトレーラーの最後 ([device_id [nonce ts]])。device_idが無ければ空文字列を置く
+        probe = self._PROBE.pack(packet.nonce & 0xFFFFFFFF, (packet.ts or 0) & 0xFFFFFFFF)
+        if not packet.device_id:
+            probe = self._U8.pack(0) + probe
+        _, _, kind, flags, _, length = self.HEADER.unpack_from(raw, 0)
+        return b''.join((
+            self.HEADER.pack(self.MAGIC, self.VERSION, kind, flags, 0, length + len(probe)),
+            raw[self.HEADER_SIZE:],
+            probe,
+        ))
+
+    def encode_sequenced(self, packet: BasePacket, seq: int, ts: int) -> bytes:
+        raw = self.encode(packet)
+        _, _, kind, flags, _, length = self.HEADER.unpack_from(raw, 0)
+        return b''.join((
+            self.HEADER.pack(self.MAGIC, self.VERSION, kind, flags | self.FLAG_SEQUENCE, 0, length),
+            self.ENVELOPE.pack(seq, ts),
+            raw[self.HEADER_SIZE:],
+        ))
+
+    def decode(self, data: bytes) -> BasePacket:
+        header = self.parse_header(data)
+        if header is None:
+            raise ValueError("Invalid binary packet header")
+        offset = self.body_offset(header[1])
+        return self.decode_body(header[0], data, offset, offset + header[2])
+
+    def decode_body(self, kind: int, data: bytes, offset: int, end: int) -> BasePacket:
+        """Decode the body in data[offset:end]. Trailing optional fields are read only if present."""
+        try:
+            if kind == self.KIND_POSITION:
+                frame_type, offset = self._unpack_str(data, offset)
+                px, py, pz, ox, oy, oz = self._VEC6.unpack_from(data, offset)
+                return PositioningRequest(frame_type, Vec3(px, py, pz), Vec3(ox, oy, oz))
+            elif kind == self.KIND_HEARTBEAT_RESPONSE:
+                status, offset = self._unpack_str(data, offset)
+                device_id, nonce, ts = self._unpack_trailer(data, offset, end)
+                return HeartBeatResponse(status=status, device_id=device_id, nonce=nonce, ts=ts)
+            elif kind == self.KIND_EVENT_PLAY_START:
+                return EventRequest("play_start")
+            elif kind == self.KIND_EVENT_RESET:
+                return EventRequest("reset")
+            elif kind == self.KIND_HEARTBEAT_REQUEST:
+                return self._unpack_heartbeat_request(data, offset, end)
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid binary packet body: {e}")
+        raise ValueError(f"Unknown binary packet kind: {kind}")
+
+    def _pack_str(self, buf: bytearray, value: str):
+        raw = (value or "").encode('utf-8')
+        if len(raw) > 255:
+            raise ValueError(f"String too long for binary codec: {value[:16]}...")
+        buf += self._U8.pack(len(raw))
+        buf += raw
+
+    def _unpack_str(self, data: bytes, offset: int) -> Tuple[str, int]:
+        (length,) = self._U8.unpack_from(data, offset)
+        offset += 1
+        raw = data[offset:offset + length]
+        if len(raw) != length:
+            raise struct.error("string exceeds packet length")
+        return bytes(raw).decode('utf-8'), offset + length
+
+    def _pack_pose(self, buf: bytearray, pose: dict):
+        self._pack_vec_pose(buf, pose.get("frame_type", "unity"), Vec3.of(pose["position"]), Vec3.of(pose["orientation"]))
+
+    def _pack_vec_pose(self, buf: bytearray, frame_type: str, position: Vec3, orientation: Vec3):
+        self._pack_str(buf, frame_type)
+        buf += self._VEC6.pack(position.x, position.y, position.z, orientation.x, orientation.y, orientation.z)
+
+    def _unpack_pose(self, data: bytes, offset: int) -> Tuple[dict, int]:
+        frame_type, offset = self._unpack_str(data, offset)
+        px, py, pz, ox, oy, oz = self._VEC6.unpack_from(data, offset)
+        pose = {
+            "frame_type": frame_type,
+            "position": {"x": px, "y": py, "z": pz},
+            "orientation": {"x": ox, "y": oy, "z": oz}
+        }
+        return pose, offset + self._VEC6.size
+
+    def _pack_actor(self, buf: bytearray, actor: Optional[dict]):
+        actor = actor or {}
+        self._pack_str(buf, actor.get("type", ""))
+        self._pack_str(buf, actor.get("name", ""))
+
+    def _unpack_actor(self, data: bytes, offset: int) -> Tuple[dict, int]:
+        actor_type, offset = self._unpack_str(data, offset)
+        name, offset = self._unpack_str(data, offset)
+        return {"type": actor_type, "name": name}, offset
+
+    def _pack_heartbeat_request(self, buf: bytearray, packet: HeartBeatRequest):
+        speed = packet.positioning_speed or {}
+        avatars = packet.avatars or []
+        if len(avatars) > 255:
+            raise ValueError("Too many avatars for binary codec")
+        self._pack_str(buf, packet.ip_address)
+        buf += self._U16.pack(packet.server_udp_port)
+        buf += self._SPEED.pack(speed.get("rotation", 0.0), speed.get("move", 0.0))
+        self._pack_pose(buf, packet.saved_position)
+        self._pack_actor(buf, packet.player)
+        buf += self._U8.pack(len(avatars))
+        for avatar in avatars:
+            self._pack_actor(buf, avatar)
+        # プローブはappend_probeで付ける
+        self._pack_trailer(buf, packet.device_id, None, None)
+
+    def _pack_trailer(self, buf: bytearray, device_id: Optional[str], nonce: Optional[int], ts: Optional[int]):
+        """Optional heartbeat fields: [device_id [nonce ts]]. device_id is written empty if only the probe is set."""
+        if nonce is not None:
+            self._pack_str(buf, device_id)
+            buf += self._PROBE.pack(nonce & 0xFFFFFFFF, (ts or 0) & 0xFFFFFFFF)
+        elif device_id:
+            self._pack_str(buf, device_id)
+
+    def _unpack_trailer(self, data: bytes, offset: int, end: int) -> Tuple[Optional[str], Optional[int], Optional[int]]:
+        device_id = nonce = ts = None
+        if offset < end:
+            device_id, offset = self._unpack_str(data, offset)
+            device_id = device_id or None
+        if offset < end:
+            nonce, ts = self._PROBE.unpack_from(data, offset)
+        return device_id, nonce, ts
+
+    def _unpack_heartbeat_request(self, data: bytes, offset: int, end: int) -> HeartBeatRequest:
+        ip_address, offset = self._unpack_str(data, offset)
+        (server_udp_port,) = self._U16.unpack_from(data, offset)
+        offset += self._U16.size
+        rotation, move = self._SPEED.unpack_from(data, offset)
+        offset += self._SPEED.size
+        saved_position, offset = self._unpack_pose(data, offset)
+        player, offset = self._unpack_actor(data, offset)
+        (avatar_count,) = self._U8.unpack_from(data, offset)
+        offset += 1
+        avatars: List[dict] = []
+        for _ in range(avatar_count):
+            avatar, offset = self._unpack_actor(data, offset)
+            avatars.append(avatar)
+        device_id, nonce, ts = self._unpack_trailer(data, offset, end)
+        return HeartBeatRequest(
+            ip_address=ip_address,
+            server_udp_port=server_udp_port,
+            positioning_speed={"rotation": rotation, "move": move},
+            saved_position=saved_position,
+            player=player,
+            avatars=avatars,
+            codecs=[CODEC_BINARY, CODEC_JSON],
+            device_id=device_id,
+            nonce=nonce,
+            ts=ts
+        )
+
+# codec name => codec instance (codecs are stateless)
+CODECS = {
+    CODEC_JSON: JsonCodec(),
+    CODEC_BINARY: BinaryCodec(),
+}
+
+def decode_datagram(data: Union[bytes, memoryview]) -> Optional[Tuple[str, BasePacket, bool]]:
+    """
+    Decode a received datagram in whichever codec it was sent.
+
+    Binary datagrams are decoded straight from the (possibly reused) receive buffer;
+    JSON needs one copy since json.loads does not accept a memoryview.
+
+    Returns (queue_name, packet, received_binary), or None if the datagram must be dropped
+    (binary header rejected or unknown packet type). Malformed bodies raise ValueError.
+    """
+    if BinaryCodec.is_binary(data):
+        # ヘッダだけで振り分け/破棄を判断し、ボディは必要な場合のみデコードする
+        header = BinaryCodec.parse_header(data)
+        if header is None:
+            return None
+        kind, flags, length = header
+        offset = BinaryCodec.body_offset(flags)
+        packet = _BINARY.decode_body(kind, data, offset, offset + length)
+        return BinaryCodec.QUEUE_NAMES[kind], packet, True
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    decoded = decode_json(data)
+    if decoded is None:
+        return None
+    return decoded[0], decoded[1], False
+
+def read_envelope(data: Union[bytes, memoryview]) -> Optional[Tuple[int, int]]:
+    """(seq, ts_ms) of a sequenced datagram, read without decoding the body; None if absent."""
+    if BinaryCodec.is_binary(data):
+        return BinaryCodec.read_envelope(data)
+    return JsonCodec.read_envelope(data)
+
+_BINARY: BinaryCodec = CODECS[CODEC_BINARY]
@@ -0,0 +1,137 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_PHI_THRESHOLD = 8.0
+DEFAULT_SUSPECT_THRESHOLD = 3.0
+DEFAULT_WINDOW = 100
+DEFAULT_MIN_STD_SEC = 0.1
+DEFAULT_ACCEPTABLE_PAUSE_SEC = 0.25
+
+LIVENESS_ALIVE = "ALIVE"
+LIVENESS_SUSPECT = "SUSPECT"
+LIVENESS_DEAD = "DEAD"
+
+# phiの上限 (exp/logが発散しないように丸める)
+MAX_PHI = 100.0
+
+class PhiAccrualDetector:
+    """
+    Phi-accrual failure detector (Hayashibara et al.) for one AR device.
+
+    heartbeat() records the arrival of a HeartBeatResponse. The intervals between arrivals
+    (the last `window` of them) give a normal distribution, and phi(elapsed) is
+    -log10(P(next arrival is later than elapsed)): phi = 1 means a 10% chance that the peer
+    is still alive, 3 about 0.1%, 8 about 1e-8. A clean link has a narrow distribution, so
+    phi rises soon after a missed heartbeat. On a jittery link the distribution widens and
+    phi rises more slowly, without flapping.
+
+    min_std_sec keeps the distribution from collapsing on a perfectly regular link, and
+    acceptable_pause_sec is added to the expected interval as a margin. Before the first
+    interval is known, the distribution is seeded from first_interval_sec (the heartbeat
+    interval).
+
+    heartbeat() runs on the receive path and phi() on the scheduler, so the state is
+    guarded by a lock.
+    """
+    def __init__(self, threshold: float = DEFAULT_PHI_THRESHOLD, suspect_threshold: float = DEFAULT_SUSPECT_THRESHOLD,
+                 window: int = DEFAULT_WINDOW, min_std_sec: float = DEFAULT_MIN_STD_SEC,
+                 acceptable_pause_sec: float = DEFAULT_ACCEPTABLE_PAUSE_SEC, first_interval_sec: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if suspect_threshold > threshold:
+            raise ValueError(f"suspect_threshold ({suspect_threshold}) must not exceed threshold ({threshold})")
+        self.threshold = threshold
+        self.suspect_threshold = suspect_threshold
+        self.min_std_sec = min_std_sec
+        self.acceptable_pause_sec = acceptable_pause_sec
+        self.first_interval_sec = first_interval_sec
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.intervals = deque(maxlen=max(window, 1))
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]], heartbeat_interval_sec: float) -> Optional['PhiAccrualDetector']:
+        """Build from the "failure_detector" config section (None when "enabled" is false)."""
+        config = config or {}
+        if not config.get("enabled", True):
+            return None
+        return cls(config.get("threshold", DEFAULT_PHI_THRESHOLD), config.get("suspect_threshold", DEFAULT_SUSPECT_THRESHOLD),
+                   config.get("window", DEFAULT_WINDOW), config.get("min_std_sec", DEFAULT_MIN_STD_SEC),
+                   config.get("acceptable_pause_sec", DEFAULT_ACCEPTABLE_PAUSE_SEC), heartbeat_interval_sec)
+
+    def reset(self):
+        """Forget the arrival history."""
+        with self.lock:
+            self.intervals.clear()
+            # 区間の合計と二乗和を保持し、平均と分散をO(1)で求める
+            self.total = 0.0
+            self.total_sq = 0.0
+            self.last_arrival: Optional[float] = None
+            self.heartbeats = 0
+
+    def suspend(self):
+        """Forget the last arrival (after a disconnect, so the gap is not counted as an interval)."""
+        with self.lock:
+            self.last_arrival = None
+
+    def heartbeat(self):
+        now = self.clock()
+        with self.lock:
+            if self.last_arrival is not None:
+                interval = now - self.last_arrival
+                if len(self.intervals) == self.intervals.maxlen:
+                    oldest = self.intervals[0]
+                    self.total -= oldest
+                    self.total_sq -= oldest * oldest
+                self.intervals.append(interval)
+                self.total += interval
+                self.total_sq += interval * interval
+            self.last_arrival = now
+            self.heartbeats += 1
+
+    def _distribution(self):
+        # self.lockを保持して呼ぶこと
+        count = len(self.intervals)
+        if count == 0:
+            mean = self.first_interval_sec
+            std = mean / 4.0
+        else:
+            mean = self.total / count
+            std = math.sqrt(max(self.total_sq / count - mean * mean, 0.0))
+        return mean, max(std, self.min_std_sec)
+
+    def phi(self, elapsed_sec: float) -> float:
+        """Suspicion level after elapsed_sec without hearing from the peer."""
+        with self.lock:
+            mean, std = self._distribution()
+        y = (elapsed_sec - mean - self.acceptable_pause_sec) / std
+        # 正規分布の累積分布関数のロジスティック近似
+        exponent = -y * (1.5976 + 0.070566 * y * y)
+        if exponent > 700.0:
+            return 0.0
+        if exponent < -700.0:
+            return MAX_PHI
+        e = math.exp(exponent)
+        if y > 0:
+            p_later = e / (1.0 + e)
+        else:
+            p_later = 1.0 - 1.0 / (1.0 + e)
+        if p_later <= 0.0:
+            return MAX_PHI
+        return min(-math.log10(p_later), MAX_PHI)
+
+    def level(self, phi: float) -> str:
+        if phi >= self.threshold:
+            return LIVENESS_DEAD
+        if phi >= self.suspect_threshold:
+            return LIVENESS_SUSPECT
+        return LIVENESS_ALIVE
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            mean, std = self._distribution()
+            return {"samples": len(self.intervals), "heartbeats": self.heartbeats, "mean_ms": mean * 1000.0, "std_ms": std * 1000.0,
+                    "threshold": self.threshold, "suspect_threshold": self.suspect_threshold}
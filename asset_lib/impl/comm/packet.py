@@ -1,59 +1,88 @@
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Callable, Union
+
+class Vec3:
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x: float = 0.0, y: float = 0.0, z: float = 0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @classmethod
+    def of(cls, value: Union['Vec3', Dict[str, float]]) -> 'Vec3':
+        """Create a Vec3 from a Vec3 or a {"x", "y", "z"} dictionary."""
+        if isinstance(value, Vec3):
+            return value
+        return cls(float(value["x"]), float(value["y"]), float(value["z"]))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"x": self.x, "y": self.y, "z": self.z}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Vec3) and self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __repr__(self) -> str:
+        return f"Vec3({self.x}, {self.y}, {self.z})"
 
 class BasePacket:
+    """
+    Packets cache their encoded bytes per codec (see codec.PacketCodec.encode), so a packet
+    that is sent repeatedly is serialized only once. Fields must therefore be changed through
+    the packet's setters, or invalidate() must be called after changing them directly.
+    """
+    __slots__ = ('type', 'data_type', 'event_type', '_data', '_wire')
+
     def __init__(self, packet_type: str, data_type: Optional[str] = None,
                  event_type: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
         self.type = packet_type       # "data" or "event"
         self.data_type = data_type    # Only required if type is "data"
         self.event_type = event_type  # Only required if type is "event"
-        self.data = data              # Additional data (only if type is "data")
+        self._data = data             # Additional data (only if type is "data")
+        self._wire: Dict[str, bytes] = {}  # codec name => encoded bytes
+
+    @property
+    def data(self) -> Optional[Dict[str, Any]]:
+        return self._data
+
+    def invalidate(self) -> None:
+        """Drop the cached encodings. Encoders holding the old cache keep writing into it harmlessly."""
+        self._wire = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert packet to the wire dictionary."""
+        return {
+            "type": self.type,
+            "data_type": self.data_type,
+            "event_type": self.event_type,
+            "data": self.data
+        }
 
     def to_json(self) -> str:
         """Convert packet to JSON string."""
-        return json.dumps(self.__dict__)
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_str: str) -> 'BasePacket':
         """Parse JSON string and create a packet instance based on data_type or event_type."""
         try:
             data = json.loads(json_str)
-            packet_type = data.get("type")
-            data_type = data.get("data_type")
-            event_type = data.get("event_type")
-            packet_data = data.get("data", {})
-
-            if data_type == "heartbeat_request":
-                return HeartBeatRequest(
-                    ip_address=packet_data["ip_address"],
-                    server_udp_port=packet_data["server_udp_port"],
-                    positioning_speed=packet_data["positioning_speed"],
-                    saved_position=packet_data["saved_position"],
-                    player=packet_data.get("player"),
-                    avatars=packet_data.get("avatars", [])
-                )
-            elif data_type == "heartbeat_response":
-                return HeartBeatResponse(status=packet_data["status"])
-            elif data_type == "position":
-                return PositioningRequest(
-                    frame_type=packet_data["frame_type"],
-                    position=packet_data["position"],
-                    orientation=packet_data["orientation"]
-                )
-            elif event_type in ["play_start", "reset"]:
-                return EventRequest(event_type=event_type)
-            else:
-                # デフォルトでBasePacketを返す
-                return cls(
-                    packet_type=packet_type,
-                    data_type=data_type,
-                    event_type=event_type,
-                    data=packet_data
-                )
-        except (json.JSONDecodeError, KeyError) as e:
+        except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON data for BasePacket: {e}")
+        decoded = decode_dict(data)
+        if decoded is not None:
+            return decoded[1]
+        # デフォルトでBasePacketを返す
+        return cls(
+            packet_type=data.get("type"),
+            data_type=data.get("data_type"),
+            event_type=data.get("event_type"),
+            data=data.get("data", {})
+        )
 
 class HeartBeatRequest(BasePacket):
+    __slots__ = ('ip_address', 'server_udp_port', 'positioning_speed', 'saved_position', 'player', 'avatars', 'codecs', 'device_id', 'nonce', 'ts')
+
     def __init__(
         self,
         ip_address: str,
@@ -61,7 +90,11 @@ class HeartBeatRequest(BasePacket):
         positioning_speed,
         saved_position,
         player: dict,
-        avatars: list
+        avatars: list,
+        codecs: Optional[List[str]] = None,
+        device_id: Optional[str] = None,
+        nonce: Optional[int] = None,
+        ts: Optional[int] = None
     ):
         """
         HeartBeatRequestの初期化
@@ -72,35 +105,172 @@ class HeartBeatRequest(BasePacket):
         :param saved_position: 保存された位置情報
         :param player: プレイヤー情報 (辞書形式: {"type": str, "name": str})
         :param avatars: アバター情報のリスト (例: [{"type": str, "name": str}, ...])
+        :param codecs: 送信側が受信可能なコーデック (例: ["binary", "json"])。古いARアプリは無視する
+        :param device_id: ARデバイスの識別子。ARアプリはHeartBeatResponseで返す (共有ソケットでの振り分けに使用)
+        :param nonce: RTT計測用のノンス (u32)。ARアプリはHeartBeatResponseでtsと共にすぐに返す
+        :param ts: ブリッジの送信時刻 (ms, u32)
         """
         super().__init__(packet_type="data", data_type="heartbeat_request")
-        self.data = {
-            "ip_address": ip_address,
-            "server_udp_port": server_udp_port,
-            "positioning_speed": positioning_speed,
-            "saved_position": saved_position,
-            "player": player,
-            "avatars": avatars,
+        self.ip_address = ip_address
+        self.server_udp_port = server_udp_port
+        self.positioning_speed = positioning_speed
+        self.saved_position = saved_position
+        self.player = player
+        self.avatars = avatars
+        self.codecs = list(codecs) if codecs else None
+        self.device_id = device_id
+        self.nonce = nonce
+        self.ts = ts
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        data = self.body_data()
+        if self.nonce is not None:
+            data["nonce"] = self.nonce
+            data["ts"] = self.ts
+        return data
+
+    def body_data(self) -> Dict[str, Any]:
+        """data without the RTT probe (nonce/ts), i.e. the part the codecs cache."""
+        data = {
+            "ip_address": self.ip_address,
+            "server_udp_port": self.server_udp_port,
+            "positioning_speed": self.positioning_speed,
+            "saved_position": self.saved_position,
+            "player": self.player,
+            "avatars": self.avatars,
         }
+        if self.codecs:
+            data["codecs"] = self.codecs
+        if self.device_id:
+            data["device_id"] = self.device_id
+        return data
+
+    def body_json(self) -> str:
+        """to_json() without the RTT probe."""
+        return json.dumps(dict(self.to_dict(), data=self.body_data()))
+
+    def set_probe(self, nonce: int, ts: int) -> None:
+        # プローブは送信ごとに変わるのでキャッシュ済みのエンコードには含めず、codecが末尾に付ける
+        self.nonce = nonce
+        self.ts = ts
+
+    def set_saved_position(self, saved_position) -> None:
+        if saved_position != self.saved_position:
+            self.saved_position = saved_position
+            self.invalidate()
 
 class HeartBeatResponse(BasePacket):
-    def __init__(self, status: str):
+    __slots__ = ('status', 'codecs', 'device_id', 'nonce', 'ts')
+
+    def __init__(self, status: str, codecs: Optional[List[str]] = None, device_id: Optional[str] = None,
+                 nonce: Optional[int] = None, ts: Optional[int] = None):
         super().__init__(packet_type="data", data_type="heartbeat_response")
-        self.data = {
-            "status": status
+        self.status = status
+        self.codecs = list(codecs) if codecs else None
+        self.device_id = device_id
+        # HeartBeatRequestのnonce/tsをそのまま返す (RTT計測用)
+        self.nonce = nonce
+        self.ts = ts
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        data = {
+            "status": self.status
         }
+        if self.codecs:
+            data["codecs"] = self.codecs
+        if self.device_id:
+            data["device_id"] = self.device_id
+        if self.nonce is not None:
+            data["nonce"] = self.nonce
+            data["ts"] = self.ts
+        return data
 
 class EventRequest(BasePacket):
+    __slots__ = ()
+
     def __init__(self, event_type: str):
         if event_type not in ["play_start", "reset"]:
             raise ValueError("Invalid event type. Expected 'play_start' or 'reset'.")
         super().__init__(packet_type="event", event_type=event_type)
 
 class PositioningRequest(BasePacket):
-    def __init__(self, frame_type: str, position: Dict[str, float], orientation: Dict[str, float]):
+    __slots__ = ('frame_type', 'position', 'orientation')
+
+    def __init__(self, frame_type: str, position: Union[Vec3, Dict[str, float]], orientation: Union[Vec3, Dict[str, float]]):
         super().__init__(packet_type="data", data_type="position")
-        self.data = {
-            "frame_type": frame_type,
-            "position": position,
-            "orientation": orientation
+        self.frame_type = frame_type
+        self.position = Vec3.of(position)
+        self.orientation = Vec3.of(orientation)
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        return {
+            "frame_type": self.frame_type,
+            "position": self.position.to_dict(),
+            "orientation": self.orientation.to_dict()
         }
+
+def _decode_heartbeat_request(data: Dict[str, Any]) -> HeartBeatRequest:
+    return HeartBeatRequest(
+        ip_address=data["ip_address"],
+        server_udp_port=data["server_udp_port"],
+        positioning_speed=data["positioning_speed"],
+        saved_position=data["saved_position"],
+        player=data.get("player"),
+        avatars=data.get("avatars", []),
+        codecs=data.get("codecs"),
+        device_id=data.get("device_id"),
+        nonce=data.get("nonce"),
+        ts=data.get("ts")
+    )
+
+def _decode_heartbeat_response(data: Dict[str, Any]) -> HeartBeatResponse:
+    return HeartBeatResponse(status=data["status"], codecs=data.get("codecs"), device_id=data.get("device_id"),
+                             nonce=data.get("nonce"), ts=data.get("ts"))
+
+def _decode_position(data: Dict[str, Any]) -> PositioningRequest:
+    return PositioningRequest(
+        frame_type=data["frame_type"],
+        position=data["position"],
+        orientation=data["orientation"]
+    )
+
+# (type, data_type/event_type) => decoder(data)
+PACKET_DECODERS: Dict[Tuple[str, str], Callable[[Dict[str, Any]], BasePacket]] = {
+    ("data", "heartbeat_request"): _decode_heartbeat_request,
+    ("data", "heartbeat_response"): _decode_heartbeat_response,
+    ("data", "position"): _decode_position,
+    ("event", "play_start"): lambda _: EventRequest("play_start"),
+    ("event", "reset"): lambda _: EventRequest("reset"),
+}
+
+# 受信キュー名 (= data_type/event_type) の一覧。メトリクスのカウンタを事前に確保するのに使う
+PACKET_TYPES: Tuple[str, ...] = tuple(key for _, key in PACKET_DECODERS)
+
+def decode_dict(obj: Dict[str, Any]) -> Optional[Tuple[str, BasePacket]]:
+    """
+    Build a typed packet from an already parsed JSON object.
+
+    Returns (queue_name, packet), or None if the packet type is unknown.
+    """
+    packet_type = obj.get("type")
+    key = obj.get("data_type") if packet_type == "data" else obj.get("event_type")
+    decoder = PACKET_DECODERS.get((packet_type, key))
+    if decoder is None:
+        return None
+    try:
+        return key, decoder(obj.get("data") or {})
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid JSON data for {key}: {e}")
+
+def decode_json(raw: Union[str, bytes]) -> Optional[Tuple[str, BasePacket]]:
+    """Parse a JSON datagram once and build a typed packet (see decode_dict)."""
+    try:
+        obj = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid JSON data for BasePacket: {e}")
+    if not isinstance(obj, dict):
+        raise ValueError("Invalid JSON data for BasePacket: not an object")
+    return decode_dict(obj)
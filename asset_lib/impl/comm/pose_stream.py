@@ -0,0 +1,145 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from asset_lib.impl.comm.packet import PositioningRequest, Vec3
+from asset_lib.impl.comm.udp_comm import UdpComm
+from asset_lib.impl.scheduler import Job, TimerWheel
+
+DEFAULT_POSITION_DEADBAND = 0.001   # [m]
+DEFAULT_ROTATION_DEADBAND = 0.1     # [deg]
+DEFAULT_MAX_RATE_HZ = 30.0
+DEFAULT_KEYFRAME_INTERVAL_SEC = 1.0
+
+class PoseStream:
+    """
+    Send-on-change stage between a pose source and UdpComm (one stream per peer).
+
+    update() may be called at any rate with the current pose. A PositioningRequest is
+    sent only when the pose moved beyond the dead-band since the last sent pose, and at
+    most max_rate_hz times per second. A keyframe is sent every keyframe_interval_sec
+    even without motion, so a lost packet cannot leave the headset stale.
+
+    After start(scheduler), a pose held back by the rate limit is sent by the scheduler
+    once min_interval_sec has passed, so the final pose of a motion is not delayed until
+    the next update().
+    """
+    def __init__(self, udp_service: UdpComm,
+                 position_deadband: float = DEFAULT_POSITION_DEADBAND,
+                 rotation_deadband: float = DEFAULT_ROTATION_DEADBAND,
+                 max_rate_hz: float = DEFAULT_MAX_RATE_HZ,
+                 keyframe_interval_sec: float = DEFAULT_KEYFRAME_INTERVAL_SEC,
+                 frame_type: str = "unity",
+                 clock: Callable[[], float] = time.monotonic):
+        self.udp_service = udp_service
+        self.position_deadband = position_deadband
+        self.rotation_deadband = rotation_deadband
+        self.min_interval_sec = 1.0 / max_rate_hz if max_rate_hz > 0 else 0.0
+        self.keyframe_interval_sec = keyframe_interval_sec
+        self.frame_type = frame_type
+        self.clock = clock
+        self.last_position: Optional[Vec3] = None
+        self.last_orientation: Optional[Vec3] = None
+        self.last_send_time = 0.0
+        # update()は入力スレッド、flush()はスケジューラから呼ばれる
+        self.lock = threading.Lock()
+        self.scheduler: Optional[TimerWheel] = None
+        self.flush_job: Optional[Job] = None
+        # レート制限で送らなかった最新の姿勢
+        self.pending: Optional[Tuple[Vec3, Vec3]] = None
+        self.sent = 0
+        self.keyframes = 0
+        self.suppressed = 0
+        self.flushed = 0
+
+    @classmethod
+    def from_config(cls, udp_service: UdpComm, config: Optional[Dict[str, Any]]) -> 'PoseStream':
+        config = config or {}
+        return cls(udp_service,
+                   position_deadband=config.get("position_deadband", DEFAULT_POSITION_DEADBAND),
+                   rotation_deadband=config.get("rotation_deadband", DEFAULT_ROTATION_DEADBAND),
+                   max_rate_hz=config.get("max_rate_hz", DEFAULT_MAX_RATE_HZ),
+                   keyframe_interval_sec=config.get("keyframe_interval_sec", DEFAULT_KEYFRAME_INTERVAL_SEC))
+
+    def start(self, scheduler: TimerWheel) -> None:
+        """Send poses held back by the rate limit from scheduler."""
+        with self.lock:
+            self.scheduler = scheduler
+
+    def stop(self) -> None:
+        with self.lock:
+            self._drop_pending()
+            self.scheduler = None
+
+    def reset(self):
+        """Forget the last sent pose so the next update is sent immediately."""
+        with self.lock:
+            self._drop_pending()
+            self.last_position = None
+            self.last_orientation = None
+
+    def update(self, position: Union[Vec3, Dict[str, float]], orientation: Union[Vec3, Dict[str, float]]) -> bool:
+        """Offer the current pose. Returns True if a packet was sent."""
+        position = Vec3.of(position)
+        orientation = Vec3.of(orientation)
+        now = self.clock()
+        with self.lock:
+            if self.last_position is not None:
+                elapsed = now - self.last_send_time
+                if elapsed < self.min_interval_sec:
+                    self.suppressed += 1
+                    self._defer(position, orientation, self.min_interval_sec - elapsed)
+                    return False
+                if not self.moved(position, orientation):
+                    if elapsed < self.keyframe_interval_sec:
+                        self.suppressed += 1
+                        return False
+                    self.keyframes += 1
+            self._send(position, orientation, now)
+            return True
+
+    def flush(self) -> bool:
+        """Send the pose held back by the rate limit, if it moved (run by the scheduler)."""
+        with self.lock:
+            self.flush_job = None
+            pending = self.pending
+            if pending is None or self.last_position is None or not self.moved(*pending):
+                self.pending = None
+                return False
+            self.flushed += 1
+            self._send(pending[0], pending[1], self.clock())
+            return True
+
+    def _defer(self, position: Vec3, orientation: Vec3, delay_sec: float):
+        # self.lockを保持して呼ぶこと
+        if self.scheduler is None:
+            return
+        self.pending = (position, orientation)
+        if self.flush_job is None:
+            self.flush_job = self.scheduler.call_later(delay_sec, self.flush, name="pose_flush")
+
+    def _drop_pending(self):
+        # self.lockを保持して呼ぶこと
+        self.pending = None
+        if self.flush_job is not None:
+            self.scheduler.cancel(self.flush_job)
+            self.flush_job = None
+
+    def _send(self, position: Vec3, orientation: Vec3, now: float):
+        # self.lockを保持して呼ぶこと
+        self._drop_pending()
+        self.udp_service.send_packet(PositioningRequest(self.frame_type, position, orientation))
+        self.last_position = position
+        self.last_orientation = orientation
+        self.last_send_time = now
+        self.sent += 1
+
+    def moved(self, position: Vec3, orientation: Vec3) -> bool:
+        last_p = self.last_position
+        last_o = self.last_orientation
+        pd = self.position_deadband
+        rd = self.rotation_deadband
+        return (abs(position.x - last_p.x) > pd or abs(position.y - last_p.y) > pd or abs(position.z - last_p.z) > pd
+                or abs(orientation.x - last_o.x) > rd or abs(orientation.y - last_o.y) > rd or abs(orientation.z - last_o.z) > rd)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "keyframes": self.keyframes, "suppressed": self.suppressed, "flushed": self.flushed}
@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+from asset_lib.impl.comm.sequence import SERIAL_MOD, monotonic_ms
+
+DEFAULT_RTT_WINDOW = 256
+
+class RttTracker:
+    """
+    Heartbeat round-trip times of one peer.
+
+    probe() returns the (nonce, ts) to put into the next HeartBeatRequest and remembers when
+    it was sent; echo() matches the nonce the peer returned in its HeartBeatResponse. The
+    last `window` samples are kept for min/p50/p99/max, and jitter is the smoothed mean
+    difference between consecutive samples (as in RFC 3550).
+
+    probe() runs on the heartbeat thread/timer, echo() on the receive path and stats() on
+    the status side, so the state is guarded by a lock.
+    """
+    # 応答待ちのノンス数。これを超えて応答のないものは失われたものとして数える
+    MAX_OUTSTANDING = 8
+
+    def __init__(self, window: Optional[int] = None):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window or DEFAULT_RTT_WINDOW)
+        self.outstanding: 'OrderedDict[int, float]' = OrderedDict()
+        # 再起動前のノンスと衝突しないよう乱数から始める
+        self.next_nonce = random.getrandbits(32)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.outstanding.clear()
+            self.last_ms: Optional[float] = None
+            self.jitter_ms = 0.0
+            self.probes = 0
+            self.lost = 0
+            self.unmatched = 0
+
+    def probe(self) -> Tuple[int, int]:
+        """Nonce and send timestamp (ms, u32) for the next heartbeat request."""
+        with self.lock:
+            nonce = self.next_nonce
+            self.next_nonce = (nonce + 1) % SERIAL_MOD
+            self.outstanding[nonce] = time.perf_counter()
+            self.probes += 1
+            if len(self.outstanding) > self.MAX_OUTSTANDING:
+                self.outstanding.popitem(last=False)
+                self.lost += 1
+        return nonce, monotonic_ms()
+
+    def echo(self, nonce: int) -> Optional[float]:
+        """Record the echo of a probe. Returns the RTT in ms, or None for an unknown nonce."""
+        now = time.perf_counter()
+        with self.lock:
+            sent = self.outstanding.pop(nonce, None)
+            if sent is None:
+                # 重複した応答や、失われたと数えた後に届いた応答
+                self.unmatched += 1
+                return None
+            rtt_ms = (now - sent) * 1000.0
+            if self.last_ms is not None:
+                self.jitter_ms += (abs(rtt_ms - self.last_ms) - self.jitter_ms) / 16.0
+            self.last_ms = rtt_ms
+            self.samples.append(rtt_ms)
+            return rtt_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            ordered = sorted(self.samples)
+            result = {"samples": len(ordered), "probes": self.probes, "lost": self.lost, "unmatched": self.unmatched}
+            if not ordered:
+                return result
+            result.update({
+                "last_ms": self.last_ms,
+                "min_ms": ordered[0],
+                "p50_ms": ordered[(len(ordered) - 1) // 2],
+                "p99_ms": ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)],
+                "max_ms": ordered[-1],
+                "jitter_ms": self.jitter_ms,
+            })
+            return result
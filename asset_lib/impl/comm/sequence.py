@@ -0,0 +1,112 @@
+import itertools
+import time
+from typing import Any, Dict, Optional
+
+# シーケンス番号とタイムスタンプ(ms)はどちらもu32で周回する
+SERIAL_MOD = 1 << 32
+SERIAL_HALF = 1 << 31
+
+def serial_delta(a: int, b: int) -> int:
+    """a - b for u32 counters that wrap around (RFC 1982 serial number arithmetic)."""
+    delta = (a - b) & (SERIAL_MOD - 1)
+    return delta - SERIAL_MOD if delta >= SERIAL_HALF else delta
+
+def monotonic_ms() -> int:
+    """Monotonic send timestamp in milliseconds, truncated to u32."""
+    return int(time.monotonic() * 1000) & (SERIAL_MOD - 1)
+
+class SequenceCounter:
+    """Per-sender sequence numbers (thread-safe: next() on itertools.count is atomic)."""
+    def __init__(self, start: int = 1):
+        self.counter = itertools.count(start)
+
+    def next(self) -> int:
+        return next(self.counter) & (SERIAL_MOD - 1)
+
+class SequenceTracker:
+    """
+    Receive-side sequence state of one peer.
+
+    observe() runs on the envelope alone, before the body is decoded: duplicates are
+    rejected there. accept() then rejects a packet that is older than the last one
+    delivered for the same queue, so a reordered pose never overwrites a newer one, while
+    a late packet of another type (e.g. an event) is still delivered.
+
+    A sequence number that goes back while the send timestamp moves forward means the
+    peer restarted; the tracker then resynchronizes instead of dropping everything.
+    """
+    WINDOW = 64
+
+    def __init__(self):
+        self.last_seq: Optional[int] = None
+        self.last_ts = 0
+        # bit i: last_seq - i を受信済み
+        self.window = 0
+        self.queue_seq: Dict[str, int] = {}
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.restarts = 0
+
+    def resync(self, seq: int, ts: int):
+        self.last_seq = seq
+        self.last_ts = ts
+        self.window = 1
+        self.queue_seq.clear()
+
+    def observe(self, seq: int, ts: int) -> bool:
+        """Record a received envelope. Returns False if the packet is a duplicate."""
+        if self.last_seq is None:
+            self.resync(seq, ts)
+            self.received += 1
+            return True
+        delta = serial_delta(seq, self.last_seq)
+        if delta > 0:
+            self.lost += delta - 1
+            self.window = ((self.window << delta) | 1) & ((1 << self.WINDOW) - 1) if delta < self.WINDOW else 1
+            self.last_seq = seq
+            self.last_ts = ts
+            self.received += 1
+            return True
+        if delta < 0 and serial_delta(ts, self.last_ts) > 0:
+            self.restarts += 1
+            self.resync(seq, ts)
+            self.received += 1
+            return True
+        age = -delta
+        if age < self.WINDOW:
+            if (self.window >> age) & 1:
+                self.duplicates += 1
+                return False
+            self.window |= 1 << age
+        # 欠落として数えていたものが遅れて届いた
+        self.reordered += 1
+        if self.lost > 0:
+            self.lost -= 1
+        self.received += 1
+        return True
+
+    def is_stale(self, queue_name: str, seq: int) -> bool:
+        last = self.queue_seq.get(queue_name)
+        return last is not None and serial_delta(seq, last) <= 0
+
+    def accept(self, queue_name: str, seq: int) -> bool:
+        """Returns False if a newer packet was already delivered for queue_name."""
+        if self.is_stale(queue_name, seq):
+            self.stale += 1
+            return False
+        self.queue_seq[queue_name] = seq
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_seq": self.last_seq,
+            "received": self.received,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "stale": self.stale,
+            "restarts": self.restarts,
+        }
@@ -1,101 +1,354 @@
-import socket
-import json
+import asyncio
 import threading
-from asset_lib.impl.comm.packet import BasePacket, HeartBeatRequest, HeartBeatResponse, EventRequest, PositioningRequest
-from typing import Dict, Optional, Type
-from time import sleep, time
+from asset_lib.impl import log
+from asset_lib.impl.comm.packet import PACKET_TYPES, BasePacket
+from asset_lib.impl.comm.codec import CODECS, CODEC_BINARY, CODEC_JSON, BinaryCodec, decode_datagram, read_envelope
+from asset_lib.impl.comm.rtt import RttTracker
+from asset_lib.impl.comm.sequence import SequenceCounter, SequenceTracker, monotonic_ms
+from asset_lib.impl.comm.udp_socket import UdpSocket
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from time import time
+
+if TYPE_CHECKING:
+    from asset_lib.impl.comm.udp_mux import UdpMux
 
 class UdpComm:
-    def __init__(self, recv_ip: str, recv_port: int, send_ip: Optional[str] = None, send_port: Optional[int] = None):
+    MAX_PEERS = 8
+
+    def __init__(self, recv_ip: str, recv_port: int, send_ip: Optional[str] = None, send_port: Optional[int] = None, codecs: Optional[List[str]] = None,
+                 mux: Optional['UdpMux'] = None, device_id: Optional[str] = None,
+                 recv_buffer_size: Optional[int] = None, so_rcvbuf: Optional[int] = None, recv_batch_size: Optional[int] = None,
+                 sequence: bool = False, rtt_window: Optional[int] = None, peer_timeout_sec: Optional[float] = None):
         self.recv_ip = recv_ip
         self.recv_port = recv_port
         self.send_ip = send_ip if send_ip else recv_ip  # 送信IPが指定されていない場合は受信用のIPを使用
         self.send_port = send_port if send_port else recv_port  # 送信ポートが指定されていない場合は受信用のポートを使用
+        self.send_addr = (self.send_ip, self.send_port)
+        # muxを指定した場合は共有ソケットで送受信し、muxが送信元アドレス/デバイスIDで振り分ける
+        self.mux = mux
+        self.device_id = device_id
+        # 共有ソケットでピアのアドレスを学習し直せるまでの無受信時間 (Noneなら常に学習する)
+        self.peer_timeout_sec = peer_timeout_sec
+        self.logger = log.get_logger("comm", node=device_id)
+        # 受信バッファ設定 (muxを使う場合はmux側の設定が有効)
+        self.recv_buffer_size = recv_buffer_size
+        self.so_rcvbuf = so_rcvbuf
+        self.recv_batch_size = recv_batch_size
 
         self.lock = threading.Lock()
+        self.buffer: Dict[str, Optional[BasePacket]] = {}
+        self.last_recv_time = 0
+        # パケット到着を待つスレッド(wait_for)とイベントループ(wait_for_async)への通知
+        self.arrived = threading.Condition(self.lock)
+        self.async_waiters: List[Tuple[frozenset, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.thread_waiters: List[_ThreadWaiter] = []
+        # 待機中の呼び出し元が無いときのwakeup。次に待ち始めた1つがすぐに戻る
+        self.woken = False
+        self.subscribers: Dict[str, Tuple[Callable[[BasePacket], None], ...]] = {}
 
-        # data_typeに対応するパケットクラスのマッピング
-        self.packet_classes = {
-            "heartbeat_request": HeartBeatRequest,
-            "heartbeat_response": HeartBeatResponse,
-            "event": EventRequest,
-            "position": PositioningRequest
-        }
+        # 受信可能なコーデック(優先順)。JSONは古いARアプリ向けに常にフォールバックとして残す
+        self.supported_codecs = [name for name in (codecs or [CODEC_BINARY, CODEC_JSON]) if name in CODECS]
+        if CODEC_JSON not in self.supported_codecs:
+            self.supported_codecs.append(CODEC_JSON)
+        # 送信コーデックはハートビート応答でピアが対応を示すまでJSON
+        self.codec = CODECS[CODEC_JSON]
+        self.dropped_packets = 0
+        self.unknown_packets = 0
+        self.decode_errors = 0
+        # 種類別の送受信数 (パケット毎に辞書を作らないよう事前に確保する)
+        self.rx_packets: Dict[str, int] = dict.fromkeys(PACKET_TYPES, 0)
+        self.tx_packets: Dict[str, int] = dict.fromkeys(PACKET_TYPES, 0)
+        self.running = False
+        self.endpoint: Optional[UdpSocket] = None
+
+        # sequence=Trueの場合は送信パケットにシーケンス番号と送信時刻を付ける
+        self.sequence = sequence
+        self.send_sequence = SequenceCounter()
+        # 受信側は送信元がエンベロープを付けていれば常に重複/古いパケットを捨てる
+        self.peers: Dict[Optional[Tuple[str, int]], SequenceTracker] = {}
+        # ハートビートのnonceエコーから求めるRTT
+        self.rtt = RttTracker(rtt_window)
 
     def get_port(self):
+        if self.mux is not None:
+            return self.mux.get_port()
         return self.recv_port
 
     def socket_create(self):
-        print(f"Creating socket on {self.recv_ip}:{self.recv_port}")
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        print(f"Binding socket to {self.recv_ip}:{self.recv_port}")
-        self.sock.bind((self.recv_ip, self.recv_port))
-        self.buffer: Dict[str, Optional[BasePacket]] = {}
-        self.last_recv_time = 0
-        print("Socket created.")
+        with self.lock:
+            self.buffer.clear()
+            self.last_recv_time = 0
+        self.peers.clear()
+        self.rtt.reset()
+        if self.mux is not None:
+            self.endpoint = self.mux.attach(self)
+        else:
+            self.endpoint = UdpSocket(self.recv_ip, self.recv_port, self.on_datagram,
+                                      self.recv_buffer_size, self.so_rcvbuf, self.recv_batch_size)
+            self.endpoint.open()
 
     def socket_close(self):
+        if self.mux is not None:
+            self.mux.detach(self)
+        else:
+            self.endpoint.close()
         with self.lock:
-            self.sock.close()
             self.buffer.clear()
 
     def start_receiving(self):
+        """Start receiving (in a separate thread, or on the shared mux thread)."""
+        self.socket_create()
+        if self.mux is not None:
+            self.mux.start_receiving()
+        else:
+            self.endpoint.start_receiving()
+        self.running = True
+
+    async def start_receiving_async(self):
+        """Receive on the running event loop instead of a dedicated thread."""
         self.socket_create()
+        if self.mux is not None:
+            await self.mux.start_receiving_async()
+        else:
+            await self.endpoint.start_receiving_async()
         self.running = True
-        """Start the receive loop in a separate thread."""
-        self.receive_thread = threading.Thread(target=self.receive_loop, daemon=True)
-        self.receive_thread.start()
 
     def stop(self):
         """Stop the receiving loop and close the socket."""
         if (self.running):
             self.running = False
             self.socket_close()
-            self.receive_thread.join()
+            self.wakeup()
 
     def reset(self):
         """Clear the buffer and reset last received time."""
         with self.lock:
             self.buffer.clear()
-        print("Buffer and last receive time reset.")
+        self.logger.debug("Receive buffer reset")
 
 
     def get_last_recv_time(self):
         return self.last_recv_time
 
+    def get_codec_name(self) -> str:
+        return self.codec.name
+
+    def set_peer_addr(self, addr: Tuple[str, int]):
+        """Send to the address the peer was actually seen at (shared socket mode)."""
+        if addr != self.send_addr:
+            self.logger.info("Peer address learned", extra={"peer": addr})
+            self.send_ip, self.send_port = addr
+            self.send_addr = addr
+
+    def negotiate_codec(self, packet: BasePacket, received_binary: bool):
+        """Select the send codec from the codecs advertised by the peer in its heartbeat response."""
+        if received_binary:
+            peer_codecs = [CODEC_BINARY, CODEC_JSON]
+        else:
+            peer_codecs = getattr(packet, "codecs", None) or [CODEC_JSON]
+        for name in self.supported_codecs:
+            if name in peer_codecs:
+                if self.codec.name != name:
+                    self.logger.info("Codec switched to %s", name, extra={"peer": self.send_addr})
+                self.codec = CODECS[name]
+                return
+
     def send_packet(self, packet: BasePacket):
-        """Send a packet as a JSON string via UDP."""
-        json_data = packet.to_json()
-        ret = self.sock.sendto(json_data.encode('utf-8'), (self.send_ip, self.send_port))
-        #print(f"send result: {ret}")
-
-    def receive_loop(self):
-        """Continuously listen for incoming packets, parse, and buffer the latest packet by type."""
-        while self.running:
-            try:
-                data, _ = self.sock.recvfrom(1024)
-                #print("data: ", data)
-                json_data = data.decode('utf-8')
-                base_packet = BasePacket.from_json(json_data)
-                queue_name = None
-                if base_packet.type == "data":
-                    queue_name = base_packet.data_type
-                elif base_packet.type == "event":
-                    queue_name = base_packet.event_type
-                else:
-                    print("ERROR: invalid packet type: ", base_packet.type)
-                    continue
-                packet_class = self.packet_classes.get(queue_name, BasePacket)
-                packet = packet_class.from_json(json_data)
-
-                # Buffer the latest packet by its type
-                with self.lock:
-                    #print("queue_name: ", queue_name)
-                    self.last_recv_time = time()
-                    self.buffer[queue_name] = packet
+        """Send a packet via UDP using the codec negotiated with the peer."""
+        if self.sequence:
+            data = self.codec.encode_sequenced(packet, self.send_sequence.next(), monotonic_ms())
+        else:
+            data = self.codec.encode(packet)
+        self.endpoint.sendto(data, self.send_addr)
+        packet_type = packet.event_type or packet.data_type
+        self.tx_packets[packet_type] = self.tx_packets.get(packet_type, 0) + 1
+
+    def on_datagram(self, data: Union[bytes, memoryview], addr: Tuple[str, int]):
+        self.handle_datagram(data, addr)
+
+    def get_tracker(self, addr: Optional[Tuple[str, int]]) -> SequenceTracker:
+        tracker = self.peers.get(addr)
+        if tracker is None:
+            if len(self.peers) >= self.MAX_PEERS:
+                # 最も古い送信元(ARアプリ再起動前のポート等)を忘れる
+                del self.peers[next(iter(self.peers))]
+            tracker = self.peers[addr] = SequenceTracker()
+        return tracker
+
+    def check_envelope(self, data: Union[bytes, memoryview], envelope: Tuple[int, int], addr: Optional[Tuple[str, int]]) -> bool:
+        """Reject duplicates (and stale binary packets) before the body is decoded."""
+        seq, ts = envelope
+        tracker = self.get_tracker(addr)
+        if not tracker.observe(seq, ts):
+            return False
+        queue_name = BinaryCodec.peek_queue_name(data) if BinaryCodec.is_binary(data) else None
+        if queue_name is not None and tracker.is_stale(queue_name, seq):
+            tracker.stale += 1
+            return False
+        return True
+
+    def handle_datagram(self, data: Union[bytes, memoryview], addr: Optional[Tuple[str, int]] = None):
+        """Decode one datagram in a single pass and buffer the packet by its type."""
+        envelope = read_envelope(data)
+        if envelope is not None and not self.check_envelope(data, envelope, addr):
+            return
+        try:
+            decoded = decode_datagram(data)
+        except ValueError as e:
+            self.decode_errors += 1
+            self.logger.warning("Error decoding datagram: %s", e, extra={"peer": addr, "key": "comm.decode_error"})
+            return
+        if decoded is None:
+            if BinaryCodec.is_binary(data):
+                self.dropped_packets += 1
+            else:
+                self.unknown_packets += 1
+            return
+        self.accept(decoded, envelope, addr)
+
+    def accept(self, decoded: Tuple[str, BasePacket, bool], envelope: Optional[Tuple[int, int]], addr: Optional[Tuple[str, int]]):
+        """Deliver a decoded packet unless a newer one of the same type was already delivered."""
+        queue_name, packet, received_binary = decoded
+        if envelope is not None and not self.get_tracker(addr).accept(queue_name, envelope[0]):
+            return
+        self.deliver(queue_name, packet, received_binary)
+
+    def deliver(self, queue_name: str, packet: BasePacket, received_binary: bool):
+        """Buffer an already decoded packet and wake whoever waits for its type."""
+        if queue_name == "heartbeat_response":
+            self.negotiate_codec(packet, received_binary)
+            if packet.nonce is not None:
+                self.rtt.echo(packet.nonce)
+
+        self.rx_packets[queue_name] += 1
+        # Buffer the latest packet by its type
+        with self.lock:
+            self.last_recv_time = time()
+            self.buffer[queue_name] = packet
+            self.arrived.notify_all()
+            if self.async_waiters:
+                self._resolve_async_waiters(queue_name)
 
+        for callback in self.subscribers.get(queue_name, ()):
+            try:
+                callback(packet)
             except Exception as e:
-                print(f"Error receiving data: {e}")
+                self.logger.error("Error in subscriber: %s", e, extra={"packet": queue_name})
+
+    def subscribe(self, packet_type: str, callback: Callable[[BasePacket], None]):
+        """
+        Call callback(packet) for every delivered packet of packet_type.
+
+        Callbacks run on the receive thread (or the event loop) and must not block. The
+        packet also stays in the buffer for get_packet.
+        """
+        with self.lock:
+            self.subscribers = {**self.subscribers, packet_type: self.subscribers.get(packet_type, ()) + (callback,)}
+
+    def unsubscribe(self, packet_type: str, callback: Callable[[BasePacket], None]):
+        with self.lock:
+            callbacks = tuple(c for c in self.subscribers.get(packet_type, ()) if c != callback)
+            self.subscribers = {**self.subscribers, packet_type: callbacks}
+
+    def _pending(self, packet_types: Iterable[str]) -> Optional[str]:
+        for packet_type in packet_types:
+            if self.buffer.get(packet_type) is not None:
+                return packet_type
+        return None
+
+    def wait_for(self, packet_types: Iterable[str], timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Block until a packet of one of packet_types is buffered (or wakeup() is called).
+
+        Returns the type of a pending packet without consuming it (use get_packet), or None
+        on timeout/wakeup.
+        """
+        packet_types = tuple(packet_types)
+        with self.lock:
+            if self.woken:
+                self.woken = False
+                return self._pending(packet_types)
+            # wakeupは待機中の呼び出し元ごとに通知し、他の待機者に横取りされないようにする
+            waiter = _ThreadWaiter()
+            self.thread_waiters.append(waiter)
+            try:
+                self.arrived.wait_for(lambda: waiter.woken or self._pending(packet_types) is not None, timeout)
+            finally:
+                self.thread_waiters.remove(waiter)
+            return self._pending(packet_types)
+
+    async def wait_for_async(self, packet_types: Iterable[str], timeout: Optional[float] = None) -> Optional[str]:
+        """Event loop version of wait_for: awaits a future resolved by the receive path."""
+        packet_types = frozenset(packet_types)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            pending = self._pending(packet_types)
+            if pending is not None or self.woken:
+                self.woken = False
+                return pending
+            waiter = (packet_types, loop, loop.create_future())
+            self.async_waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[2], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self.lock:
+                if waiter in self.async_waiters:
+                    self.async_waiters.remove(waiter)
+
+    def wakeup(self):
+        """
+        Wake every wait_for/wait_for_async caller (e.g. after a state change). If nobody is
+        waiting, the next call returns at once instead.
+        """
+        with self.lock:
+            if not self.thread_waiters and not self.async_waiters:
+                self.woken = True
+                return
+            for waiter in self.thread_waiters:
+                waiter.woken = True
+            self.arrived.notify_all()
+            self._resolve_async_waiters(None)
+
+    def _resolve_async_waiters(self, queue_name: Optional[str]):
+        """Called with the lock held. queue_name=None resolves every waiter."""
+        remaining = []
+        for waiter in self.async_waiters:
+            packet_types, loop, future = waiter
+            if queue_name is None or queue_name in packet_types:
+                # 受信スレッドからも呼ばれるため、結果の設定はループに委譲する
+                loop.call_soon_threadsafe(_set_future_result, future, queue_name)
+            else:
+                remaining.append(waiter)
+        self.async_waiters = remaining
+
+    def get_sequence_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-peer loss/reorder/duplicate counters of sequenced packets."""
+        return {f"{addr[0]}:{addr[1]}" if addr else "unknown": tracker.stats() for addr, tracker in list(self.peers.items())}
+
+    def get_rtt_stats(self) -> Dict[str, Any]:
+        """Heartbeat round-trip times (ms) and jitter of the peer."""
+        return self.rtt.stats()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Counters of this channel. The socket is reported by the mux when it is shared."""
+        sequence = {"lost": 0, "reordered": 0, "duplicates": 0, "stale": 0}
+        for tracker in list(self.peers.values()):
+            sequence["lost"] += tracker.lost
+            sequence["reordered"] += tracker.reordered
+            sequence["duplicates"] += tracker.duplicates
+            sequence["stale"] += tracker.stale
+        return {
+            "rx": dict(self.rx_packets),
+            "tx": dict(self.tx_packets),
+            "decode_errors": self.decode_errors,
+            "rejected": self.dropped_packets,
+            "unknown": self.unknown_packets,
+            "sequence": sequence,
+            "rtt": self.rtt.stats(),
+            "socket": self.endpoint.stats() if self.mux is None and self.endpoint is not None else None,
+        }
 
     def get_packet(self, packet_type: str) -> Optional[BasePacket]:
         """Get the latest packet of a given type from the buffer."""
@@ -103,3 +356,14 @@ class UdpComm:
             packet = self.buffer.get(packet_type)
             self.buffer[packet_type] = None
             return packet
+
+class _ThreadWaiter:
+    """A thread blocked in UdpComm.wait_for (woken by wakeup())."""
+    __slots__ = ('woken',)
+
+    def __init__(self):
+        self.woken = False
+
+def _set_future_result(future: asyncio.Future, result: Optional[str]):
+    if not future.done():
+        future.set_result(result)
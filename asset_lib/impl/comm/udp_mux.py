@@ -0,0 +1,123 @@
+import threading
+from time import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+from asset_lib.impl import log
+from asset_lib.impl.comm.codec import decode_datagram, read_envelope
+from asset_lib.impl.comm.udp_comm import UdpComm
+from asset_lib.impl.comm.udp_socket import UdpSocket
+
+logger = log.get_logger("comm")
+
+class UdpMux:
+    """
+    One UDP socket shared by many UdpComm channels (one per AR device).
+
+    Datagrams from a known source address go straight to its channel. For an unknown
+    source the packet is decoded once and routed by the device_id echoed in the heartbeat
+    response, or by source IP when exactly one channel is configured for that IP; the
+    address is then learned and replies go back to it on the same socket. A channel only
+    moves to a new address once its current peer has been silent for peer_timeout_sec.
+    """
+    def __init__(self, recv_ip: str, recv_port: int,
+                 recv_buffer_size: Optional[int] = None, so_rcvbuf: Optional[int] = None, recv_batch_size: Optional[int] = None):
+        self.endpoint = UdpSocket(recv_ip, recv_port, self.handle_datagram, recv_buffer_size, so_rcvbuf, recv_batch_size)
+        self.lock = threading.Lock()
+        self.channels: List[UdpComm] = []
+        self.by_addr: Dict[Tuple[str, int], UdpComm] = {}
+        self.unrouted_packets = 0
+        self.rejected_peers = 0
+        self.decode_errors = 0
+        self.started = False
+
+    def get_port(self) -> int:
+        return self.endpoint.get_port()
+
+    def attach(self, channel: UdpComm) -> UdpSocket:
+        with self.lock:
+            if not self.endpoint.is_open():
+                self.endpoint.open()
+            if channel not in self.channels:
+                self.channels.append(channel)
+        return self.endpoint
+
+    def detach(self, channel: UdpComm):
+        with self.lock:
+            if channel in self.channels:
+                self.channels.remove(channel)
+            self.by_addr = {addr: c for addr, c in self.by_addr.items() if c is not channel}
+            if not self.channels and self.endpoint.is_open():
+                self.endpoint.close()
+                self.started = False
+
+    def start_receiving(self):
+        with self.lock:
+            if not self.started:
+                self.endpoint.start_receiving()
+                self.started = True
+
+    async def start_receiving_async(self):
+        if not self.started:
+            self.started = True
+            await self.endpoint.start_receiving_async()
+
+    def handle_datagram(self, data: Union[bytes, memoryview], addr: Tuple[str, int]):
+        channel = self.by_addr.get(addr)
+        if channel is not None:
+            channel.handle_datagram(data, addr)
+            return
+        # 未知の送信元: 1回だけデコードして振り分け先を決める
+        try:
+            decoded = decode_datagram(data)
+        except ValueError as e:
+            self.decode_errors += 1
+            logger.warning("Error decoding datagram: %s", e, extra={"peer": addr, "key": "comm.decode_error"})
+            return
+        if decoded is None:
+            self.unrouted_packets += 1
+            return
+        channel = self.find_channel(getattr(decoded[1], "device_id", None), addr)
+        if channel is None:
+            self.unrouted_packets += 1
+            return
+        if not self.may_learn(channel):
+            # 応答中のデバイスのチャネルを別の送信元に乗っ取らせない
+            self.rejected_peers += 1
+            logger.warning("Datagram for a live device from a new address rejected", extra={"peer": addr, "key": "comm.peer_rejected"})
+            return
+        self.learn(addr, channel)
+        envelope = read_envelope(data)
+        if envelope is None or channel.check_envelope(data, envelope, addr):
+            channel.accept(decoded, envelope, addr)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {"unrouted": self.unrouted_packets, "rejected": self.rejected_peers, "decode_errors": self.decode_errors, "socket": self.endpoint.stats()}
+
+    def find_channel(self, device_id: Optional[str], addr: Tuple[str, int]) -> Optional[UdpComm]:
+        channels = self.channels
+        if device_id:
+            for channel in channels:
+                if channel.device_id == device_id:
+                    return channel
+            return None
+        for channel in channels:
+            if channel.send_addr == addr:
+                return channel
+        # デバイスIDがない場合は送信元IPで一意に決まるときだけ振り分ける
+        candidates = [channel for channel in channels if channel.send_ip == addr[0]]
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+    def may_learn(self, channel: UdpComm) -> bool:
+        """A channel with a known peer address is only re-learned after that peer fell silent."""
+        if channel.peer_timeout_sec is None or channel not in self.by_addr.values():
+            return True
+        return time() - channel.get_last_recv_time() > channel.peer_timeout_sec
+
+    def learn(self, addr: Tuple[str, int], channel: UdpComm):
+        with self.lock:
+            # 同じデバイスの古いアドレス(ARアプリ再起動等)は捨てる
+            by_addr = {a: c for a, c in self.by_addr.items() if c is not channel}
+            by_addr[addr] = channel
+            self.by_addr = by_addr
+        channel.set_peer_addr(addr)
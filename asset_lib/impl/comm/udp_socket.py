@@ -0,0 +1,194 @@
+import asyncio
+import select
+import socket
+import threading
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from asset_lib.impl import log
+from asset_lib.impl.metrics import Histogram
+
+# 受信バッファの既定値: IPv4 UDPの最大ペイロードを収められるサイズ
+DEFAULT_RECV_BUFFER_SIZE = 65535
+DEFAULT_RECV_BATCH_SIZE = 16
+
+_MSG_TRUNC = getattr(socket, "MSG_TRUNC", 0)
+
+logger = log.get_logger("comm")
+
+class UdpSocketProtocol(asyncio.DatagramProtocol):
+    """asyncio endpoint feeding received datagrams into UdpSocket.on_datagram."""
+    def __init__(self, endpoint: 'UdpSocket'):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data: bytes, addr):
+        start = perf_counter()
+        try:
+            self.endpoint.on_datagram(data, addr)
+        except Exception as e:
+            logger.warning("Error receiving data: %s", e, extra={"peer": addr})
+        endpoint = self.endpoint
+        endpoint.received_datagrams += 1
+        endpoint.receive_batches += 1
+        endpoint.receive_time.observe(perf_counter() - start)
+
+    def error_received(self, exc: Exception):
+        logger.warning("Error receiving data: %s", exc)
+
+class UdpSocket:
+    """
+    A bound UDP socket served either by a receive thread or by an asyncio endpoint.
+
+    The socket is non-blocking: the receive thread waits with select, then reads every
+    pending datagram into preallocated buffers before dispatching the batch. on_datagram may be handed a memoryview into
+    a reused buffer: it must finish with (or copy) the data before returning.
+    """
+    def __init__(self, recv_ip: str, recv_port: int, on_datagram: Callable[[Union[bytes, memoryview], Tuple[str, int]], None],
+                 recv_buffer_size: Optional[int] = None, so_rcvbuf: Optional[int] = None, recv_batch_size: Optional[int] = None):
+        self.recv_ip = recv_ip
+        self.recv_port = recv_port
+        self.on_datagram = on_datagram
+        self.recv_buffer_size = recv_buffer_size or DEFAULT_RECV_BUFFER_SIZE
+        self.so_rcvbuf = so_rcvbuf
+        self.recv_batch_size = max(1, recv_batch_size or DEFAULT_RECV_BATCH_SIZE)
+        self.recv_views = [memoryview(bytearray(self.recv_buffer_size)) for _ in range(self.recv_batch_size)]
+        self.recv_sizes = [0] * self.recv_batch_size
+        self.recv_addrs: List[Optional[Tuple[str, int]]] = [None] * self.recv_batch_size
+        self.received_datagrams = 0
+        self.receive_batches = 0
+        self.truncated_datagrams = 0
+        self.dropped_sends = 0
+        self.recv_backlog = False
+        # 受信したバッチの振り分けにかかった時間 (select待ちは含まない)
+        self.receive_time = Histogram()
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+        self.receive_thread: Optional[threading.Thread] = None
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+
+    def is_open(self) -> bool:
+        return self.sock is not None
+
+    def get_port(self) -> int:
+        """Bound port (resolves port 0 to the port chosen by the OS)."""
+        if self.sock is not None:
+            return self.sock.getsockname()[1]
+        return self.recv_port
+
+    def open(self):
+        logger.debug("Creating socket on %s:%s", self.recv_ip, self.recv_port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.so_rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.so_rcvbuf)
+        logger.debug("Binding socket to %s:%s", self.recv_ip, self.recv_port)
+        self.sock.bind((self.recv_ip, self.recv_port))
+        # 受信はselectで待ってから溜まっている分をまとめて読み出す
+        self.sock.setblocking(False)
+        logger.info("Socket bound to %s:%s", self.recv_ip, self.get_port())
+
+    def start_receiving(self):
+        """Start the receive loop in a separate thread."""
+        self.running = True
+        self.receive_thread = threading.Thread(target=self.receive_loop, daemon=True)
+        self.receive_thread.start()
+
+    async def start_receiving_async(self):
+        """Receive on the running event loop instead of a dedicated thread."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: UdpSocketProtocol(self), sock=self.sock)
+        self.running = True
+
+    def close(self):
+        self.running = False
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        elif self.sock is not None:
+            try:
+                # select待ちの受信スレッドを起こしてから閉じる
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            if self.receive_thread is not None:
+                self.receive_thread.join(timeout=1.0)
+                self.receive_thread = None
+        self.sock = None
+
+    def sendto(self, data: bytes, addr: Tuple[str, int]):
+        if self.transport is not None:
+            # トランスポートはスレッドセーフではないため、ループ外からの送信はループに委譲する
+            if threading.get_ident() == self.loop_thread_id:
+                self.transport.sendto(data, addr)
+            else:
+                self.loop.call_soon_threadsafe(self.transport.sendto, data, addr)
+        else:
+            try:
+                self.sock.sendto(data, addr)
+            except BlockingIOError:
+                # 送信バッファが一杯の場合はUDPの損失と同じ扱い
+                self.dropped_sends += 1
+
+    def _recv_into(self, view: memoryview) -> Tuple[int, Tuple[str, int]]:
+        """Receive one datagram into view. Returns (nbytes, addr); nbytes > len(view) means truncated."""
+        # MSG_TRUNC(Linux)では切り詰められたデータグラムの本来の長さが返る
+        nbytes, addr = self.sock.recvfrom_into(view, 0, _MSG_TRUNC)
+        if not _MSG_TRUNC and nbytes >= len(view):
+            # MSG_TRUNCが無い環境ではバッファを使い切った場合を切り詰めとみなす
+            nbytes = len(view) + 1
+        return nbytes, addr
+
+    def receive_batch(self) -> int:
+        """Wait until the socket is readable, then drain the pending datagrams and dispatch them."""
+        views = self.recv_views
+        sizes = self.recv_sizes
+        addrs = self.recv_addrs
+        if not self.recv_backlog:
+            select.select([self.sock], [], [])
+        count = 0
+        while count < len(views):
+            try:
+                sizes[count], addrs[count] = self._recv_into(views[count])
+            except BlockingIOError:
+                break
+            count += 1
+        # バッファを使い切った場合はまだ溜まっている可能性が高いので次回はselectを省く
+        self.recv_backlog = count == len(views)
+        if count == 0:
+            return 0
+
+        self.receive_batches += 1
+        self.received_datagrams += count
+        start = perf_counter()
+        limit = self.recv_buffer_size
+        for index in range(count):
+            nbytes = sizes[index]
+            if nbytes > limit:
+                self.truncated_datagrams += 1
+                continue
+            try:
+                self.on_datagram(views[index][:nbytes], addrs[index])
+            except Exception as e:
+                logger.warning("Error receiving data: %s", e, extra={"peer": addrs[index]})
+        self.receive_time.observe(perf_counter() - start)
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received_datagrams,
+            "batches": self.receive_batches,
+            "truncated": self.truncated_datagrams,
+            "dropped_sends": self.dropped_sends,
+            "receive_loop": self.receive_time.snapshot(),
+        }
+
+    def receive_loop(self):
+        """Continuously listen for incoming datagrams and hand them to on_datagram."""
+        while self.running:
+            try:
+                self.receive_batch()
+            except Exception as e:
+                if self.running:
+                    logger.warning("Error receiving data: %s", e)
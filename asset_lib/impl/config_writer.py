@@ -0,0 +1,136 @@
+import atexit
+import copy
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from asset_lib.impl import log
+
+DEFAULT_SAVE_DEBOUNCE_SEC = 1.0
+
+logger = log.get_logger("config")
+
+class ConfigWriter:
+    """
+    Write-behind persistence of a JSON config file.
+
+    update() only records the latest contents and returns immediately; a background
+    thread writes them at most once per debounce interval (the first change is written
+    debounce_sec later, together with everything that changed meanwhile). Unchanged
+    contents are never rewritten. Each write goes to a temporary file in the same
+    directory that then replaces the config with os.replace, so a process killed
+    mid-write leaves either the old or the new file, never a truncated one.
+
+    With a scheduler (the container's TimerWheel) there is no writer thread per file: the
+    first change arms a one-shot "flush" job on the scheduler's I/O worker instead.
+
+    `current` is what the file already contains (the config just loaded from it), so an
+    update that does not change anything is not written either.
+    """
+    def __init__(self, path: str, debounce_sec: float = DEFAULT_SAVE_DEBOUNCE_SEC, scheduler=None,
+                 current: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.debounce_sec = debounce_sec
+        self.scheduler = scheduler
+        self.flush_job = None
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending: Optional[Dict[str, Any]] = None
+        self.dirty_since = 0.0
+        self.last_written: Optional[Dict[str, Any]] = copy.deepcopy(current) if current else None
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        # 終了時に未書き込みの内容を残さない (start/stopを繰り返しても登録は1回)
+        atexit.register(self.stop)
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            if self.scheduler is not None and self.pending is not None:
+                self._arm_flush()
+        if self.scheduler is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def update(self, data: Dict[str, Any]):
+        """Schedule data to be written (a snapshot is taken, callers may keep mutating their objects)."""
+        snapshot = copy.deepcopy(data)
+        with self.cond:
+            if self.pending is None:
+                if snapshot == self.last_written:
+                    return
+                self.dirty_since = time.monotonic()
+                if self.scheduler is not None:
+                    if self.running:
+                        self._arm_flush()
+                else:
+                    self.cond.notify()
+            else:
+                self.coalesced += 1
+            self.pending = snapshot
+
+    def flush(self):
+        """Write pending contents now, from the calling thread."""
+        with self.cond:
+            data = self.pending
+            self.pending = None
+            self.flush_job = None
+        if data is not None:
+            self.write(data)
+
+    def stop(self):
+        with self.cond:
+            was_running = self.running
+            self.running = False
+            self.cond.notify()
+            if self.flush_job is not None:
+                self.scheduler.cancel(self.flush_job)
+                self.flush_job = None
+        if was_running and self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5.0)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"writes": self.writes, "coalesced": self.coalesced, "errors": self.errors}
+
+    def _arm_flush(self):
+        # self.condを保持して呼ぶこと
+        if self.flush_job is None:
+            self.flush_job = self.scheduler.call_later(self.debounce_sec, self.flush, name="flush", blocking=True)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and self.pending is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                # 最初の変更からdebounce_sec待ち、その間の変更をまとめて書く
+                deadline = self.dirty_since + self.debounce_sec
+                while self.running and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                if not self.running:
+                    return
+            self.flush()
+
+    def write(self, data: Dict[str, Any]):
+        tmp_path = f"{self.path}.tmp"
+        with self.write_lock:
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self.last_written = data
+                self.writes += 1
+                logger.debug("Saved current state to %s", self.path)
+            except (IOError, OSError) as e:
+                self.errors += 1
+                logger.error("Error saving to file %s: %s", self.path, e)
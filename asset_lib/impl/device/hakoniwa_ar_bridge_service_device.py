@@ -1,39 +1,67 @@
-import logging
+import asyncio
 import json
 import time
+from typing import Optional
+from asset_lib.impl import log
 from asset_lib.impl.comm.udp_comm import UdpComm
+from asset_lib.impl.config_writer import ConfigWriter, DEFAULT_SAVE_DEBOUNCE_SEC
+from asset_lib.impl.comm.udp_mux import UdpMux
 from asset_lib.impl.device.sync_manager_device import SyncManagerDevice
+from asset_lib.impl.metrics import Histogram, ProgressCounter, node_metrics
+from asset_lib.impl.scheduler import TimerWheel
+from asset_lib.impl.sync_manager_base import DEFAULT_HEARTBEAT_TIMEOUT_SEC
+
+logger = log.get_logger("device")
 
 class HakoniwaARBridgeServiceDevice:
-    def __init__(self, config_path: str, my_ip: str, ar_port: int, web_ip: str):
+    def __init__(self, config_path: str, my_ip: str, ar_port: int, web_ip: str, mux: Optional[UdpMux] = None,
+                 scheduler: Optional[TimerWheel] = None):
         self.config = self.load_config(config_path)
         self.my_ip = my_ip
         self.server_udp_port = self.config.get("server_udp_port", 48528)
         self.ar_ip = self.config.get("ar_ip", "127.0.0.1")
-        self.ar_port = ar_port
+        self.ar_port = self.config.get("ar_port", ar_port)
+        # 共有ソケットでの振り分けに使うID (ARアプリがHeartBeatResponseで返す)
+        self.device_id = self.config.get("device_id", self.config.get("player", {}).get("name"))
+        self.logger = log.get_logger("device", node=self.device_id)
         self.web_ip = web_ip
         self.output_file = self.config.get("output_file",config_path)
-        print(f"Config: {self.config}")
-        self.udp_service = UdpComm(recv_ip=self.my_ip, recv_port=self.server_udp_port, send_ip=self.ar_ip, send_port=self.ar_port)
-        self.sync_manager = SyncManagerDevice(self.web_ip, self.udp_service, 5, self.config['positioning_speed'], self.config['position'], self.config['rotation'], self.config['player'], self.config['avatars'])
+        # 読み込んだ内容と同じなら書き直さない (出力先が別ファイルの場合はその内容を知らない)
+        self.config_writer = ConfigWriter(self.output_file, self.config.get("save_debounce_sec", DEFAULT_SAVE_DEBOUNCE_SEC), scheduler,
+                                          self.config if self.output_file == config_path else None)
+        self.logger.debug("Config: %s", self.config)
+        self.udp_service = UdpComm(recv_ip=self.my_ip, recv_port=self.server_udp_port, send_ip=self.ar_ip, send_port=self.ar_port, codecs=self.config.get("codecs"), mux=mux, device_id=self.device_id,
+                                  recv_buffer_size=self.config.get("recv_buffer_size"), so_rcvbuf=self.config.get("so_rcvbuf"),
+                                  recv_batch_size=self.config.get("recv_batch_size"), sequence=self.config.get("sequence", False),
+                                  rtt_window=self.config.get("rtt_window"),
+                                  peer_timeout_sec=self.config.get("heartbeat_timeout_sec", DEFAULT_HEARTBEAT_TIMEOUT_SEC))
+        # step()1回の処理時間と、ループが回っていることを示す回数
+        self.step_time = Histogram()
+        self.progress = ProgressCounter()
+        self.sync_manager = SyncManagerDevice(self.web_ip, self.udp_service, self.config.get("heartbeat_timeout_sec", DEFAULT_HEARTBEAT_TIMEOUT_SEC),
+                                              self.config['positioning_speed'], self.config['position'], self.config['rotation'], self.config['player'], self.config['avatars'],
+                                              scheduler, self.config.get("heartbeat_interval_sec"), self.config.get("liveness_interval_sec"),
+                                              self.config.get("failure_detector"))
         
     def load_config(self, config_path):
         try:
             with open(config_path, 'r') as file:
                 config_data = json.load(file)
-                logging.info("Config loaded successfully: %s", config_data)
+                logger.debug("Config loaded successfully: %s", config_data)
                 return config_data
         except FileNotFoundError:
-            logging.error("Error: Config file not found at %s", config_path)
+            logger.error("Error: Config file not found at %s", config_path)
             return {}
         except json.JSONDecodeError as e:
-            logging.error("Error: Failed to decode JSON from %s: %s", config_path, e)
+            logger.error("Error: Failed to decode JSON from %s: %s", config_path, e)
             return {}
 
 
     def save_to_json(self, position, rotation):
         """指定したファイルに位置と回転情報を保存"""
-        data = {
+        # 未知の設定項目(codecs等)も保持したまま位置と回転を更新する
+        data = dict(self.config)
+        data.update({
             "ar_ip": self.ar_ip,
             "server_udp_port": self.server_udp_port,
             "player": self.config['player'],
@@ -49,49 +77,83 @@ class HakoniwaARBridgeServiceDevice:
                 rotation["y"],
                 rotation["z"]
             ]
-        }
-        try:
-            with open(self.output_file, 'w') as f:
-                json.dump(data, f, indent=4)
-            #logging.info("Saved current state to %s", self.output_file)
-        except IOError as e:
-            logging.error("Error saving to file %s: %s", self.output_file, e)
+        })
+        # ファイル書き込みは書き込みスレッドがまとめて行う
+        self.config_writer.update(data)
     
 
     def start_service(self):
         """SyncManagerサービスの開始"""
         try:
-            print("Starting SyncManager service.")
+            self.logger.info("Starting SyncManager service.")
+            self.config_writer.start()
             self.sync_manager.start_service()
-            print("Using My IP: %s", self.my_ip)
-            print("Using AR IP: %s", self.ar_ip)
-            print("Using Web Server IP: %s", self.web_ip)
-            print("Receiving on port: %d, Sending on port: %d", self.server_udp_port, self.ar_port)
-            print("Config: %s", self.config)
+            self.logger.info("Using My IP: %s, AR IP: %s, Web Server IP: %s", self.my_ip, self.ar_ip, self.web_ip)
+            self.logger.info("Receiving on port: %d, Sending on port: %d", self.server_udp_port, self.ar_port)
         except Exception as e:
-            logging.error("Using My IP: %s", self.my_ip)
-            logging.error("Using AR IP: %s", self.ar_ip)
-            logging.error("Using Web Server IP: %s", self.web_ip)
-            logging.error("Error starting SyncManager service: %s", e)
+            self.logger.error("Using My IP: %s, AR IP: %s, Web Server IP: %s", self.my_ip, self.ar_ip, self.web_ip)
+            self.logger.error("Error starting SyncManager service: %s", e)
+
+    async def start_service_async(self):
+        """SyncManagerサービスをイベントループ上で開始"""
+        try:
+            self.logger.info("Starting SyncManager service (asyncio).")
+            self.config_writer.start()
+            await self.sync_manager.start_service_async()
+        except Exception as e:
+            self.logger.error("Error starting SyncManager service: %s", e)
+
+    def stop_service(self):
+        """SyncManagerサービスを止め、未保存の設定を書き出す"""
+        self.sync_manager.stop_service()
+        self.config_writer.stop()
+
+    # 状態ごとに待つパケット。状態変化はハートビート処理がwakeupで知らせる
+    WAIT_PACKET_TYPES = {
+        "POSITIONING": ("position", "play_start", "reset"),
+        "PLAYING": ("reset",),
+    }
+    # パケットが来なくても状態を見直す間隔
+    IDLE_TIMEOUT_SEC = 1.0
+
+    def wait_packet_types(self):
+        return self.WAIT_PACKET_TYPES.get(self.sync_manager.get_sync_status(), ())
+
+    def step(self):
+        """状態に応じて受信済みのパケットを処理する"""
+        start = time.perf_counter()
+        status = self.sync_manager.get_sync_status()
+        if status == "POSITIONING":
+            if self.sync_manager.update_position():
+                self.save_to_json(self.sync_manager.position, self.sync_manager.orientation)
+            if self.sync_manager.is_play_start():
+                self.sync_manager.start_play()
+        elif status == "PLAYING":
+            if self.sync_manager.is_reset():
+                self.sync_manager.reset()
+        self.step_time.observe(time.perf_counter() - start)
+        self.progress.tick()
+
+    def metrics(self):
+        return node_metrics(self.device_id, "device", self.sync_manager, self.udp_service, self.config_writer, self.step_time, self.progress)
 
     def run(self):
-        """サービスのメインループ"""
+        """サービスのメインループ。パケット到着までブロックして待つ"""
         try:
             while True:
-                status = self.sync_manager.get_sync_status()
-                if status == "POSITIONING":
-                    if self.sync_manager.update_position():
-                        #print("Updating position.")
-                        self.save_to_json(self.sync_manager.position, self.sync_manager.orientation)
-                    if self.sync_manager.is_play_start():
-                        self.sync_manager.start_play()
-                    time.sleep(1)
-                elif status == "PLAYING":
-                    if self.sync_manager.is_reset():
-                        self.sync_manager.reset()
-                else:
-                    #WAITING
-                    time.sleep(1)
+                self.sync_manager.udp_service.wait_for(self.wait_packet_types(), self.IDLE_TIMEOUT_SEC)
+                self.step()
         except KeyboardInterrupt:
-            logging.info("Service stopped by user.")
-            self.sync_manager.stop_service()
\ No newline at end of file
+            self.logger.info("Service stopped by user.")
+            self.stop_service()
+
+    async def run_async(self):
+        """イベントループ版のメインループ。パケット到着をfutureで待つ"""
+        try:
+            while True:
+                await self.sync_manager.udp_service.wait_for_async(self.wait_packet_types(), self.IDLE_TIMEOUT_SEC)
+                self.step()
+        except asyncio.CancelledError:
+            self.logger.info("Service stopped.")
+            self.stop_service()
+            raise
@@ -1,15 +1,19 @@
-import threading
-import time
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, Optional
+from asset_lib.impl import log
 from asset_lib.impl.comm.packet import EventRequest, HeartBeatRequest, PositioningRequest
 from asset_lib.impl.comm.udp_comm import UdpComm
+from asset_lib.impl.scheduler import TimerWheel
 from asset_lib.impl.sync_manager_base import SyncManagerBaseService
 from asset_lib.impl.sync_state import SyncStateManagement, SyncState
 from asset_lib.sync_interface import SyncManagerInterface
 
 class SyncManagerDevice(SyncManagerInterface):
-    def __init__(self, web_ip: str, udp_service: UdpComm, heartbeat_timeout_sec: int, positioning_speed, position, rotation, player, avatars):
-        self.state_management = SyncStateManagement()
+    def __init__(self, web_ip: str, udp_service: UdpComm, heartbeat_timeout_sec: float, positioning_speed, position, rotation, player, avatars,
+                 scheduler: Optional[TimerWheel] = None, heartbeat_interval_sec: Optional[float] = None, liveness_interval_sec: Optional[float] = None,
+                 failure_detector: Optional[Dict[str, Any]] = None):
+        self.state_management = SyncStateManagement(player.get("name"))
+        self.logger = log.get_logger("device", node=player.get("name"))
         self.position = {
             "x": position[0],
             "y": position[1],
@@ -21,12 +25,15 @@ class SyncManagerDevice(SyncManagerInterface):
             "z": rotation[2]
         }
         self.running = False
-        self.thread = None
+        # ハートビートとタイムアウト判定はコンテナのスケジューラで動かす (無ければ自前で持つ)
+        self.scheduler = scheduler
+        self.owns_scheduler = False
         self.udp_service = udp_service
         self.saved_position_packet = PositioningRequest("unity", self.position, self.orientation)
         self.player = player
         self.avatars = avatars
-        self.service = SyncManagerBaseService(self.state_management, web_ip, udp_service, heartbeat_timeout_sec, positioning_speed, self.saved_position_packet.data, self.player, self.avatars)
+        self.service = SyncManagerBaseService(self.state_management, web_ip, udp_service, heartbeat_timeout_sec, positioning_speed, self.saved_position_packet.data, self.player, self.avatars,
+                                              heartbeat_interval_sec, liveness_interval_sec, failure_detector)
 
     def update_saved_position_packet(self, position, rotation) -> None:
         self.position = position
@@ -37,43 +44,53 @@ class SyncManagerDevice(SyncManagerInterface):
         if not self.running:
             self.udp_service.start_receiving()
             self.running = True
-            self.thread = threading.Thread(target=self._run_service, daemon=True)
-            self.thread.start()
-            print("SyncManager service started.")
+            self._schedule(None)
+            self.logger.info("SyncManager service started.")
 
-    def _run_service(self) -> None:
-        while self.running:
-            try:
-                if self.service:
-                    self.service.run()
-                else:
-                    print("No service defined for the current state.")                
-                time.sleep(1)
-            except Exception as e:
-                print(f"Error in service run loop: {e}")
+    async def start_service_async(self) -> None:
+        """Start the service on the running event loop (no receive/heartbeat threads)."""
+        if not self.running:
+            await self.udp_service.start_receiving_async()
+            self.running = True
+            self._schedule(asyncio.get_running_loop())
+            self.logger.info("SyncManager service started (asyncio).")
+
+    def _schedule(self, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        if self.scheduler is None:
+            # コンテナの外で単体で使う場合
+            self.scheduler = TimerWheel()
+            self.owns_scheduler = True
+            if loop is not None:
+                self.scheduler.start_async(loop)
+            else:
+                self.scheduler.start()
+        self.service.schedule(self.scheduler)
 
     def stop_service(self) -> None:
         if self.running:
             self.running = False
-            if self.thread:
-                self.thread.join()
+            self.service.cancel_schedule(self.scheduler)
+            if self.owns_scheduler:
+                self.scheduler.stop()
+                self.scheduler = None
+                self.owns_scheduler = False
             self.udp_service.stop()
-            print("SyncManager service stopped.")
+            self.logger.info("SyncManager service stopped.")
 
     def start_play(self) -> None:
         try:
-            print("EVENT: start play")
+            self.logger.info("EVENT: start play")
             self.state_management.start_play()
         except Exception as e:
-            print(f"Error starting play: {e}")
+            self.logger.error("Error starting play: %s", e)
 
     def reset(self) -> None:
         try:
-            print("EVENT: reset")
+            self.logger.info("EVENT: reset")
             self.state_management.disconnect_or_reset()
             self.udp_service.reset()
         except Exception as e:
-            print(f"Error during reset: {e}")
+            self.logger.error("Error during reset: %s", e)
 
     def is_reset(self) -> bool:
         try:
@@ -82,7 +99,7 @@ class SyncManagerDevice(SyncManagerInterface):
                 return True
             return False
         except Exception as e:
-            print(f"Error checking reset: {e}")
+            self.logger.error("Error checking reset: %s", e)
             return False
 
     def is_play_start(self) -> bool:
@@ -94,7 +111,7 @@ class SyncManagerDevice(SyncManagerInterface):
                 return True
             return False
         except Exception as e:
-            print(f"Error checking play start: {e}")
+            self.logger.error("Error checking play start: %s", e)
             return False
 
     def update_position(self) -> None:
@@ -103,24 +120,28 @@ class SyncManagerDevice(SyncManagerInterface):
             _ = self.udp_service.get_packet('reset')
             packet = self.udp_service.get_packet('position')
             if packet:
-                self.position = packet.data['position']
-                self.orientation = packet.data['orientation']
+                self.position = packet.position.to_dict()
+                self.orientation = packet.orientation.to_dict()
                 self.update_saved_position_packet(self.position, self.orientation)
-                print(f"Updating position to {self.position} and orientation to {self.orientation}")
+                # 位置合わせ中は毎パケット来るので間引いて出す
+                self.logger.debug("Updating position to %s and orientation to %s", self.position, self.orientation,
+                                  extra={"packet": "position", "sample": 10})
                 return True
         except Exception as e:
-            print(f"Error updating position or sending PositioningRequest: {e}")
+            self.logger.error("Error updating position or sending PositioningRequest: %s", e)
 
     def get_ar_status(self) -> Dict[str, Any]:
         try:
-            return {"status": self.state_management.state.name, "position": self.position, "orientation": self.orientation}
+            return {"status": self.state_management.state.name, "position": self.position, "orientation": self.orientation,
+                    "sequence": self.udp_service.get_sequence_stats(), "rtt": self.udp_service.get_rtt_stats(),
+                    "liveness": self.service.get_liveness()}
         except Exception as e:
-            print(f"Error retrieving AR status: {e}")
+            self.logger.error("Error retrieving AR status: %s", e)
             return {}
 
     def get_sync_status(self) -> Dict[str, Any]:
         try:
             return self.state_management.state.name
         except Exception as e:
-            print(f"Error retrieving sync status: {e}")
+            self.logger.error("Error retrieving sync status: %s", e)
             return {"sync_state": "unknown"}
@@ -1,17 +1,43 @@
+import threading
+
 import pygame
 
 from asset_lib.impl.drivers.rc_utils import StickMonitor
-from asset_lib.impl.local.sync_manager_local import SyncManager
+from asset_lib.impl.local.sync_manager_local import SyncManagerLocal
 from asset_lib.impl.drivers.input_handler import InputHandler
+from asset_lib.impl.metrics import ProgressCounter
 import time
+from asset_lib.impl import log
+
+logger = log.get_logger("input")
+
+# poll: 10ms周期で全軸を読み、1周期ごとに固定量動かす (従来の動作)
+# event: JOYAXISMOTIONで軸の値を更新し、positioning_speed(毎秒の移動量/回転量)で経過時間分動かす
+INPUT_MODE_POLL = "poll"
+INPUT_MODE_EVENT = "event"
+DEFAULT_POSITIONING_SPEED = {"rotation": 20.0, "move": 0.2}
+
+EVENT_TICK_SEC = 0.01     # スティックが倒れている間の積分周期
+IDLE_TIMEOUT_SEC = 0.5    # 無操作で待つ間にPOSITIONINGの終了を確認する間隔
+MAX_STEP_SEC = 0.1        # 1回に積分する最大時間 (処理が止まった後に位置が跳ばないように)
 
 class JoystickInputHandler(InputHandler):
-    def __init__(self, position, rotation, sync_manager: SyncManager, save_to_json, stick_monitor: StickMonitor):
+    def __init__(self, position, rotation, sync_manager: SyncManagerLocal, save_to_json, stick_monitor: StickMonitor,
+                 positioning_speed=None, input_mode: str = INPUT_MODE_POLL, stop_event: threading.Event = None,
+                 progress: ProgressCounter = None):
         self.position = position
         self.rotation = rotation
         self.sync_manager = sync_manager
         self.save_to_json = save_to_json
         self.stick_monitor = stick_monitor
+        self.positioning_speed = positioning_speed or DEFAULT_POSITIONING_SPEED
+        if input_mode not in (INPUT_MODE_POLL, INPUT_MODE_EVENT):
+            raise ValueError(f"Unknown input_mode: {input_mode}")
+        self.input_mode = input_mode
+        # セットされたら位置決めを中断してhandle_inputから戻る (サービス停止)
+        self.stop_event = stop_event or threading.Event()
+        # ループ1周ごとに進める (ワーカーの停止検出用)
+        self.progress = progress or ProgressCounter()
 
         pygame.init()
         pygame.joystick.init()
@@ -25,30 +51,14 @@ class JoystickInputHandler(InputHandler):
     def handle_input_position(self, config):
         temp_position = [0, 0, 0]
         temp_rotation = [0, 0, 0]
-        yaw_value = 0
-        vertical_value = 0
-        horizontal_value = 0
-        forward_backward_value = 0
-
-        # 軸の数を取得
+        # 全軸の値を1サンプルとして変換する
         num_axes = self.joystick.get_numaxes()
-
-        # 各軸の値を取得
-        for axis in range(num_axes):
-            axis_value = self.joystick.get_axis(axis)
-            #print(f"軸 {axis} の値: {axis_value:.2f}")
-            op_index = self.stick_monitor.rc_config.get_op_index(axis)
-            if op_index is None:
-                continue
-            stick_value = self.stick_monitor.stick_value(axis, axis_value)
-            if op_index == self.stick_monitor.rc_config.STICK_TURN_LR:
-                yaw_value = stick_value * 1.0
-            elif op_index == self.stick_monitor.rc_config.STICK_UP_DOWN:
-                vertical_value = stick_value * 0.01
-            elif op_index == self.stick_monitor.rc_config.STICK_MOVE_LR:
-                horizontal_value = -stick_value * 0.01
-            elif op_index == self.stick_monitor.rc_config.STICK_MOVE_FB:
-                forward_backward_value = stick_value * 0.01
+        ops = self.stick_monitor.stick_frame([self.joystick.get_axis(axis) for axis in range(num_axes)])
+        rc_config = self.stick_monitor.rc_config
+        yaw_value = ops[rc_config.STICK_TURN_LR] * 1.0
+        vertical_value = ops[rc_config.STICK_UP_DOWN] * 0.01
+        horizontal_value = -ops[rc_config.STICK_MOVE_LR] * 0.01
+        forward_backward_value = ops[rc_config.STICK_MOVE_FB] * 0.01
 
         # スティックの値が変わった場合のみ更新
         if yaw_value != 0 or vertical_value != 0 or horizontal_value != 0 or forward_backward_value != 0:
@@ -62,6 +72,9 @@ class JoystickInputHandler(InputHandler):
             self.position[2] += temp_position[2]
             self.rotation[1] += temp_rotation[1]
 
+        return self.current_pose()
+
+    def current_pose(self):
         pos = {
             "x": self.position[0],
             "y": self.position[1],
@@ -72,14 +85,53 @@ class JoystickInputHandler(InputHandler):
             "y": self.rotation[1],
             "z": 0.0
         }
-        #print("Position: ", pos)
         return pos, rot
 
+    def stick_rates(self, config, axis_values):
+        """
+        スティックの値から毎秒の変化量(yaw[deg/s], 上下, 左右, 前後[m/s])を求める。全スティックが中立ならNone
+        """
+        ops = self.stick_monitor.stick_frame(axis_values)
+        rc_config = self.stick_monitor.rc_config
+        if not any(ops):
+            return None
+        adjustments = config.get("adjustments", {})
+        rotation_speed = self.positioning_speed["rotation"]
+        move_speed = self.positioning_speed["move"]
+        return (
+            ops[rc_config.STICK_TURN_LR] * rotation_speed * adjustments.get("yaw", 1.0),
+            ops[rc_config.STICK_UP_DOWN] * move_speed * adjustments.get("vertical", 1.0),
+            -ops[rc_config.STICK_MOVE_LR] * move_speed * adjustments.get("horizontal", 1.0),
+            ops[rc_config.STICK_MOVE_FB] * move_speed * adjustments.get("forward_and_back", 1.0),
+        )
+
+    def integrate(self, rates, dt: float):
+        yaw_rate, vertical_rate, horizontal_rate, forward_backward_rate = rates
+        self.rotation[1] += yaw_rate * dt
+        self.position[1] += vertical_rate * dt
+        self.position[0] += horizontal_rate * dt
+        self.position[2] += forward_backward_rate * dt
+
+    def handle_button(self, button) -> bool:
+        """ボタンイベントを処理する。位置決め完了ならTrue"""
+        event_op_index = self.stick_monitor.rc_config.get_event_op_index(button)
+        logger.info("Event for button %s ==> END.", button)
+        if event_op_index is not None and event_op_index == self.stick_monitor.rc_config.SWITCH_GRAB_BAGGAGE:
+            logger.info("Confirmation button pressed.")
+            return True
+        elif event_op_index is not None and event_op_index == self.stick_monitor.rc_config.SWITCH_RETURN_HOME:
+            logger.info("RTH button pressed.")
+            self.reset_position()
+        return False
+
     def handle_input(self, config):
+        if self.input_mode == INPUT_MODE_EVENT:
+            return self.handle_input_events(config)
         running = True
         while running:
-            if self.sync_manager.get_sync_status() != "POSITIONING":
+            if self.stop_event.is_set() or self.sync_manager.get_sync_status() != "POSITIONING":
                 return False
+            self.progress.tick()
 
             # joystick event
             pygame.event.pump()  # イベントキューを更新
@@ -88,15 +140,52 @@ class JoystickInputHandler(InputHandler):
             self.save_to_json(self.position, self.rotation)
 
             for event in pygame.event.get([pygame.JOYBUTTONUP]):  # 必要なイベントのみ取得
-                event_op_index = self.stick_monitor.rc_config.get_event_op_index(event.button)
-                print(f"INFO: Event for button {event.button} ==> END.")
-                if event_op_index is not None and event_op_index == self.stick_monitor.rc_config.SWITCH_GRAB_BAGGAGE:
-                    print("Confirmation button pressed.")
+                if self.handle_button(event.button):
                     running = False
-                elif event_op_index is not None and event_op_index == self.stick_monitor.rc_config.SWITCH_RETURN_HOME:
-                    print("RTH button pressed.")
-                    self.reset_position()
 
             pygame.time.wait(10)
         pygame.event.clear()
         return True
+
+    def handle_input_events(self, config):
+        """
+        イベント駆動の位置決め。スティックが倒れている間はEVENT_TICK_SEC周期で経過時間分を積分し、
+        全スティックが中立の間は次のイベントまで(最大IDLE_TIMEOUT_SEC)ブロックする
+        """
+        pygame.event.pump()
+        axis_values = [self.joystick.get_axis(axis) for axis in range(self.joystick.get_numaxes())]
+        rates = self.stick_rates(config, axis_values)
+        last_time = time.monotonic()
+        while True:
+            if self.stop_event.is_set() or self.sync_manager.get_sync_status() != "POSITIONING":
+                return False
+            self.progress.tick()
+
+            timeout = EVENT_TICK_SEC if rates is not None else IDLE_TIMEOUT_SEC
+            event = pygame.event.wait(int(timeout * 1000))
+            now = time.monotonic()
+            # 前回からの区間はその時点のスティックの値が続いていたとして積分する
+            if rates is not None:
+                self.integrate(rates, min(now - last_time, MAX_STEP_SEC))
+            last_time = now
+
+            events = [event] + pygame.event.get() if event.type != pygame.NOEVENT else []
+            moved = False
+            done = False
+            for event in events:
+                if event.type == pygame.JOYAXISMOTION and event.axis < len(axis_values):
+                    axis_values[event.axis] = event.value
+                    moved = True
+                elif event.type == pygame.JOYBUTTONUP:
+                    done = self.handle_button(event.button) or done
+            # 平均化しているスティックは離した後も数周期かけて中立に戻るため、倒れている間は毎周期計算する
+            if moved or rates is not None:
+                rates = self.stick_rates(config, axis_values)
+
+            pos, rot = self.current_pose()
+            self.sync_manager.update_position(pos, rot)
+            self.save_to_json(self.position, self.rotation)
+            if done:
+                break
+        pygame.event.clear()
+        return True
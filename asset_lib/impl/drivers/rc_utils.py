@@ -3,6 +3,10 @@
 
 import sys
 import json
+from collections import deque
+from asset_lib.impl import log
+
+logger = log.get_logger("input")
 
 class RcConfig:
     # スティック操作の定数定義
@@ -19,23 +23,130 @@ class RcConfig:
     SWITCH_CAMERA_MOVE_DOWN = 12
     SWITCH_RETURN_HOME = 13
     
+    # Eventの項目名 => スイッチ操作 (項目が無いプロファイルもある)
+    EVENT_OPS = (
+        ('RadioControlEnable', SWITCH_RADIO_CONTROL_ENABLE),
+        ('GrabBaggage', SWITCH_GRAB_BAGGAGE),
+        ('Camera', SWITCH_CAMERA_SHOT),
+        ('CameraMoveUp', SWITCH_CAMERA_MOVE_UP),
+        ('CameraMoveDown', SWITCH_CAMERA_MOVE_DOWN),
+        ('ReturnHome', SWITCH_RETURN_HOME),
+    )
+    SWITCH_STATES = ('up', 'down')
+
     def __init__(self, filepath):
         self.config = self._load_json(filepath)
+        if self.config is None:
+            raise ValueError(f"Failed to load controller profile '{filepath}'")
+        # 軸/ボタン番号で引く表をロード時に1度だけ作る
+        self.stick_ops = []
+        self.stick_features = []
+        self.event_ops = []
+        self.switch_features = []
+        try:
+            self._compile()
+        except ValueError as e:
+            raise ValueError(f"Invalid controller profile '{filepath}': {e}")
 
     def _load_json(self, path):
         try:
             with open(path, 'r') as file:
                 return json.load(file)
         except FileNotFoundError:
-            print(f"ERROR: File not found '{path}'")
+            logger.error("File not found '%s'", path)
         except json.JSONDecodeError:
-            print(f"ERROR: Invalid Json fromat '{path}'")
+            logger.error("Invalid Json fromat '%s'", path)
         except PermissionError:
-            print(f"ERROR: Permission denied '{path}'")
+            logger.error("Permission denied '%s'", path)
         except Exception as e:
-            print(f"ERROR: {e}")
+            logger.error("%s", e)
         return None
 
+    @staticmethod
+    def _index(entry, name):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{name} must be an object")
+        index = entry.get('index')
+        if not isinstance(index, int) or isinstance(index, bool) or index < 0:
+            raise ValueError(f"{name}.index must be a non-negative integer, got {index!r}")
+        return index
+
+    @staticmethod
+    def _put(table, index, value):
+        if index >= len(table):
+            table.extend([None] * (index + 1 - len(table)))
+        table[index] = value
+
+    def _compile(self):
+        mode = self.config.get('mode')
+        if mode not in (1, 2):
+            raise ValueError(f"mode must be 1 or 2, got {mode!r}")
+        if mode == 2:
+            stick_ops = (
+                ('Left', 'LR', self.STICK_TURN_LR),
+                ('Left', 'UD', self.STICK_UP_DOWN),
+                ('Right', 'LR', self.STICK_MOVE_LR),
+                ('Right', 'UD', self.STICK_MOVE_FB),
+            )
+        else: # mode1
+            stick_ops = (
+                ('Left', 'LR', self.STICK_TURN_LR),
+                ('Left', 'UD', self.STICK_MOVE_FB),
+                ('Right', 'LR', self.STICK_MOVE_LR),
+                ('Right', 'UD', self.STICK_UP_DOWN),
+            )
+        sticks = self.config.get('stick')
+        if not isinstance(sticks, dict):
+            raise ValueError("stick must be an object")
+        for side, axis, op_index in stick_ops:
+            name = f"stick.{side}.{axis}"
+            entry = sticks.get(side, {}).get(axis)
+            index = self._index(entry, name)
+            if index < len(self.stick_ops) and self.stick_ops[index] is not None:
+                raise ValueError(f"{name}.index {index} is assigned to more than one stick")
+            conversion = entry.get('conversion')
+            if conversion is not None:
+                try:
+                    conversion = {
+                        'paramA': float(conversion['paramA']),
+                        'paramB': float(conversion['paramB']),
+                        'paramC': float(conversion.get('paramC', 0.0)),
+                    }
+                except (KeyError, TypeError, ValueError) as e:
+                    raise ValueError(f"{name}.conversion needs numeric paramA/paramB: {e}")
+            discretize = entry.get('discretize')
+            if discretize is not None and (not isinstance(discretize, (int, float)) or discretize <= 0):
+                raise ValueError(f"{name}.discretize must be a positive number, got {discretize!r}")
+            feature = dict(entry)
+            feature.update({
+                'conversion': conversion,
+                'discretize': discretize,
+                'average': bool(entry.get('average', False)),
+                'valueInverse': bool(entry.get('valueInverse', False)),
+            })
+            self._put(self.stick_ops, index, op_index)
+            self._put(self.stick_features, index, feature)
+
+        events = self.config.get('Event', {})
+        if not isinstance(events, dict):
+            raise ValueError("Event must be an object")
+        for name, op_index in self.EVENT_OPS:
+            entry = events.get(name)
+            if entry is None:
+                continue
+            index = self._index(entry, f"Event.{name}")
+            if index < len(self.event_ops) and self.event_ops[index] is not None:
+                raise ValueError(f"Event.{name}.index {index} is assigned to more than one event")
+            feature = dict(entry)
+            feature.update({
+                'type': entry.get('type', 'toggle'),
+                'off': entry.get('off', 'up'),
+                'on': entry.get('on', 'down'),
+            })
+            if feature['on'] not in self.SWITCH_STATES or feature['off'] not in self.SWITCH_STATES:
+                raise ValueError(f"Event.{name}.on/off must be 'up' or 'down'")
+            self._put(self.event_ops, index, op_index)
+            self._put(self.switch_features, index, feature)
 
     def get_event_op_index(self, switch_index):
         """
@@ -43,15 +154,9 @@ class RcConfig:
         
         Returns the corresponding index.
         """
-        event_op_map = {
-            self.config['Event']['RadioControlEnable']['index']: self.SWITCH_RADIO_CONTROL_ENABLE,
-            self.config['Event']['GrabBaggage']['index']: self.SWITCH_GRAB_BAGGAGE,
-            self.config['Event']['Camera']['index']: self.SWITCH_CAMERA_SHOT,
-            self.config['Event']['CameraMoveUp']['index']: self.SWITCH_CAMERA_MOVE_UP,
-            self.config['Event']['CameraMoveDown']['index']: self.SWITCH_CAMERA_MOVE_DOWN,
-            self.config['Event']['ReturnHome']['index']: self.SWITCH_RETURN_HOME
-        }
-        return event_op_map.get(switch_index, None)
+        if 0 <= switch_index < len(self.event_ops):
+            return self.event_ops[switch_index]
+        return None
 
     def get_switch_feature(self, switch_index):
         """
@@ -59,23 +164,9 @@ class RcConfig:
         
         Returns the corresponding switch feature dictionary.
         """
-        feature_map = {
-            self.config['Event']['RadioControlEnable']['index']: self.config['Event']['RadioControlEnable'],
-            self.config['Event']['Camera']['index']: self.config['Event']['Camera'],
-            self.config['Event']['GrabBaggage']['index']: self.config['Event']['GrabBaggage'],
-            self.config['Event']['CameraMoveUp']['index']: self.config['Event']['CameraMoveUp'],
-            self.config['Event']['CameraMoveDown']['index']: self.config['Event']['CameraMoveDown'],
-            self.config['Event']['ReturnHome']['index']: self.config['Event']['ReturnHome']
-        }
-        feature = feature_map.get(switch_index, None)
-        if feature:
-            feature['type'] = feature.get('type', 'toggle')
-            feature['off'] = feature.get('off', 'up')
-            feature['on'] = feature.get('on', 'down')
-        else:
-            print(f"WARNING: Feature for switch index {switch_index} not found.")
-            return None
- 
+        feature = self.switch_features[switch_index] if 0 <= switch_index < len(self.switch_features) else None
+        if feature is None:
+            logger.warning("Feature for switch index %s not found.", switch_index)
         return feature
 
     def get_op_index(self, stick_index):
@@ -84,22 +175,9 @@ class RcConfig:
         
         Returns the corresponding index.
         """
-        if self.config['mode'] == 2:
-            op_map = {
-                self.config['stick']['Left']['LR']['index']: self.STICK_TURN_LR,
-                self.config['stick']['Left']['UD']['index']: self.STICK_UP_DOWN,
-                self.config['stick']['Right']['LR']['index']: self.STICK_MOVE_LR,
-                self.config['stick']['Right']['UD']['index']: self.STICK_MOVE_FB
-            }
-        else: # mode1
-            op_map = {
-                self.config['stick']['Left']['LR']['index']: self.STICK_TURN_LR,
-                self.config['stick']['Left']['UD']['index']: self.STICK_MOVE_FB,
-                self.config['stick']['Right']['LR']['index']: self.STICK_MOVE_LR,
-                self.config['stick']['Right']['UD']['index']: self.STICK_UP_DOWN
-            }
-
-        return op_map.get(stick_index, None)
+        if 0 <= stick_index < len(self.stick_ops):
+            return self.stick_ops[stick_index]
+        return None
 
     def get_stick_feature(self, stick_index):
         """
@@ -107,28 +185,16 @@ class RcConfig:
         
         Returns the corresponding stick feature dictionary.
         """
-        feature_map = {
-            self.config['stick']['Left']['LR']['index']: self.config['stick']['Left']['LR'],
-            self.config['stick']['Left']['UD']['index']: self.config['stick']['Left']['UD'],
-            self.config['stick']['Right']['LR']['index']: self.config['stick']['Right']['LR'],
-            self.config['stick']['Right']['UD']['index']: self.config['stick']['Right']['UD']
-        }
-        feature = feature_map.get(stick_index, None)
-        if feature:
-            feature['conversion'] = feature.get('conversion', None)
-            feature['discretize'] = feature.get('discretize', None)
-            feature['average'] = feature.get('average', False)
-            feature['valueInverse'] = feature.get('valueInverse', False)
-        else:
+        feature = self.stick_features[stick_index] if 0 <= stick_index < len(self.stick_features) else None
+        if feature is None:
             raise ValueError(f"Feature for stick index {stick_index} not found.")
- 
         return feature
 
 class StickMonitor:
     def __init__(self, config: RcConfig):
         self.rc_config = config
-        self.stick_history = {0: [], 1: [], 2: [], 3: [], 4: [], 5: []}
         self.history_len = 5
+        self.stick_history = {op_index: deque(maxlen=self.history_len) for op_index in range(6)}
         self.switch_states = {}
     
     def stick_value(self, stick_index, stick_value) -> float:
@@ -149,6 +215,18 @@ class StickMonitor:
             v = self.discretized_stick_value(v, feature['discretize'])
 
         return v
+
+    def stick_frame(self, axis_values):
+        """
+        全軸の値(1サンプル分)を変換し、op index順の値(STICK_*の4要素、割り当ての無い操作は0.0)を返す
+        1サンプルではNumPyの呼び出しより軸ごとのスカラー計算の方が速いため、stick_valueで変換する
+        """
+        ops = [0.0] * 4
+        for axis, value in enumerate(axis_values):
+            op_index = self.rc_config.get_op_index(axis)
+            if op_index is not None:
+                ops[op_index] = self.stick_value(axis, value)
+        return ops
     
     def switch_event(self, switch_index: int, down: bool) -> bool:
         """
@@ -196,8 +274,6 @@ class StickMonitor:
         """
         history = self.stick_history[op_index]
         history.append(new_value)
-        if len(history) > self.history_len:
-            history.pop(0)
         return sum(history) / len(history)
     
     def cubic_stick_value(self, x: float, a_value: float, b_value: float, c_value: float = 0.0, d_value: float = 0.0) -> float:
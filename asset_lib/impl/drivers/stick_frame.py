@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from typing import Sequence
+import numpy as np
+
+from asset_lib.impl.drivers.rc_utils import RcConfig
+
+# スティック操作の数 (RcConfig.STICK_*)
+NUM_STICK_OPS = 4
+
+class StickFrameProcessor:
+    """
+    Frame-oriented version of StickMonitor.stick_value.
+
+    process() takes the values of all axes of one sample and applies averaging (fixed
+    size ring buffers), the cubic response curve, inversion and discretization to every
+    mapped axis in one vectorized pass. Every step does the same IEEE operations in the
+    same order as the per-axis path, so the results are identical. The powers of the cubic
+    are taken with Python's float power, like cubic_stick_value does.
+
+    A NumPy call has a fixed overhead that is larger than the scalar work for a handful of
+    axes, so this only pays off with process_block() on several samples at once; single
+    samples are cheaper through StickMonitor.stick_frame.
+
+    NumPy is not a dependency of the bridge; it is installed with benchmarks/requirements.txt.
+
+    The processor keeps its own averaging history. Feed one input stream either to it or
+    to a StickMonitor, not to both.
+    """
+    def __init__(self, rc_config: RcConfig, history_len: int = 5):
+        self.rc_config = rc_config
+        columns = [(axis, op_index) for axis, op_index in enumerate(rc_config.stick_ops) if op_index is not None]
+        features = [rc_config.get_stick_feature(axis) for axis, _ in columns]
+        self.axes = np.array([axis for axis, _ in columns], dtype=np.intp)
+        self.op_indices = np.array([op_index for _, op_index in columns], dtype=np.intp)
+        self.num_axes = int(self.axes.max()) + 1 if len(columns) else 0
+
+        self.average = np.array([f['average'] for f in features], dtype=bool)
+        self.any_average = bool(self.average.any())
+        self.convert = np.array([f['conversion'] is not None for f in features], dtype=bool)
+        self.any_convert = bool(self.convert.any())
+        self.param_a = np.array([f['conversion']['paramA'] if f['conversion'] else 0.0 for f in features])
+        self.param_b = np.array([f['conversion']['paramB'] if f['conversion'] else 0.0 for f in features])
+        self.param_c = np.array([f['conversion']['paramC'] if f['conversion'] else 0.0 for f in features])
+        self.inverse = np.array([f['valueInverse'] for f in features], dtype=bool)
+        self.sign = np.where(self.inverse, -1.0, 1.0)
+        self.discretize = np.array([f['discretize'] is not None for f in features], dtype=bool)
+        self.any_discretize = bool(self.discretize.any())
+        self.split = np.array([f['discretize'] if f['discretize'] is not None else 1.0 for f in features], dtype=float)
+
+        # 平均用のリングバッファ (行=サンプル、列=軸)
+        self.history_len = history_len
+        self.history = np.zeros((history_len, len(columns)))
+        self.history_pos = 0
+        self.history_count = 0
+
+
+    def reset(self):
+        self.history_pos = 0
+        self.history_count = 0
+
+    def _columns(self, values: np.ndarray) -> np.ndarray:
+        # 足りない軸は0(中立)として扱う
+        if values.shape[-1] < self.num_axes:
+            pad = np.zeros(values.shape[:-1] + (self.num_axes - values.shape[-1],))
+            values = np.concatenate((values, pad), axis=-1)
+        return values[..., self.axes]
+
+    def _finish(self, v: np.ndarray) -> np.ndarray:
+        if self.any_convert:
+            v = np.where(self.convert, self._response(v), v)
+
+        v = v * self.sign
+
+        if self.any_discretize:
+            # +0.0で-0.0を0.0に揃える (round()はintを返すため符号付きゼロにならない)
+            v = np.where(self.discretize, np.rint(v / self.split) * self.split + 0.0, v)
+        return v
+
+    def process(self, axis_values: Sequence[float]) -> np.ndarray:
+        """Process one sample. Returns the values of the mapped axes, in the order of self.axes."""
+        v = self._columns(np.asarray(axis_values, dtype=float))
+        if self.any_average:
+            v = np.where(self.average, self._average(v), v)
+        return self._finish(v)
+
+    def process_block(self, samples) -> np.ndarray:
+        """
+        Process consecutive samples (shape: samples x axes) in one pass, e.g. everything
+        sampled since the last frame. Same results as calling process() for each row.
+        """
+        v = self._columns(np.asarray(samples, dtype=float).reshape(len(samples), -1))
+        if self.any_average:
+            v = np.where(self.average, self._average_block(v), v)
+        return self._finish(v)
+
+    def _average(self, v: np.ndarray) -> np.ndarray:
+        history = self.history
+        history[self.history_pos] = v
+        self.history_pos = (self.history_pos + 1) % self.history_len
+        if self.history_count < self.history_len:
+            self.history_count += 1
+        count = self.history_count
+        # sum()と同じく0.0から古い順に足す (per-axis実装と加算順を揃えて結果を一致させる)
+        first = (self.history_pos - count) % self.history_len
+        total = history[first] + 0.0
+        for k in range(1, count):
+            total += history[(first + k) % self.history_len]
+        return total / count
+
+    def _average_block(self, v: np.ndarray) -> np.ndarray:
+        length = self.history_len
+        count = self.history_count
+        rows = len(v)
+        # 履歴(古い順)の前に0行を置き、各行の窓をlength個の位置ずらしで足す
+        # 0.0の加算は値を変えないため、窓が満たない行もsum()と同じ結果になる
+        ext = np.zeros((length - 1 + count + rows, v.shape[1]))
+        first = (self.history_pos - count) % length
+        ext[length - 1:length - 1 + count] = np.roll(self.history, -first, axis=0)[:count]
+        ext[length - 1 + count:] = v
+        total = np.zeros_like(v)
+        start = count
+        for k in range(length):
+            total += ext[start + k:start + k + rows]
+        averaged = total / np.minimum(np.arange(count + 1, count + rows + 1), length)[:, None]
+
+        # 最新のlength行をリングバッファへ戻す
+        recent = ext[length - 1:][-length:]
+        self.history_count = min(count + rows, length)
+        self.history[:len(recent)] = recent
+        self.history_pos = len(recent) % length
+        return averaged
+
+    def _response(self, x: np.ndarray) -> np.ndarray:
+        # x**3, x**2はper-axis実装と同じくfloatのべき乗(libmのpow)で求める
+        # (np.powerはSIMD実装、乗算は丸め方が異なり、結果が一致しない場合がある)
+        xo = x.astype(object)
+        y = self.param_a * (xo ** 3).astype(float) + self.param_b * (xo ** 2).astype(float) + self.param_c * x + 0.0
+        return np.clip(y, -1.0, 1.0)
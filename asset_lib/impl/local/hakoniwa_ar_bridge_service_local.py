@@ -1,22 +1,31 @@
 import json
 import socket
-import time
 import os
-import logging
+import threading
+from asset_lib.impl import log
 from asset_lib.impl.comm.udp_comm import UdpComm
-from asset_lib.impl.drivers.joystick_input_handler import JoystickInputHandler
+from asset_lib.impl.config_writer import ConfigWriter, DEFAULT_SAVE_DEBOUNCE_SEC
+from asset_lib.impl.drivers.joystick_input_handler import JoystickInputHandler, INPUT_MODE_POLL
 from asset_lib.impl.drivers.rc_utils import RcConfig, StickMonitor
 from asset_lib.impl.local.sync_manager_local import SyncManagerLocal
+from asset_lib.impl.metrics import ProgressCounter, node_metrics
+from asset_lib.impl.scheduler import TimerWheel
+from asset_lib.impl.sync_manager_base import DEFAULT_HEARTBEAT_TIMEOUT_SEC
 from asset_lib.playing.rc_custom import do_radio_control
 
 # デフォルトのJSONファイルパス
 DEFAULT_CONFIG_PATH = "rc_config/ps4-control.json"
+# ハートビートに載せる値 (local用設定ファイルに無い場合)
+DEFAULT_POSITIONING_SPEED = {"rotation": 20.0, "move": 0.2}
+DEFAULT_PLAYER = {"type": "dji", "name": "Local"}
+# stop_serviceがrunのループの終了を待つ最大時間
+STOP_TIMEOUT_SEC = 2.0
 
-# ロギングの設定
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = log.get_logger("local")
 
 class HakoniwaARBridgeServiceLocal:
-    def __init__(self, config_path: str, my_ip: str, ar_ip: str, web_ip: str, rc_config_path: str = None):
+    def __init__(self, config_path: str, my_ip: str, ar_ip: str, web_ip: str, rc_config_path: str = None,
+                 scheduler: TimerWheel = None):
         # 設定ファイルの読み込み
         self.config = self.load_config(config_path)
         self.my_ip = my_ip or self.get_local_ip()
@@ -25,7 +34,18 @@ class HakoniwaARBridgeServiceLocal:
         self.server_udp_port = self.config.get("server_udp_port", 48528)
         self.ar_port = self.config.get("ar_port", 38528)
         self.output_file = self.config.get("output_file",config_path)
+        # 読み込んだ内容と同じなら書き直さない (出力先が別ファイルの場合はその内容を知らない)
+        self.config_writer = ConfigWriter(self.output_file, self.config.get("save_debounce_sec", DEFAULT_SAVE_DEBOUNCE_SEC), scheduler,
+                                          self.config if self.output_file == config_path else None)
         self.custom_config_path = self.config.get("custom_config_path")
+        # runのループ(ジョイスティック/ラジコン操作)を止めるためのイベント
+        self.stop_event = threading.Event()
+        # runのループを実行中のスレッドと、ループを抜けたことを知らせるイベント
+        self.run_thread = None
+        self.run_done = threading.Event()
+        self.run_done.set()
+        # runのループ(位置決め/ラジコン操作の内側のループを含む)が回っていることを示す回数
+        self.progress = ProgressCounter()
 
         # RcConfigとStickMonitorの初期化
         if rc_config_path is None:
@@ -34,26 +54,36 @@ class HakoniwaARBridgeServiceLocal:
             raise FileNotFoundError(f"Config file not found at '{rc_config_path}'")
 
         rc_config = RcConfig(rc_config_path)
-        print("Controller: ", rc_config_path)
-        print("Mode: ", rc_config.config['mode'])
+        logger.info("Controller: %s, Mode: %s", rc_config_path, rc_config.config['mode'])
         self.stick_monitor = StickMonitor(rc_config)
 
         # UDP通信サービスとSyncManagerの初期化
-        self.udp_service = UdpComm(recv_ip=self.my_ip, recv_port=self.server_udp_port, send_ip=self.ar_ip, send_port=self.ar_port)
-        self.sync_manager = SyncManagerLocal(self.web_ip, self.udp_service, 5, self.config['position'], self.cofnig['rotation'])
-        self.joystick_input = JoystickInputHandler(self.config['position'], self.config['rotation'], self.sync_manager, self.save_to_json, self.stick_monitor)
+        self.udp_service = UdpComm(recv_ip=self.my_ip, recv_port=self.server_udp_port, send_ip=self.ar_ip, send_port=self.ar_port, codecs=self.config.get("codecs"),
+                                  recv_buffer_size=self.config.get("recv_buffer_size"), so_rcvbuf=self.config.get("so_rcvbuf"),
+                                  recv_batch_size=self.config.get("recv_batch_size"), sequence=self.config.get("sequence", False),
+                                  rtt_window=self.config.get("rtt_window"))
+        self.sync_manager = SyncManagerLocal(self.web_ip, self.udp_service, self.config.get("heartbeat_timeout_sec", DEFAULT_HEARTBEAT_TIMEOUT_SEC),
+                                             self.config.get('positioning_speed', DEFAULT_POSITIONING_SPEED),
+                                             self.config['position'], self.config['rotation'],
+                                             self.config.get('player', DEFAULT_PLAYER), self.config.get('avatars', []),
+                                             self.config.get('pose_stream'), scheduler,
+                                             self.config.get("heartbeat_interval_sec"), self.config.get("liveness_interval_sec"),
+                                             self.config.get("failure_detector"))
+        self.joystick_input = JoystickInputHandler(self.config['position'], self.config['rotation'], self.sync_manager, self.save_to_json, self.stick_monitor,
+                                                   self.config.get('positioning_speed', DEFAULT_POSITIONING_SPEED),
+                                                   self.config.get('input_mode', INPUT_MODE_POLL), self.stop_event, self.progress)
 
     def load_config(self, config_path):
         try:
             with open(config_path, 'r') as file:
                 config_data = json.load(file)
-                logging.info("Config loaded successfully: %s", config_data)
+                logger.debug("Config loaded successfully: %s", config_data)
                 return config_data
         except FileNotFoundError:
-            logging.error("Error: Config file not found at %s", config_path)
+            logger.error("Error: Config file not found at %s", config_path)
             return {}
         except json.JSONDecodeError as e:
-            logging.error("Error: Failed to decode JSON from %s: %s", config_path, e)
+            logger.error("Error: Failed to decode JSON from %s: %s", config_path, e)
             return {}
 
     def get_local_ip(self):
@@ -62,7 +92,7 @@ class HakoniwaARBridgeServiceLocal:
             s.connect(("8.8.8.8", 80))
             local_ip = s.getsockname()[0]
         except Exception as e:
-            logging.error("Error obtaining local IP address: %s", e)
+            logger.error("Error obtaining local IP address: %s", e)
             local_ip = "127.0.0.1"
         finally:
             s.close()
@@ -70,49 +100,87 @@ class HakoniwaARBridgeServiceLocal:
 
     def save_to_json(self, position, rotation):
         """指定したファイルに位置と回転情報を保存"""
-        data = {
+        # 未知の設定項目(pose_stream等)も保持したまま位置と回転を更新する
+        data = dict(self.config)
+        data.update({
             "ar_ip": self.ar_ip,
             "server_udp_port": self.server_udp_port,
             "adjustments": self.config["adjustments"],
             "custom_config_path": self.custom_config_path,
             "position": position, 
             "rotation": rotation
-        }
-        try:
-            with open(self.output_file, 'w') as f:
-                json.dump(data, f, indent=4)
-            #logging.info("Saved current state to %s", self.output_file)
-        except IOError as e:
-            logging.error("Error saving to file %s: %s", self.output_file, e)
+        })
+        # ファイル書き込みは書き込みスレッドがまとめて行う
+        self.config_writer.update(data)
 
     def start_service(self):
         """SyncManagerサービスの開始"""
         try:
+            self.config_writer.start()
             self.sync_manager.start_service()
-            logging.info("Using My IP: %s", self.my_ip)
-            logging.info("Using AR IP: %s", self.ar_ip)
-            logging.info("Using Web Server IP: %s", self.web_ip)
-            logging.info("Receiving on port: %d, Sending on port: %d", self.server_udp_port, self.ar_port)
-            logging.info("Config: %s", self.config)
+            logger.info("Using My IP: %s", self.my_ip)
+            logger.info("Using AR IP: %s", self.ar_ip)
+            logger.info("Using Web Server IP: %s", self.web_ip)
+            logger.info("Receiving on port: %d, Sending on port: %d", self.server_udp_port, self.ar_port)
+            logger.info("Config: %s", self.config)
+        except Exception as e:
+            logger.error("Error starting SyncManager service: %s", e)
+
+    async def start_service_async(self):
+        """SyncManagerサービスをイベントループ上で開始 (ジョイスティック処理はrunで別スレッド実行)"""
+        try:
+            self.config_writer.start()
+            await self.sync_manager.start_service_async()
+            logger.info("Using My IP: %s", self.my_ip)
+            logger.info("Using AR IP: %s", self.ar_ip)
+            logger.info("Using Web Server IP: %s", self.web_ip)
+            logger.info("Receiving on port: %d, Sending on port: %d", self.server_udp_port, self.ar_port)
         except Exception as e:
-            logging.error("Error starting SyncManager service: %s", e)
+            logger.error("Error starting SyncManager service: %s", e)
+
+    def stop_service(self):
+        """runのループとSyncManagerサービスを止め、未保存の設定を書き出す"""
+        self.stop_event.set()
+        # 接続待ちのループを起こし、ループが抜けてからソケットを閉じる
+        self.udp_service.wakeup()
+        if self.run_thread is not threading.current_thread():
+            self.run_done.wait(STOP_TIMEOUT_SEC)
+        self.sync_manager.stop_service()
+        self.config_writer.stop()
+
+    def metrics(self):
+        # ジョイスティックのループは自身の統計を終了時に出力する
+        return node_metrics(self.sync_manager.player['name'], "local", self.sync_manager, self.udp_service, self.config_writer,
+                            progress=self.progress)
 
     def run(self):
-        """サービスのメインループ"""
+        """サービスのメインループ (stop_serviceで抜ける)"""
+        self.run_thread = threading.current_thread()
+        self.run_done.clear()
         try:
-            while True:
+            while not self.stop_event.is_set():
+                self.progress.tick()
                 status = self.sync_manager.get_sync_status()
-                logging.info("sync_status: %s", status)
+                # 状態の確認は毎周回行うのでDEBUG
+                logger.debug("sync_status: %s", status)
                 if status == "POSITIONING":
                     ret = self.joystick_input.handle_input(self.config)
                     if ret == True:
                         self.sync_manager.start_play()
                 elif status == "PLAYING":
-                    ret = do_radio_control(self.sync_manager, self.custom_config_path, self.stick_monitor)
-                    if ret != 0:
+                    ret = do_radio_control(self.sync_manager, self.custom_config_path, self.stick_monitor,
+                                           self.config.get("control_rate_hz"), self.config.get("joystick_keepalive_sec"),
+                                           self.config.get("camera_capture_dir"),
+                                           self.config.get("simulator"), self.config.get("simulator_options"),
+                                           self.stop_event, self.progress)
+                    if ret != 0 and not self.stop_event.is_set():
                         self.sync_manager.reset()
                 else:
-                    time.sleep(1)
+                    # 接続(状態変化)はハートビート処理がwakeupで知らせる
+                    self.udp_service.wait_for((), 1.0)
         except KeyboardInterrupt:
-            logging.info("Service stopped by user.")
-            self.sync_manager.stop_service()
\ No newline at end of file
+            logger.info("Service stopped by user.")
+            self.stop_service()
+        finally:
+            self.run_thread = None
+            self.run_done.set()
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Logging for the bridge.
+
+Every module logs through get_logger(subsystem), a child of the "hakoniwa" logger. Records
+are put on a bounded queue by a QueueHandler and written by one background thread, so a
+control loop never blocks on stdout. Before a record is queued:
+
+- its level is checked against the subsystem's level (set_level() changes it at runtime),
+- a 1-in-N sample can be requested per call (extra={"sample": N}),
+- a token bucket per message key drops floods. The key is extra={"key": ...} if given,
+  otherwise the logger, the message template and the node. The number of dropped
+  records is added to the next record of that key that gets through.
+
+Structured fields (node, peer, packet) are passed as extra or bound with get_logger(...,
+node=name) and are appended to the line as key=value.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+ROOT = "hakoniwa"
+SUBSYSTEMS = ("main", "comm", "sync", "device", "local", "input", "control", "config", "metrics", "scheduler")
+FIELDS = ("node", "peer", "packet")
+
+DEFAULT_RATE_PER_SEC = 10.0
+DEFAULT_BURST = 20
+DEFAULT_QUEUE_SIZE = 10000
+
+class RateLimitFilter(logging.Filter):
+    """Per-key token bucket and sampling, applied in the calling thread before queueing."""
+    def __init__(self, rate_per_sec: float = DEFAULT_RATE_PER_SEC, burst: int = DEFAULT_BURST,
+                 rate_limits: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        # キー別の上限 (1秒あたり)。0以下なら制限しない
+        self.rate_limits = dict(rate_limits or {})
+        self.lock = threading.Lock()
+        # key => [tokens, last_time, suppressed, seen]
+        self.buckets: Dict[Any, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "key", None)
+        if key is None:
+            key = (record.name, record.msg, getattr(record, "node", None))
+        rate = self.rate_limits.get(key, self.rate_per_sec) if isinstance(key, str) else self.rate_per_sec
+        sample = getattr(record, "sample", 1) or 1
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [float(self.burst), now, 0, 0]
+            bucket[3] += 1
+            if sample > 1 and (bucket[3] - 1) % sample:
+                return False
+            if rate > 0:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] < 1.0:
+                    bucket[2] += 1
+                    return False
+                bucket[0] -= 1.0
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(subsystem)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.subsystem = record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + ".") else record.name
+        line = super().format(record)
+        fields = [f"{name}={_field(getattr(record, name))}" for name in FIELDS if getattr(record, name, None) is not None]
+        if fields:
+            line = f"{line} [{' '.join(fields)}]"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line = f"{line} (+{suppressed} suppressed)"
+        return line
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full instead of blocking."""
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 引数の展開だけ行い、行の整形は書き込みスレッドに任せる
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout (so contextlib.redirect_stdout keeps working)."""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    def emit(self, record: logging.LogRecord):
+        self.stream = sys.stdout
+        super().emit(record)
+
+class StructuredLogger(logging.LoggerAdapter):
+    """LoggerAdapter that merges its bound fields with the extra of each call."""
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = dict(self.extra, **extra) if extra else self.extra
+        return msg, kwargs
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[_QueueHandler] = None
+_rate_filter: Optional[RateLimitFilter] = None
+
+def configure(options: Optional[Dict[str, Any]] = None):
+    """
+    Install the queue handler and start the writer thread (once; later calls only apply levels).
+
+    options (the "logging" section of node.json): level, levels {subsystem: level},
+    rate_per_sec, burst, rate_limits {key: rate}, queue_size, file.
+    """
+    global _listener, _handler, _rate_filter
+    options = options or {}
+    root = logging.getLogger(ROOT)
+    with _lock:
+        if _listener is None:
+            _rate_filter = RateLimitFilter(options.get("rate_per_sec", DEFAULT_RATE_PER_SEC), options.get("burst", DEFAULT_BURST),
+                                           options.get("rate_limits"))
+            _handler = _QueueHandler(queue.Queue(options.get("queue_size", DEFAULT_QUEUE_SIZE)))
+            _handler.addFilter(_rate_filter)
+            output = logging.FileHandler(options["file"]) if options.get("file") else _StdoutHandler()
+            output.setFormatter(StructuredFormatter())
+            _listener = logging.handlers.QueueListener(_handler.queue, output)
+            _listener.start()
+            root.addHandler(_handler)
+            # ルートロガー(basicConfig等)への二重出力を避ける
+            root.propagate = False
+            # 終了時に書き込み待ちのログを書き出す
+            atexit.register(shutdown)
+    root.setLevel(_level(options.get("level", "INFO")))
+    for subsystem, level in (options.get("levels") or {}).items():
+        set_level(subsystem, level)
+
+def shutdown():
+    """Write what is still queued and stop the writer thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            logging.getLogger(ROOT).removeHandler(_handler)
+
+def get_logger(subsystem: str, **fields) -> StructuredLogger:
+    """Logger of a subsystem, with structured fields (node=..., peer=...) bound to every record."""
+    return StructuredLogger(logging.getLogger(f"{ROOT}.{subsystem}"), fields)
+
+def set_level(subsystem: Optional[str], level) -> None:
+    """Change the level of one subsystem (or of all when subsystem is empty) at runtime."""
+    logging.getLogger(f"{ROOT}.{subsystem}" if subsystem else ROOT).setLevel(_level(level))
+
+def get_levels() -> Dict[str, str]:
+    levels = {"": logging.getLevelName(logging.getLogger(ROOT).level)}
+    for subsystem in SUBSYSTEMS:
+        logger = logging.getLogger(f"{ROOT}.{subsystem}")
+        levels[subsystem] = logging.getLevelName(logger.getEffectiveLevel())
+    return levels
+
+def stats() -> Dict[str, int]:
+    """Records dropped because the queue was full, and records waiting to be written."""
+    if _handler is None:
+        return {"dropped": 0, "queued": 0}
+    return {"dropped": _handler.dropped, "queued": _handler.queue.qsize()}
+
+def _field(value) -> str:
+    # (ip, port) は ip:port で表示する
+    if isinstance(value, tuple) and len(value) == 2:
+        return f"{value[0]}:{value[1]}"
+    return str(value)
+
+def _level(level) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
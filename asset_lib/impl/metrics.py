@@ -0,0 +1,306 @@
+import bisect
+import http.server
+import json
+import os
+import socket
+import socketserver
+import threading
+import urllib.parse
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from asset_lib.impl import log
+
+# ループ1回の処理時間のヒストグラム境界 (秒)
+LOOP_BUCKETS_SEC = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+METRIC_PREFIX = "hakoniwa_ar_"
+
+logger = log.get_logger("metrics")
+
+class Histogram:
+    """
+    Fixed-bucket histogram with preallocated counts (Prometheus semantics: value <= bound).
+
+    observe() does no allocation, so it can stay on in the receive and service loops. Each
+    histogram has a single writer; readers may see a snapshot that is one sample behind.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds=LOOP_BUCKETS_SEC):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            cumulative.append([bound, running])
+        return {"buckets": cumulative, "sum": self.total, "count": self.count}
+
+class ProgressCounter:
+    """
+    Iterations of a service loop (including the joystick loops of a local node).
+
+    A worker's report carries the count of every node, and the supervisor restarts a
+    worker whose counters stop advancing. Single writer, read without locks.
+    """
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def tick(self):
+        self.count += 1
+
+def node_metrics(name: str, kind: str, sync_manager, udp_service, config_writer, service_loop: Optional[Histogram] = None,
+                 progress: Optional[ProgressCounter] = None) -> Dict[str, Any]:
+    """Snapshot of one node's counters (read without locks; each counter has a single writer)."""
+    state_management = sync_manager.state_management
+    heartbeat = sync_manager.service
+    return {
+        "node": name,
+        "type": kind,
+        "state": {state.name: state is state_management.state for state in type(state_management.state)},
+        "transitions": dict(state_management.transitions),
+        "heartbeat": {"sent": heartbeat.heartbeats_sent, "timeouts": heartbeat.heartbeat_timeouts,
+                      "suspicions": heartbeat.suspicions, "phi": heartbeat.phi},
+        "comm": udp_service.get_metrics(),
+        "service_loop": service_loop.snapshot() if service_loop is not None else None,
+        "progress": progress.count if progress is not None else None,
+        "config": config_writer.stats(),
+    }
+
+class _Family:
+    __slots__ = ('kind', 'help', 'samples')
+
+    def __init__(self, kind: str, help_text: str):
+        self.kind = kind
+        self.help = help_text
+        self.samples: List[Tuple[str, Dict[str, Any], float]] = []
+
+class PrometheusWriter:
+    """Collects samples by metric family and renders the Prometheus text format (0.0.4)."""
+    def __init__(self):
+        self.families: Dict[str, _Family] = {}
+
+    def add(self, name: str, kind: str, help_text: str, labels: Dict[str, Any], value):
+        if value is None:
+            return
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = _Family(kind, help_text)
+        family.samples.append((name, labels, value))
+
+    def add_histogram(self, name: str, help_text: str, labels: Dict[str, Any], histogram: Optional[Dict[str, Any]]):
+        if not histogram:
+            return
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = _Family("histogram", help_text)
+        for bound, count in histogram["buckets"]:
+            family.samples.append((name + "_bucket", dict(labels, le=repr(bound)), count))
+        family.samples.append((name + "_bucket", dict(labels, le="+Inf"), histogram["count"]))
+        family.samples.append((name + "_sum", labels, histogram["sum"]))
+        family.samples.append((name + "_count", labels, histogram["count"]))
+
+    def render(self) -> str:
+        lines = []
+        for name, family in self.families.items():
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for sample_name, labels, value in family.samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        text = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{key}="{text}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+def format_prometheus(snapshot: Dict[str, Any]) -> str:
+    """Render a container metrics snapshot (HakoniwaARBridgeServiceContainer.metrics_snapshot)."""
+    out = PrometheusWriter()
+    p = METRIC_PREFIX
+    for node in snapshot.get("nodes", []):
+        labels = {"node": node["node"], "kind": node["type"]}
+        for state, active in node.get("state", {}).items():
+            out.add(p + "sync_state", "gauge", "1 for the current sync state of the node.", dict(labels, state=state), active)
+        for transition, count in node.get("transitions", {}).items():
+            source, target = transition.split("->")
+            out.add(p + "state_transitions_total", "counter", "Sync state transitions.", dict(labels, source=source, target=target), count)
+        heartbeat = node.get("heartbeat", {})
+        out.add(p + "heartbeats_sent_total", "counter", "Heartbeat requests sent.", labels, heartbeat.get("sent"))
+        out.add(p + "heartbeat_timeouts_total", "counter", "Heartbeat timeouts (AR device considered disconnected).", labels, heartbeat.get("timeouts"))
+        out.add(p + "liveness_suspicions_total", "counter", "Times the AR device became suspected.", labels, heartbeat.get("suspicions"))
+        out.add(p + "liveness_phi", "gauge", "Current phi-accrual suspicion level of the AR device.", labels, heartbeat.get("phi"))
+        comm = node.get("comm", {})
+        for packet_type, count in comm.get("rx", {}).items():
+            out.add(p + "rx_packets_total", "counter", "Packets received by type.", dict(labels, type=packet_type), count)
+        for packet_type, count in comm.get("tx", {}).items():
+            out.add(p + "tx_packets_total", "counter", "Packets sent by type.", dict(labels, type=packet_type), count)
+        out.add(p + "decode_errors_total", "counter", "Datagrams with a malformed body.", labels, comm.get("decode_errors"))
+        out.add(p + "rejected_packets_total", "counter", "Binary datagrams rejected by their header.", labels, comm.get("rejected"))
+        out.add(p + "unknown_packets_total", "counter", "Datagrams of an unknown packet type.", labels, comm.get("unknown"))
+        for key, name in (("lost", "sequence_lost"), ("reordered", "sequence_reordered"), ("duplicates", "sequence_duplicates"), ("stale", "sequence_stale")):
+            out.add(p + name + "_total", "counter", f"Sequenced packets counted as {key}.", labels, comm.get("sequence", {}).get(key))
+        rtt = comm.get("rtt", {})
+        for key in ("min_ms", "p50_ms", "p99_ms", "max_ms", "jitter_ms"):
+            out.add(p + "heartbeat_rtt_" + key, "gauge", f"Heartbeat round-trip time ({key[:-3]}) over the rolling window, ms.", labels, rtt.get(key))
+        out.add(p + "heartbeat_rtt_lost_total", "counter", "Heartbeat probes without an echo.", labels, rtt.get("lost"))
+        _add_socket(out, labels, comm.get("socket"))
+        out.add_histogram(p + "service_loop_seconds", "Service loop iteration time.", labels, node.get("service_loop"))
+        out.add(p + "service_loop_iterations_total", "counter", "Service loop iterations (stops advancing if the loop hangs).", labels, node.get("progress"))
+        config = node.get("config", {})
+        out.add(p + "config_writes_total", "counter", "Config file writes.", labels, config.get("writes"))
+        out.add(p + "config_write_errors_total", "counter", "Failed config file writes.", labels, config.get("errors"))
+        out.add(p + "config_coalesced_total", "counter", "Config updates merged into a later write.", labels, config.get("coalesced"))
+    _add_scheduler(out, {"node": "container", "kind": "scheduler"}, snapshot.get("scheduler"))
+    for worker in snapshot.get("workers") or []:
+        labels = {"node": f"worker{worker['shard']}", "kind": "worker"}
+        out.add(p + "worker_up", "gauge", "1 while the worker process is running.", labels, worker.get("up"))
+        out.add(p + "worker_restarts_total", "counter", "Worker process restarts.", labels, worker.get("restarts"))
+        out.add(p + "worker_report_age_seconds", "gauge", "Time since the worker's last report.", labels, worker.get("report_age_sec"))
+        out.add(p + "worker_progress_age_seconds", "gauge", "Longest time a node loop of the worker has not advanced.", labels, worker.get("progress_age_sec"))
+        _add_scheduler(out, labels, worker.get("scheduler"))
+    mux = snapshot.get("mux")
+    if mux:
+        labels = {"node": "shared", "kind": "mux"}
+        out.add(p + "unrouted_packets_total", "counter", "Datagrams on the shared port without a matching device.", labels, mux.get("unrouted"))
+        out.add(p + "rejected_peers_total", "counter", "Datagrams for a live device from a new source address.", labels, mux.get("rejected"))
+        out.add(p + "decode_errors_total", "counter", "Datagrams with a malformed body.", labels, mux.get("decode_errors"))
+        _add_socket(out, labels, mux.get("socket"))
+    return out.render()
+
+def _add_scheduler(out: PrometheusWriter, labels: Dict[str, Any], scheduler: Optional[Dict[str, Any]]):
+    if not scheduler:
+        return
+    p = METRIC_PREFIX
+    out.add(p + "scheduler_jobs", "gauge", "Jobs registered with the scheduler.", labels, scheduler.get("jobs"))
+    out.add(p + "scheduler_runs_total", "counter", "Scheduled job runs.", labels, scheduler.get("runs"))
+    out.add(p + "scheduler_errors_total", "counter", "Scheduled job runs that raised.", labels, scheduler.get("errors"))
+    out.add(p + "scheduler_skipped_total", "counter", "Periods skipped because a job fell behind.", labels, scheduler.get("skipped"))
+    out.add_histogram(p + "scheduler_lag_seconds", "Delay from a job's due time to its run.", labels, scheduler.get("lag"))
+
+def _add_socket(out: PrometheusWriter, labels: Dict[str, Any], stats: Optional[Dict[str, Any]]):
+    if not stats:
+        return
+    p = METRIC_PREFIX
+    out.add(p + "received_datagrams_total", "counter", "Datagrams read from the socket.", labels, stats.get("received"))
+    out.add(p + "truncated_datagrams_total", "counter", "Datagrams larger than recv_buffer_size.", labels, stats.get("truncated"))
+    out.add(p + "dropped_sends_total", "counter", "Sends dropped because the socket buffer was full.", labels, stats.get("dropped_sends"))
+    out.add_histogram(p + "receive_loop_seconds", "Time to dispatch one receive batch.", labels, stats.get("receive_loop"))
+
+class MetricsServer:
+    """
+    Serves metrics snapshots: Prometheus text on http://<http_ip>:<http_port>/metrics and
+    the JSON snapshot on a UNIX stream socket (one snapshot per connection).
+
+    Both servers run in their own daemon threads and only read the counters.
+    """
+    def __init__(self, snapshot: Callable[[], Dict[str, Any]], http_ip: str = "127.0.0.1", http_port: Optional[int] = None,
+                 unix_socket: Optional[str] = None):
+        self.snapshot = snapshot
+        self.http_ip = http_ip
+        self.http_port = http_port
+        self.unix_socket = unix_socket
+        self.servers: List[socketserver.BaseServer] = []
+
+    def start(self):
+        if self.http_port is not None:
+            server = http.server.ThreadingHTTPServer((self.http_ip, self.http_port), self._http_handler())
+            self.http_port = server.server_address[1]
+            self._serve(server)
+            logger.info("Metrics: http://%s:%s/metrics", self.http_ip, self.http_port)
+        if self.unix_socket:
+            if not hasattr(socket, "AF_UNIX"):
+                logger.error("UNIX sockets are not supported on this platform: %s", self.unix_socket)
+                return
+            # 前回の実行で残ったソケットファイルを消してからbindする
+            if os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
+            server = socketserver.ThreadingUnixStreamServer(self.unix_socket, self._unix_handler())
+            self._serve(server)
+            logger.info("Metrics snapshot: %s", self.unix_socket)
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    def _serve(self, server: socketserver.BaseServer):
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+
+    def _http_handler(self):
+        snapshot = self.snapshot
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/log":
+                    self._send_json({"levels": log.get_levels(), "queue": log.stats()})
+                    return
+                if path not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                self._send(format_prometheus(snapshot()).encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+            def do_POST(self):
+                # POST /log?comm=DEBUG&sync=WARNING でサブシステム別のログレベルを変更する
+                path, _, query = self.path.partition("?")
+                if path != "/log":
+                    self.send_error(404)
+                    return
+                try:
+                    for subsystem, levels in urllib.parse.parse_qs(query, keep_blank_values=True).items():
+                        log.set_level(subsystem if subsystem != "all" else None, levels[-1])
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                logger.info("Log levels changed: %s", query)
+                self._send_json({"levels": log.get_levels()})
+
+            def _send_json(self, data):
+                self._send(json.dumps(data).encode("utf-8"), "application/json")
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # スクレイプ毎のアクセスログは出さない
+                pass
+        return Handler
+
+    def _unix_handler(self):
+        snapshot = self.snapshot
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(json.dumps(snapshot()).encode("utf-8") + b"\n")
+        return Handler
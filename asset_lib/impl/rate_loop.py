@@ -0,0 +1,76 @@
+import time
+from typing import Any, Callable, Dict, Optional
+
+class RateLoop:
+    """
+    Fixed-rate loop timing.
+
+    Call wait() once per iteration. Deadlines are start + n * period rather than
+    "now + period", so sleep and work times do not accumulate into drift. An iteration
+    whose work already ran past its deadline is counted as late (overrun); when the loop
+    falls one or more whole periods behind, the missed ticks are skipped instead of being
+    run back to back.
+    """
+    def __init__(self, rate_hz: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = time.sleep):
+        if rate_hz <= 0:
+            raise ValueError(f"rate_hz must be positive: {rate_hz}")
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.clock = clock
+        self.sleep = sleep
+        self.next_deadline: Optional[float] = None
+        self.last_tick = 0.0
+        self.ticks = 0
+        self.late = 0
+        self.skipped = 0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def reset(self):
+        """Restart the schedule from the next wait() (e.g. after the loop was paused)."""
+        self.next_deadline = None
+
+    def wait(self) -> float:
+        """Sleep until the next tick. Returns the time since the previous tick [s]."""
+        now = self.clock()
+        if self.next_deadline is None:
+            # 最初の周期は待たずに始める
+            self.next_deadline = now + self.period
+            self.last_tick = now
+            self.ticks += 1
+            return 0.0
+
+        remaining = self.next_deadline - now
+        if remaining > 0:
+            self.sleep(remaining)
+            now = self.clock()
+        else:
+            self.late += 1
+
+        jitter = max(now - self.next_deadline, 0.0)
+        self.total_jitter += jitter
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+
+        # 1周期以上遅れたら、遅れた分の周期を飛ばして次の期限を作り直す
+        behind = int(jitter // self.period)
+        self.skipped += behind
+        self.next_deadline += (behind + 1) * self.period
+
+        dt = now - self.last_tick
+        self.last_tick = now
+        self.ticks += 1
+        return dt
+
+    def stats(self) -> Dict[str, Any]:
+        measured = self.ticks - 1 if self.ticks > 1 else 1
+        return {
+            "rate_hz": self.rate_hz,
+            "ticks": self.ticks,
+            "late": self.late,
+            "skipped": self.skipped,
+            "max_jitter_ms": self.max_jitter * 1000.0,
+            "mean_jitter_ms": self.total_jitter / measured * 1000.0,
+        }
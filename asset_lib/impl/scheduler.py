@@ -0,0 +1,279 @@
+import asyncio
+import concurrent.futures
+import math
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from asset_lib.impl import log
+from asset_lib.impl.metrics import Histogram
+
+DEFAULT_TICK_SEC = 0.01
+DEFAULT_SLOTS = 512
+DEFAULT_JITTER = 0.0
+
+# 同じ名前のジョブの初回時刻を黄金比の刻みでずらし、何個登録されても周期内に均等に散らす
+_GOLDEN_RATIO = (math.sqrt(5.0) - 1.0) / 2.0
+
+logger = log.get_logger("scheduler")
+
+class Job:
+    """A job registered with TimerWheel.every() or call_later(). Cancel it with TimerWheel.cancel()."""
+    __slots__ = ('name', 'callback', 'interval', 'blocking', 'base', 'due', 'target', 'cancelled', 'runs')
+
+    def __init__(self, name: str, callback: Callable[[], Any], interval: Optional[float], blocking: bool, due: float):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.blocking = blocking
+        # 周期の基準時刻 (ジッタを含まない)。次回はbase + intervalで、実行時刻に引きずられない
+        self.base = due
+        self.due = due
+        self.target = 0
+        self.cancelled = False
+        self.runs = 0
+
+class TimerWheel:
+    """
+    Hashed timer wheel that runs the periodic jobs of all nodes from one thread (or from
+    timers of one event loop).
+
+    Time is divided into ticks of tick_sec; a job due at time t sits in slot
+    ceil(t / tick_sec) % slots and fires at the first tick at or after t, so a job is never
+    early and at most one tick late. Inserting and cancelling are O(1). The runner sleeps
+    until the next occupied tick instead of waking every tick.
+
+    Periodic jobs keep a fixed grid (base + n * interval): a late run does not shift the
+    following ones, and whole periods that were missed are skipped. Jobs with the same name
+    (e.g. the heartbeat of every node) get their first run spread over the interval, and
+    `jitter` (a fraction of the interval) randomizes every later run, so N nodes do not
+    send in the same instant.
+
+    Callbacks run on the scheduler thread and must not block. Jobs added with
+    blocking=True (file writes) run on a single worker thread instead.
+    """
+    def __init__(self, tick_sec: float = DEFAULT_TICK_SEC, slots: int = DEFAULT_SLOTS, jitter: float = DEFAULT_JITTER,
+                 clock: Callable[[], float] = time.monotonic):
+        if tick_sec <= 0 or slots <= 0:
+            raise ValueError(f"tick_sec and slots must be positive: {tick_sec}, {slots}")
+        self.tick_sec = tick_sec
+        self.jitter = jitter
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.slots: List[List[Job]] = [[] for _ in range(slots)]
+        self.origin = clock()
+        self.tick = 0
+        # 待機中のランナーが起きる予定のtick (待機していなければNone)
+        self.armed: Optional[int] = None
+        self.spread: Dict[str, int] = {}
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.timer_handle = None
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.random = random.Random()
+        self.jobs = 0
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        # 予定時刻から実行までの遅れ
+        self.lag = Histogram()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> 'TimerWheel':
+        """Build from the "scheduler" section of node.json (tick_sec, slots, jitter)."""
+        config = config or {}
+        return cls(config.get("tick_sec", DEFAULT_TICK_SEC), config.get("slots", DEFAULT_SLOTS), config.get("jitter", DEFAULT_JITTER))
+
+    def every(self, name: str, interval_sec: float, callback: Callable[[], Any], blocking: bool = False,
+              phase_sec: Optional[float] = None) -> Job:
+        """Run callback every interval_sec. The first run is spread over the interval unless phase_sec is given."""
+        if interval_sec <= 0:
+            raise ValueError(f"interval_sec must be positive: {interval_sec}")
+        with self.cond:
+            if phase_sec is None:
+                count = self.spread.get(name, 0)
+                self.spread[name] = count + 1
+                phase_sec = (count * _GOLDEN_RATIO) % 1.0 * interval_sec
+            job = Job(name, callback, interval_sec, blocking, self.clock() + phase_sec)
+            self.jobs += 1
+            self._insert(job)
+        return job
+
+    def call_later(self, delay_sec: float, callback: Callable[[], Any], name: str = "once", blocking: bool = False) -> Job:
+        """Run callback once after delay_sec."""
+        with self.cond:
+            job = Job(name, callback, None, blocking, self.clock() + max(delay_sec, 0.0))
+            self.jobs += 1
+            self._insert(job)
+        return job
+
+    def cancel(self, job: Optional[Job]) -> None:
+        # スロットからは次にそのスロットを処理するときに取り除く
+        if job is None:
+            return
+        with self.cond:
+            if not job.cancelled:
+                job.cancelled = True
+                self.jobs -= 1
+
+    def start(self) -> None:
+        """Run the wheel on its own thread."""
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def start_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Run the wheel from timers of the given event loop (call from the loop's thread)."""
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.loop = loop
+        self._arm()
+
+    def stop(self) -> None:
+        with self.cond:
+            was_running = self.running
+            self.running = False
+            self.cond.notify()
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if was_running and self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        self.loop = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"jobs": self.jobs, "runs": self.runs, "errors": self.errors, "skipped": self.skipped, "lag": self.lag.snapshot()}
+
+    def run_due(self) -> int:
+        """Run every job that is due now. Returns the number of jobs run."""
+        now = self.clock()
+        # 浮動小数の誤差で期限ちょうどに起きたときに1tick手前と判定しないようにする
+        now_tick = int((now - self.origin) / self.tick_sec + 1e-9)
+        due = []
+        with self.cond:
+            if now_tick > self.tick:
+                num_slots = len(self.slots)
+                for i in range(1, min(now_tick - self.tick, num_slots) + 1):
+                    slot = self.slots[(self.tick + i) % num_slots]
+                    if not slot:
+                        continue
+                    keep = []
+                    for job in slot:
+                        if job.cancelled:
+                            continue
+                        if job.target <= now_tick:
+                            due.append(job)
+                        else:
+                            keep.append(job)
+                    slot[:] = keep
+                self.tick = now_tick
+        due.sort(key=lambda job: job.due)
+        for job in due:
+            self._execute(job, now)
+        return len(due)
+
+    def _execute(self, job: Job, now: float):
+        self.lag.observe(max(now - job.due, 0.0))
+        if job.blocking:
+            self._submit(job)
+        else:
+            self._call(job)
+        with self.cond:
+            if job.cancelled:
+                return
+            if job.interval is None:
+                job.cancelled = True
+                self.jobs -= 1
+                return
+            job.base += job.interval
+            if job.base <= now:
+                # 1周期以上遅れたら、遅れた分の周期を飛ばす
+                behind = int((now - job.base) // job.interval) + 1
+                self.skipped += behind
+                job.base += behind * job.interval
+            job.due = job.base
+            if self.jitter > 0:
+                job.due += self.random.uniform(-self.jitter, self.jitter) * job.interval
+            self._insert(job)
+
+    def _call(self, job: Job):
+        try:
+            job.callback()
+        except Exception as e:
+            self.errors += 1
+            logger.error("Error in scheduled job %s: %s", job.name, e)
+        job.runs += 1
+        self.runs += 1
+
+    def _submit(self, job: Job):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="scheduler-io")
+        try:
+            self.executor.submit(self._call, job)
+        except RuntimeError:
+            # 停止処理中はその場で実行する
+            self._call(job)
+
+    def _insert(self, job: Job):
+        # self.condを保持して呼ぶこと
+        target = max(math.ceil((job.due - self.origin) / self.tick_sec - 1e-9), self.tick + 1)
+        job.target = target
+        self.slots[target % len(self.slots)].append(job)
+        if self.armed is not None and target < self.armed:
+            self._kick()
+
+    def _kick(self):
+        # ランナーが予定より早く起きる必要がある
+        if self.loop is not None:
+            self.armed = None
+            self.loop.call_soon_threadsafe(self._arm)
+        else:
+            self.cond.notify()
+
+    def _next_tick(self) -> int:
+        # 次に期限の来るジョブを持つtick。1周しても無ければ1周後に見直す
+        num_slots = len(self.slots)
+        for i in range(1, num_slots + 1):
+            tick = self.tick + i
+            for job in self.slots[tick % num_slots]:
+                if job.target == tick and not job.cancelled:
+                    return tick
+        return self.tick + num_slots
+
+    def _run(self):
+        while True:
+            self.run_due()
+            with self.cond:
+                if not self.running:
+                    return
+                self.armed = self._next_tick()
+                remaining = self.origin + self.armed * self.tick_sec - self.clock()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                self.armed = None
+
+    def _arm(self):
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        with self.cond:
+            if not self.running or self.loop is None:
+                return
+            self.armed = self._next_tick()
+            remaining = self.origin + self.armed * self.tick_sec - self.clock()
+        self.timer_handle = self.loop.call_later(max(remaining, 0.0), self._on_timer)
+
+    def _on_timer(self):
+        self.timer_handle = None
+        self.run_due()
+        self._arm()
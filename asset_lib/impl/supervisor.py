@@ -0,0 +1,355 @@
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from asset_lib.impl import log
+
+DEFAULT_REPORT_INTERVAL_SEC = 1.0
+DEFAULT_BACKOFF_SEC = 0.5
+DEFAULT_MAX_BACKOFF_SEC = 30.0
+# これ以上動き続けたワーカーが落ちた場合はバックオフを初期値に戻す
+DEFAULT_STABLE_SEC = 10.0
+# この間レポートが届かない、またはノードのループが進まないワーカーは止まっているとみなして再起動する
+DEFAULT_HANG_TIMEOUT_SEC = 10.0
+DEFAULT_STOP_TIMEOUT_SEC = 5.0
+
+logger = log.get_logger("main")
+
+def shard_nodes(nodes: List[Dict[str, Any]], workers: int, shared_udp_port: bool = False) -> List[List[int]]:
+    """
+    Split the indices of node.json "nodes" into at most `workers` shards (round robin).
+
+    With shared_udp_port all device nodes use one socket, so they are kept in one shard
+    and only the other nodes are spread over the remaining workers.
+    """
+    workers = max(1, min(workers, len(nodes)))
+    shards: List[List[int]] = [[] for _ in range(workers)]
+    if shared_udp_port:
+        devices = [index for index, node in enumerate(nodes) if node.get('type') == 'device']
+        others = [index for index, node in enumerate(nodes) if node.get('type') != 'device']
+        if devices:
+            shards[0].extend(devices)
+            targets = list(range(1, workers)) or [0]
+        else:
+            targets = list(range(workers))
+        for position, index in enumerate(others):
+            shards[targets[position % len(targets)]].append(index)
+    else:
+        for index in range(len(nodes)):
+            shards[index % workers].append(index)
+    return [shard for shard in shards if shard]
+
+def worker_main(node_path: str, node_indices: List[int], shard: int, runtime: str, report_interval_sec: float, conn):
+    """Entry point of a worker process: run one shard of the nodes until the parent says stop."""
+    # Ctrl-Cはプロセスグループ全体に届くので無視し、親からの停止指示で止まる
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from asset_lib.main import HakoniwaARBridgeServiceContainer, run_container_async
+    container = HakoniwaARBridgeServiceContainer(node_path, node_indices)
+    # メトリクスは親がまとめて公開する
+    container.node.pop('metrics', None)
+    send_lock = threading.Lock()
+
+    def report():
+        snapshot = container.metrics_snapshot()
+        status = {}
+        for node, service in zip(snapshot["nodes"], container.services):
+            status[node["node"]] = service.sync_manager.get_ar_status()
+        try:
+            with send_lock:
+                conn.send(("report", {"shard": shard, "pid": os.getpid(), "snapshot": snapshot, "status": status}))
+        except (OSError, EOFError, ValueError):
+            pass
+
+    # 送信はパイプが詰まるとブロックするのでI/Oワーカーで行う
+    container.scheduler.every("report", report_interval_sec, report, blocking=True, phase_sec=0.0)
+    if runtime == 'asyncio':
+        async def run():
+            task = asyncio.ensure_future(run_container_async(container))
+            await asyncio.get_running_loop().run_in_executor(None, _wait_stop, conn)
+            # キャンセルでlocalノードのrun(executorで実行中)も止まり、asyncio.run()が戻る
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        asyncio.run(run())
+    else:
+        container.start_service()
+        threading.Thread(target=container.run, daemon=True).start()
+        _wait_stop(conn)
+    container.stop_service()
+    log.shutdown()
+
+def _wait_stop(conn):
+    # 親が終了した(パイプが閉じた)場合も止まる
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message and message[0] == "stop":
+            return
+
+class _Worker:
+    __slots__ = ('shard', 'node_indices', 'process', 'conn', 'started_at', 'restarts', 'failures', 'next_start',
+                 'report', 'report_time', 'exitcode', 'progress')
+
+    def __init__(self, shard: int, node_indices: List[int]):
+        self.shard = shard
+        self.node_indices = node_indices
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn = None
+        self.started_at = 0.0
+        self.restarts = 0
+        # 連続して早期に落ちた回数 (バックオフの指数)
+        self.failures = 0
+        self.next_start: Optional[float] = 0.0
+        self.report: Optional[Dict[str, Any]] = None
+        self.report_time = 0.0
+        self.exitcode: Optional[int] = None
+        # ノードごとの(名前, ループの回数, 回数が最後に進んだ時刻)
+        self.progress: List[Tuple[Optional[str], int, float]] = []
+
+    def observe_progress(self, nodes: List[Dict[str, Any]], now: float):
+        """Record the loop counters of a report (nodes in the order of the worker's services)."""
+        if len(nodes) != len(self.progress):
+            self.progress = [(node.get("node"), node.get("progress"), now) for node in nodes]
+            return
+        for index, node in enumerate(nodes):
+            count = node.get("progress")
+            if count != self.progress[index][1]:
+                self.progress[index] = (node.get("node"), count, now)
+
+    def stalled_node(self, now: float, timeout: float) -> Optional[Tuple[Optional[str], float]]:
+        """(name, seconds) of a node whose loop counter has not advanced for timeout, or None."""
+        for name, count, changed in self.progress:
+            if count is not None and now - changed > timeout:
+                return name, now - changed
+        return None
+
+    def progress_age(self, now: float) -> Optional[float]:
+        ages = [now - changed for _, count, changed in self.progress if count is not None]
+        return max(ages) if ages else None
+
+class ShardSupervisor:
+    """
+    Runs the nodes of a node.json in worker processes and keeps them running.
+
+    Nodes are split into shards (shard_nodes) and every shard runs in its own process
+    with its own HakoniwaARBridgeServiceContainer, so nodes no longer share one GIL. A
+    worker sends its metrics snapshot and the AR status of its nodes every
+    report_interval_sec; the supervisor keeps the latest report of each worker and serves
+    the merged snapshot (metrics_snapshot, get_status, the "metrics" endpoints).
+
+    Reports are sent from the worker's scheduler, so they keep coming while a node's
+    service loop is stuck. Every report therefore carries the loop counter of each node
+    (ProgressCounter), and the supervisor also checks that these keep advancing.
+
+    A worker that exits, that stops reporting for hang_timeout_sec, or in which a node's
+    loop counter does not advance for hang_timeout_sec, is restarted after backoff_sec,
+    doubled for every consecutive crash up to max_backoff_sec. A worker that ran for
+    stable_sec before crashing starts again from backoff_sec.
+    """
+    def __init__(self, node_path: str, node: Dict[str, Any], workers: int, runtime: str = 'thread',
+                 options: Optional[Dict[str, Any]] = None):
+        options = options or {}
+        self.node_path = node_path
+        self.node = node
+        self.runtime = runtime
+        self.report_interval_sec = options.get("report_interval_sec", DEFAULT_REPORT_INTERVAL_SEC)
+        self.backoff_sec = options.get("backoff_sec", DEFAULT_BACKOFF_SEC)
+        self.max_backoff_sec = options.get("max_backoff_sec", DEFAULT_MAX_BACKOFF_SEC)
+        self.stable_sec = options.get("stable_sec", DEFAULT_STABLE_SEC)
+        self.hang_timeout_sec = options.get("hang_timeout_sec", DEFAULT_HANG_TIMEOUT_SEC)
+        self.stop_timeout_sec = options.get("stop_timeout_sec", DEFAULT_STOP_TIMEOUT_SEC)
+        # ワーカーは親のスレッドを引き継がないようspawnで起動する
+        self.context = multiprocessing.get_context("spawn")
+        shards = shard_nodes(node.get('nodes', []), workers, node.get('shared_udp_port') is not None)
+        self.workers = [_Worker(shard, indices) for shard, indices in enumerate(shards)]
+        self.lock = threading.Lock()
+        self.running = False
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.metrics_server = None
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            for worker in self.workers:
+                self._spawn(worker)
+        self.thread = threading.Thread(target=self._monitor, name="supervisor", daemon=True)
+        self.thread.start()
+        self.start_metrics()
+        logger.info("Supervising %d workers: %s", len(self.workers),
+                    ", ".join(f"{worker.shard}={worker.node_indices}" for worker in self.workers))
+
+    def start_metrics(self):
+        options = self.node.get('metrics')
+        if not options or self.metrics_server is not None:
+            return
+        from asset_lib.impl.metrics import MetricsServer
+        self.metrics_server = MetricsServer(self.metrics_snapshot, options.get('http_ip', '127.0.0.1'),
+                                            options.get('http_port'), options.get('unix_socket'))
+        try:
+            self.metrics_server.start()
+        except OSError as e:
+            logger.error("Error starting metrics server: %s", e)
+
+    def run(self):
+        """Block until stop() is called."""
+        while not self.stopped.wait(1.0):
+            pass
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        # 先に全ワーカーへ停止を指示してから待つ (設定の書き出しを並行して行う)
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                try:
+                    worker.conn.send(("stop",))
+                except (OSError, ValueError):
+                    pass
+        deadline = time.monotonic() + self.stop_timeout_sec
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(deadline - time.monotonic(), 0.0))
+            if worker.process.is_alive():
+                logger.warning("Worker %d did not stop, terminating.", worker.shard)
+                worker.process.terminate()
+                worker.process.join()
+            worker.exitcode = worker.process.exitcode
+            worker.conn.close()
+        self.stopped.set()
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Latest snapshot of every worker merged into one (same format as the container's)."""
+        now = time.monotonic()
+        nodes = []
+        mux = None
+        workers = []
+        with self.lock:
+            for worker in self.workers:
+                report = worker.report
+                snapshot = report["snapshot"] if report else {}
+                nodes.extend(snapshot.get("nodes", []))
+                mux = mux or snapshot.get("mux")
+                workers.append({
+                    "shard": worker.shard,
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "up": worker.process is not None and worker.process.is_alive(),
+                    "restarts": worker.restarts,
+                    "exitcode": worker.exitcode,
+                    "uptime_sec": now - worker.started_at if worker.process is not None else None,
+                    "report_age_sec": now - worker.report_time if report else None,
+                    "progress_age_sec": worker.progress_age(now),
+                    "nodes": worker.node_indices,
+                    "scheduler": snapshot.get("scheduler"),
+                    "status": report["status"] if report else {},
+                })
+        return {"time": time.time(), "nodes": nodes, "mux": mux, "workers": workers}
+
+    def get_status(self) -> Dict[str, Any]:
+        """AR status of every node, by node name (from the latest worker reports)."""
+        status = {}
+        with self.lock:
+            for worker in self.workers:
+                if worker.report:
+                    status.update(worker.report["status"])
+        return status
+
+    def _spawn(self, worker: _Worker):
+        # self.lockを保持して呼ぶこと
+        parent_conn, child_conn = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=worker_main, name=f"hakoniwa-worker-{worker.shard}", daemon=True,
+            args=(self.node_path, worker.node_indices, worker.shard, self.runtime, self.report_interval_sec, child_conn))
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.started_at = time.monotonic()
+        worker.report_time = worker.started_at
+        worker.progress = []
+        worker.next_start = None
+        worker.exitcode = None
+
+    def _on_exit(self, worker: _Worker, now: float):
+        # self.lockを保持して呼ぶこと
+        worker.process.join()
+        worker.exitcode = worker.process.exitcode
+        worker.conn.close()
+        if now - worker.started_at >= self.stable_sec:
+            worker.failures = 0
+        worker.failures += 1
+        delay = min(self.backoff_sec * (2 ** (worker.failures - 1)), self.max_backoff_sec)
+        worker.next_start = now + delay
+        logger.error("Worker %d (pid %s) exited with %s, restarting in %.1f s.", worker.shard, worker.process.pid, worker.exitcode, delay)
+
+    def _monitor(self):
+        while True:
+            with self.lock:
+                if not self.running:
+                    return
+                waitables = {}
+                for worker in self.workers:
+                    if worker.next_start is None:
+                        waitables[worker.conn] = worker
+                        waitables[worker.process.sentinel] = worker
+            ready = multiprocessing.connection.wait(list(waitables), timeout=min(0.5, self.report_interval_sec))
+            now = time.monotonic()
+            with self.lock:
+                if not self.running:
+                    return
+                exited = set()
+                for item in ready:
+                    worker = waitables[item]
+                    if item is worker.conn:
+                        try:
+                            message = worker.conn.recv()
+                        except (EOFError, OSError):
+                            exited.add(worker)
+                            continue
+                        if message[0] == "report":
+                            worker.report = message[1]
+                            worker.report_time = now
+                            worker.observe_progress(message[1]["snapshot"].get("nodes", []), now)
+                    else:
+                        exited.add(worker)
+                for worker in exited:
+                    if worker.next_start is None:
+                        if worker.process.is_alive():
+                            # パイプだけ閉じた場合はプロセスを止めて再起動する
+                            worker.process.terminate()
+                        self._on_exit(worker, now)
+                for worker in self.workers:
+                    stalled = worker.stalled_node(now, self.hang_timeout_sec) if worker.next_start is None else None
+                    if worker.next_start is None and now - worker.report_time > self.hang_timeout_sec:
+                        logger.error("Worker %d (pid %s) sent no report for %.1f s, terminating.", worker.shard,
+                                     worker.process.pid, now - worker.report_time)
+                        worker.process.kill()
+                        self._on_exit(worker, now)
+                    elif stalled is not None:
+                        # スケジューラは動いていてもノードのループが止まっている
+                        logger.error("Worker %d (pid %s): node %s made no progress for %.1f s, terminating.", worker.shard,
+                                     worker.process.pid, stalled[0], stalled[1])
+                        worker.process.kill()
+                        self._on_exit(worker, now)
+                    elif worker.next_start is not None and now >= worker.next_start:
+                        worker.restarts += 1
+                        self._spawn(worker)
+                        logger.info("Worker %d restarted (pid %s, restart %d).", worker.shard, worker.process.pid, worker.restarts)
@@ -1,20 +1,49 @@
 
+from asset_lib.impl import log
+from asset_lib.impl.comm.failure_detector import LIVENESS_ALIVE, LIVENESS_DEAD, LIVENESS_SUSPECT, PhiAccrualDetector
 from asset_lib.impl.comm.packet import HeartBeatRequest
 from asset_lib.impl.comm.udp_comm import UdpComm
+from asset_lib.impl.scheduler import TimerWheel
 from asset_lib.impl.sync_state import SyncState, SyncStateManagement
+from typing import Any, Dict, Optional
 import time
 
+DEFAULT_HEARTBEAT_INTERVAL_SEC = 1.0
+DEFAULT_HEARTBEAT_TIMEOUT_SEC = 5.0
+
 class SyncManagerBaseService:
-    def __init__(self, state_management: SyncStateManagement, web_ip: str, udp_service: UdpComm, heartbeat_timeout_sec: int, positioning_speed, saved_position, player, avatars):
+    def __init__(self, state_management: SyncStateManagement, web_ip: str, udp_service: UdpComm, heartbeat_timeout_sec: float, positioning_speed, saved_position, player, avatars,
+                 heartbeat_interval_sec: Optional[float] = None, liveness_interval_sec: Optional[float] = None,
+                 failure_detector: Optional[Dict[str, Any]] = None):
         self.state_management = state_management
         self.ar_device_is_alive = False
         self.web_ip = web_ip
         self.udp_service = udp_service
         self.heartbeat_timeout_sec = heartbeat_timeout_sec
+        self.heartbeat_interval_sec = heartbeat_interval_sec or DEFAULT_HEARTBEAT_INTERVAL_SEC
+        # HeartBeatResponseの到着間隔から切断を判定する (heartbeat_timeout_secは上限として残る)
+        self.detector = PhiAccrualDetector.from_config(failure_detector, self.heartbeat_interval_sec)
+        # 判定の間隔。省略時は、phiで判定する場合はハートビートの1/4、そうでなければハートビートと同じ
+        self.liveness_interval_sec = liveness_interval_sec or (
+            self.heartbeat_interval_sec / 4.0 if self.detector is not None else self.heartbeat_interval_sec)
+        self.liveness = LIVENESS_DEAD
+        self.phi: Optional[float] = None
+        self.silence_sec: Optional[float] = None
+        # 切断と判定した時点の最終受信時刻。これより新しいパケットが来るまで切断のままにする
+        self.dead_recv_time = 0
+        self.suspicions = 0
+        if self.detector is not None:
+            self.udp_service.subscribe("heartbeat_response", self._on_heartbeat_response)
         self.positioning_speed = positioning_speed
         self.saved_position = saved_position
         self.player = player
         self.avatars = avatars
+        # ハートビートパケットは使い回し、送信ごとにRTT計測用のnonceを更新する (nonceはエンコードのキャッシュに含まれない)
+        self.heartbeat_packet = HeartBeatRequest(self.web_ip, self.udp_service.get_port(), self.positioning_speed, self.saved_position, self.player, self.avatars, self.udp_service.supported_codecs, self.udp_service.device_id)
+        self.jobs = []
+        self.heartbeats_sent = 0
+        self.logger = log.get_logger("sync", node=self.player['name'])
+        self.heartbeat_timeouts = 0
 
     def update_saved_position_packet(self, position, rotation):
         self.saved_position = {
@@ -22,16 +51,77 @@ class SyncManagerBaseService:
             "position": position,
             "orientation": rotation
         }
+        self.heartbeat_packet.set_saved_position(self.saved_position)
+
+    def schedule(self, scheduler: TimerWheel) -> None:
+        """Register the heartbeat and liveness jobs of this node with the scheduler."""
+        self.cancel_schedule(scheduler)
+        self.jobs = [
+            scheduler.every("heartbeat", self.heartbeat_interval_sec, self.send_heartbeat),
+            scheduler.every("liveness", self.liveness_interval_sec, self.check_liveness),
+        ]
+
+    def cancel_schedule(self, scheduler: TimerWheel) -> None:
+        for job in self.jobs:
+            scheduler.cancel(job)
+        self.jobs = []
 
     def run(self):
+        """Send one heartbeat and check the timeout (both jobs once)."""
+        self.send_heartbeat()
+        self.check_liveness()
+
+    def send_heartbeat(self):
         try:
-            packet = HeartBeatRequest(self.web_ip, self.udp_service.get_port(), self.positioning_speed, self.saved_position, self.player, self.avatars)
-            #print(f"Sending heartbeat request to {self.web_ip}:{self.udp_service.get_port()}")
-            #print(f"Packet: {packet.data}")
+            packet = self.heartbeat_packet
+            packet.set_probe(*self.udp_service.rtt.probe())
             self.udp_service.send_packet(packet)
-            #print("last_recv: ", self.udp_service.get_last_recv_time())
-            if (self.udp_service.get_last_recv_time() == 0) or (time.time() - self.udp_service.get_last_recv_time() > self.heartbeat_timeout_sec):
-                print(f"{self.player['name']} : Heartbeat timeout: assuming AR device is disconnected.")
+            self.heartbeats_sent += 1
+        except Exception as e:
+            self.logger.error("Error during HeartBeatRequest sending: %s", e)
+
+    def _on_heartbeat_response(self, packet):
+        self.detector.heartbeat()
+
+    def _judge(self, last_recv: float) -> str:
+        """Liveness from the silence since the last packet of any type."""
+        if last_recv == 0 or last_recv == self.dead_recv_time:
+            self.phi = None
+            self.silence_sec = None if last_recv == 0 else time.time() - last_recv
+            return LIVENESS_DEAD
+        self.silence_sec = time.time() - last_recv
+        if self.silence_sec > self.heartbeat_timeout_sec:
+            return LIVENESS_DEAD
+        if self.detector is None:
+            return LIVENESS_ALIVE
+        self.phi = self.detector.phi(self.silence_sec)
+        return self.detector.level(self.phi)
+
+    def get_liveness(self) -> Dict[str, Any]:
+        status = {"state": self.liveness, "phi": self.phi, "silence_sec": self.silence_sec, "suspicions": self.suspicions}
+        if self.detector is not None:
+            status.update(self.detector.stats())
+        return status
+
+    def check_liveness(self):
+        try:
+            state = self.state_management.state
+            last_recv = self.udp_service.get_last_recv_time()
+            liveness = self._judge(last_recv)
+            if liveness == LIVENESS_SUSPECT and self.liveness == LIVENESS_ALIVE:
+                self.suspicions += 1
+                self.logger.info("AR device suspected (silent %.2f s, phi %.1f).", self.silence_sec, self.phi)
+            self.liveness = liveness
+            if liveness == LIVENESS_DEAD:
+                if self.ar_device_is_alive:
+                    # 接続中からタイムアウトした回数 (未接続のままの間は数えない)
+                    self.heartbeat_timeouts += 1
+                    self.logger.warning("Heartbeat timeout: assuming AR device is disconnected (silent %.2f s).", self.silence_sec)
+                    self.dead_recv_time = last_recv
+                    if self.detector is not None:
+                        self.detector.suspend()
+                else:
+                    self.logger.debug("Heartbeat timeout: AR device not connected.")
                 self.ar_device_is_alive = False
                 self.state_management.disconnect_or_reset()
             else:
@@ -39,6 +129,8 @@ class SyncManagerBaseService:
             if self.state_management.state == SyncState.WAITING:
                 if self.ar_device_is_alive:
                     self.state_management.connect_established()
+            if self.state_management.state != state:
+                # 状態に応じて待つパケットが変わるので、待機中のサービスループを起こす
+                self.udp_service.wakeup()
         except Exception as e:
-            #print(f"Error during HeartBeatRequest sending or heartbeat check: {e}")
-            pass
+            self.logger.error("Error during heartbeat check: %s", e)
@@ -1,4 +1,6 @@
 from enum import Enum, auto
+from typing import Optional
+from asset_lib.impl import log
 
 class SyncState(Enum):
     WAITING = auto()           # 待機モード
@@ -6,22 +8,28 @@ class SyncState(Enum):
     PLAYING = auto()           # プレイモード
 
 class SyncStateManagement:
-    def __init__(self):
+    def __init__(self, name: Optional[str] = None):
         self.state = SyncState.WAITING
+        self.logger = log.get_logger("sync", node=name)
+        # 遷移回数 (メトリクス用に事前に確保しておく)
+        self.transitions = {f"{a.name}->{b.name}": 0 for a in SyncState for b in SyncState if a is not b}
+
+    def _transition(self, state: SyncState):
+        if state is not self.state:
+            self.transitions[f"{self.state.name}->{state.name}"] += 1
+            self.logger.info("Transitioning from %s to %s", self.state.name, state.name)
+            self.state = state
 
     def connect_established(self):
         """接続確立：待機モードから位置合わせモードへ遷移"""
         if self.state == SyncState.WAITING:
-            print("Transitioning from WAITING to POSITIONING")
-            self.state = SyncState.POSITIONING
+            self._transition(SyncState.POSITIONING)
 
     def start_play(self):
         """プレイ開始：位置合わせモードからプレイモードへ遷移"""
         if self.state == SyncState.POSITIONING:
-            print("Transitioning from POSITIONING to PLAYING")
-            self.state = SyncState.PLAYING
+            self._transition(SyncState.PLAYING)
 
     def disconnect_or_reset(self):
         """接続切断/リセット：任意の状態から待機モードへ遷移"""
-        #print("Transitioning to WAITING (disconnection/reset)")
-        self.state = SyncState.WAITING
+        self._transition(SyncState.WAITING)
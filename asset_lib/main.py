@@ -1,22 +1,40 @@
 import json
 import argparse
+import asyncio
 import os
-import logging
 import threading
+import time
+from typing import List, Optional
+from asset_lib.impl import log
+
+logger = log.get_logger("main")
 
 class HakoniwaARBridgeServiceContainer:
-    def __init__(self, node_path: str):
+    def __init__(self, node_path: str, node_indices: Optional[List[int]] = None):
+        """node_indices: run only these entries of node.json "nodes" (a worker process's shard)."""
         #get directory path
         self.node_path = node_path
         self.node_dir = os.path.dirname(node_path)
-        print(f'node_dir: {self.node_dir}')
         self.node = self.load_config(node_path)
-        print(f'node: {self.node}')
+        # ログの出力先/レベルはnode.jsonの"logging"で設定する
+        log.configure(self.node.get('logging'))
+        logger.debug('node: %s', self.node)
         self.services = []
-        for node in self.node['nodes']:
-            print(f'node: {node}')
+        self.metrics_server = None
+        # 全ノードのハートビート/タイムアウト判定/設定の書き出しを1つのタイマーホイールで動かす
+        from asset_lib.impl.scheduler import TimerWheel
+        self.scheduler = TimerWheel.from_config(self.node.get('scheduler'))
+        # shared_udp_portを指定した場合、全deviceノードが1つのソケットを共有する
+        self.mux = None
+        if self.node.get('shared_udp_port') is not None:
+            from asset_lib.impl.comm.udp_mux import UdpMux
+            self.mux = UdpMux(self.node['bridge_ip'], self.node['shared_udp_port'],
+                              self.node.get('recv_buffer_size'), self.node.get('so_rcvbuf'), self.node.get('recv_batch_size'))
+        for index, node in enumerate(self.node['nodes']):
+            if node_indices is not None and index not in node_indices:
+                continue
             config_path = os.path.join(self.node_dir, node['path'])
-            print(f'config_path: {config_path}')
+            logger.info('%s node: %s', node['type'], config_path)
             if node['type'] == 'device':
                 from asset_lib.impl.device.hakoniwa_ar_bridge_service_device import HakoniwaARBridgeServiceDevice
                 self.services.append(
@@ -24,7 +42,9 @@ class HakoniwaARBridgeServiceContainer:
                         config_path, 
                         self.node['bridge_ip'], 
                         self.node['ar_port'], 
-                        self.node['web_ip']))
+                        self.node['web_ip'],
+                        self.mux,
+                        scheduler=self.scheduler))
             elif node['type'] == 'local':
                 #TODO 箱庭のインストールが必要となるため、ローカルでインポートしています。
                 from asset_lib.impl.local.hakoniwa_ar_bridge_service_local import HakoniwaARBridgeServiceLocal
@@ -33,26 +53,63 @@ class HakoniwaARBridgeServiceContainer:
                         config_path, 
                         self.node['bridge_ip'], 
                         self.node['ar_ip'], 
-                        self.node['web_ip']))
+                        self.node['web_ip'],
+                        scheduler=self.scheduler))
             else:
-                logging.error("Error: Unknown node type %s", node['type'])
+                logger.error("Error: Unknown node type %s", node['type'])
 
-    def load_config(self, config_path):
+    @staticmethod
+    def load_config(config_path):
         try:
             with open(config_path, 'r') as file:
                 config_data = json.load(file)
-                logging.info("Node loaded successfully: %s", config_data)
+                logger.debug("Node loaded successfully: %s", config_data)
                 return config_data
         except FileNotFoundError:
-            logging.error("Error: Node file not found at %s", config_path)
+            logger.error("Error: Node file not found at %s", config_path)
             return {}
         except json.JSONDecodeError as e:
-            logging.error("Error: Failed to decode JSON from %s: %s", config_path, e)
+            logger.error("Error: Failed to decode JSON from %s: %s", config_path, e)
             return {}
 
+    def metrics_snapshot(self):
+        """Counters of every node (and of the shared socket) as one dictionary."""
+        return {
+            "time": time.time(),
+            "nodes": [service.metrics() for service in self.services],
+            "mux": self.mux.get_metrics() if self.mux is not None else None,
+            "scheduler": self.scheduler.stats(),
+        }
+
+    def start_metrics(self):
+        """Serve metrics if node.json has a "metrics" section."""
+        options = self.node.get('metrics')
+        if not options or self.metrics_server is not None:
+            return
+        from asset_lib.impl.metrics import MetricsServer
+        self.metrics_server = MetricsServer(self.metrics_snapshot, options.get('http_ip', '127.0.0.1'),
+                                            options.get('http_port'), options.get('unix_socket'))
+        try:
+            self.metrics_server.start()
+        except OSError as e:
+            logger.error("Error starting metrics server: %s", e)
+
     def start_service(self):
+        self.start_metrics()
+        self.scheduler.start()
         for service in self.services:
             service.start_service()
+
+    def stop_service(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        for service in self.services:
+            try:
+                service.stop_service()
+            except Exception as e:
+                logger.error("Error stopping service: %s", e)
+        self.scheduler.stop()
     
     def run(self):
         # サービス毎にスレッドを起動して実行
@@ -66,19 +123,94 @@ class HakoniwaARBridgeServiceContainer:
         for thread in threads:
             thread.join()
 
+    async def start_service_async(self):
+        self.start_metrics()
+        self.scheduler.start_async(asyncio.get_running_loop())
+        for service in self.services:
+            await service.start_service_async()
+
+    async def run_async(self):
+        """全ノードを1つのイベントループで実行する。
+        ブロッキングなメインループしか持たないノード(local)はワーカースレッドで実行する"""
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for service in self.services:
+            if hasattr(service, 'run_async'):
+                tasks.append(asyncio.ensure_future(service.run_async()))
+            else:
+                tasks.append(loop.run_in_executor(None, service.run))
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # ワーカースレッドのrunはキャンセルできないので、ループが動いているうちにサービスを止めて戻らせる
+            # (戻らないとasyncio.run()がexecutorの終了を待ち続ける)
+            for service in self.services:
+                if not hasattr(service, 'run_async'):
+                    try:
+                        service.stop_service()
+                    except Exception as e:
+                        logger.error("Error stopping service: %s", e)
+            raise
+
+
+async def run_container_async(service_container: HakoniwaARBridgeServiceContainer):
+    await service_container.start_service_async()
+    logger.info("Hakoniwa AR Bridge started (asyncio).")
+    await service_container.run_async()
+
+
+def run_supervisor(node_path: str, node, workers: int, runtime: str):
+    """ノードを複数のワーカープロセスに分けて実行し、落ちたワーカーを再起動する"""
+    from asset_lib.impl.supervisor import ShardSupervisor
+    log.configure(node.get('logging'))
+    supervisor = ShardSupervisor(node_path, node, workers, runtime, node.get('workers'))
+    supervisor.start()
+    logger.info("Hakoniwa AR Bridge started (%d workers, %s).", len(supervisor.workers), runtime)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.info("Service stopped by user.")
+    supervisor.stop()
+    log.shutdown()
+
 
 def main():
     parser = argparse.ArgumentParser(description="Load configuration for Hakoniwa AR Bridge")
     parser.add_argument('--node', type=str, default="asset_lib/config/node.json",
                         help="Path to the node definition file (default: asset_lib/config/node.json)")
+    parser.add_argument('--runtime', type=str, choices=['thread', 'asyncio'], default=None,
+                        help="thread: threads per node, asyncio: all nodes on one event loop (default: node file 'runtime' or thread)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="shard the nodes over this many supervised worker processes (default: node file 'workers.count', or none)")
     args = parser.parse_args()
 
+    node = HakoniwaARBridgeServiceContainer.load_config(args.node)
+    workers = args.workers if args.workers is not None else (node.get('workers') or {}).get('count')
+    if workers:
+        run_supervisor(args.node, node, workers, args.runtime or node.get('runtime', 'thread'))
+        return
+
     service_container = HakoniwaARBridgeServiceContainer(args.node)
+    runtime = args.runtime or service_container.node.get('runtime', 'thread')
+    if runtime == 'asyncio':
+        try:
+            asyncio.run(run_container_async(service_container))
+        except KeyboardInterrupt:
+            logger.info("Service stopped by user.")
+        service_container.stop_service()
+        log.shutdown()
+        return
+
     # サービスの開始
     service_container.start_service()
 
-    print("Hakoniwa AR Bridge started.")
-    service_container.run()
+    logger.info("Hakoniwa AR Bridge started.")
+    try:
+        service_container.run()
+    except KeyboardInterrupt:
+        logger.info("Service stopped by user.")
+    service_container.stop_service()
+    log.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,334 @@
+"""
+Multi-headset load generator.
+
+Simulates many AR headsets against one bridge from a single asyncio process. Every
+virtual headset speaks the MockQuest3 protocol on its own UDP endpoint (receive port
+base_port + i) and either sends to its own bridge port (bridge_port + i) or, with
+--shared, to one shared bridge port where it is routed by the device_id it echoes.
+
+Each headset sends HeartBeatResponses and PositioningRequests at the configured rates and
+follows a script of POSITIONING -> play_start -> PLAYING -> reset -> POSITIONING cycles.
+Datagrams are dropped at random in both directions with the --loss probability.
+A HeartBeatRequest nonce is echoed at once, so the bridge's heartbeat RTT statistics
+(get_ar_status()["rtt"]) cover the same traffic.
+
+Measurements per headset (milliseconds):
+- heartbeat_interval: arrival interval of the bridge's HeartBeatRequests.
+- pose_rtt: age of the pose the bridge reports back as saved_position in a HeartBeatRequest,
+  from the time the headset sent it. This covers the bridge's full path (receive, service
+  loop, state update, heartbeat send); a pose that had to wait for the next heartbeat shows
+  up as up to one heartbeat period.
+- reset_reaction: reset sent until the bridge accepts poses again, i.e. it went through
+  WAITING back to POSITIONING and echoed a pose sent after the reset.
+
+    python -m asset_lib.mock.load_generator --headsets 200 --duration 60 [--shared]
+    python -m asset_lib.mock.load_generator --headsets 200 --write-node /tmp/load [--shared]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+
+from asset_lib.impl.comm.codec import CODECS, CODEC_BINARY, CODEC_JSON, decode_datagram
+from asset_lib.impl.comm.packet import EventRequest, HeartBeatResponse, PositioningRequest
+from asset_lib.impl.comm.sequence import SequenceCounter, monotonic_ms
+
+# 未応答の姿勢はこの数だけ覚えておく (古いものから捨てる)
+MAX_PENDING_POSES = 1024
+
+class LoadProfile:
+    """Settings shared by every virtual headset."""
+    def __init__(self, heartbeat_rate_hz: float = 1.0, position_rate_hz: float = 10.0, positioning_sec: float = 5.0,
+                 playing_sec: float = 3.0, loss: float = 0.0, codec: str = CODEC_JSON, sequence: bool = False):
+        self.heartbeat_rate_hz = heartbeat_rate_hz
+        self.position_rate_hz = position_rate_hz
+        # 0以下ならイベントを送らず位置合わせを続ける
+        self.positioning_sec = positioning_sec
+        self.playing_sec = playing_sec
+        self.loss = loss
+        self.codec = codec
+        self.sequence = sequence
+
+class VirtualHeadset(asyncio.DatagramProtocol):
+    """One simulated headset: MockQuest3 behaviour on an asyncio datagram endpoint."""
+    def __init__(self, index: int, name: str, bridge_addr, profile: LoadProfile, rng: random.Random):
+        self.index = index
+        self.name = name
+        self.bridge_addr = bridge_addr
+        self.profile = profile
+        self.rng = rng
+        self.transport = None
+        self.state = "POSITIONING"
+        self.device_id = None
+        self.codec = CODECS[CODEC_JSON]
+        self.sequence = SequenceCounter() if profile.sequence else None
+        self.pose_seq = 0
+        # 姿勢のx値 => 送信時刻 (x値はfloat32でも正確に表せる値を使う)
+        self.pending = OrderedDict()
+        self.reset_sent = None
+        self.last_heartbeat = None
+        self.counters = {"tx": 0, "rx": 0, "dropped_tx": 0, "dropped_rx": 0, "decode_errors": 0,
+                         "heartbeats": 0, "play_start": 0, "reset": 0}
+        self.samples = {"heartbeat_interval": [], "pose_rtt": [], "reset_reaction": []}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.profile.loss and self.rng.random() < self.profile.loss:
+            self.counters["dropped_rx"] += 1
+            return
+        self.counters["rx"] += 1
+        try:
+            decoded = decode_datagram(data)
+        except ValueError:
+            decoded = None
+        if decoded is None:
+            self.counters["decode_errors"] += 1
+            return
+        queue_name, packet, _ = decoded
+        if queue_name == "heartbeat_request":
+            self.handle_heartbeat_request(packet, time.perf_counter())
+
+    def handle_heartbeat_request(self, packet, now: float):
+        self.counters["heartbeats"] += 1
+        if self.last_heartbeat is not None:
+            self.samples["heartbeat_interval"].append((now - self.last_heartbeat) * 1000.0)
+        self.last_heartbeat = now
+        # ブリッジが通知したコーデックとデバイスIDに合わせる (MockQuest3と同じ)
+        bridge_codecs = packet.codecs or [CODEC_JSON]
+        self.codec = CODECS[self.profile.codec if self.profile.codec in bridge_codecs else CODEC_JSON]
+        self.device_id = packet.device_id
+        # RTT計測用のnonce/tsはすぐに返す (ブリッジ側でRTTを集計する)
+        if packet.nonce is not None:
+            self.send_heartbeat_response(packet.nonce, packet.ts)
+        try:
+            x = packet.saved_position["position"]["x"]
+        except (KeyError, TypeError):
+            return
+        sent = self.pending.get(x)
+        if sent is None:
+            return
+        # 返ってきた姿勢より前に送ったものはもう返らない
+        while self.pending:
+            key, _ = self.pending.popitem(last=False)
+            if key == x:
+                break
+        self.samples["pose_rtt"].append((now - sent) * 1000.0)
+        if self.reset_sent is not None and sent >= self.reset_sent:
+            self.samples["reset_reaction"].append((now - self.reset_sent) * 1000.0)
+            self.reset_sent = None
+
+    def send(self, packet):
+        if self.profile.loss and self.rng.random() < self.profile.loss:
+            self.counters["dropped_tx"] += 1
+            return
+        if self.sequence is not None:
+            data = self.codec.encode_sequenced(packet, self.sequence.next(), monotonic_ms())
+        else:
+            data = self.codec.encode(packet)
+        self.transport.sendto(data, self.bridge_addr)
+        self.counters["tx"] += 1
+
+    def send_heartbeat_response(self, nonce: int = None, ts: int = None):
+        codecs = [self.profile.codec, CODEC_JSON] if self.profile.codec != CODEC_JSON else None
+        self.send(HeartBeatResponse(self.state, codecs, self.device_id, nonce, ts))
+
+    def send_pose(self):
+        self.pose_seq += 1
+        # 1/256刻みの値はfloat32でも誤差なく往復する
+        x = (self.pose_seq % 65536) / 256.0 + 1.0
+        self.pending.pop(x, None)
+        self.pending[x] = time.perf_counter()
+        if len(self.pending) > MAX_PENDING_POSES:
+            self.pending.popitem(last=False)
+        self.send(PositioningRequest("unity", {"x": x, "y": float(self.index % 256), "z": 0.0}, {"x": 0.0, "y": 0.0, "z": 0.0}))
+
+    def send_event(self, event_type: str):
+        self.counters[event_type] += 1
+        self.send(EventRequest(event_type))
+
+    async def _every(self, rate_hz: float, action, stop_at: float):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / rate_hz
+        # ヘッドセット間で送信タイミングが揃わないよう開始をずらす
+        next_time = loop.time() + self.rng.random() * interval
+        while next_time < stop_at:
+            await asyncio.sleep(max(next_time - loop.time(), 0.0))
+            action()
+            next_time += interval
+
+    def _position_tick(self):
+        if self.state == "POSITIONING":
+            self.send_pose()
+
+    async def _script(self, stop_at: float):
+        if self.profile.positioning_sec <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            if loop.time() + self.profile.positioning_sec >= stop_at:
+                return
+            await asyncio.sleep(self.profile.positioning_sec)
+            self.state = "PLAYING"
+            self.send_event("play_start")
+            if loop.time() + self.profile.playing_sec >= stop_at:
+                return
+            await asyncio.sleep(self.profile.playing_sec)
+            self.state = "POSITIONING"
+            self.pending.clear()
+            self.reset_sent = time.perf_counter()
+            self.send_event("reset")
+
+    async def run(self, duration_sec: float):
+        stop_at = asyncio.get_running_loop().time() + duration_sec
+        tasks = [self._every(self.profile.heartbeat_rate_hz, self.send_heartbeat_response, stop_at),
+                 self._script(stop_at)]
+        if self.profile.position_rate_hz > 0:
+            tasks.append(self._every(self.profile.position_rate_hz, self._position_tick, stop_at))
+        await asyncio.gather(*tasks)
+
+    def report(self):
+        result = {"name": self.name}
+        result.update(self.counters)
+        for key, samples in self.samples.items():
+            result[f"{key}_ms"] = percentiles(samples)
+        return result
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles plus min/max/mean."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    result = {"count": len(ordered), "min": ordered[0], "max": ordered[-1], "mean": sum(ordered) / len(ordered)}
+    for point in points:
+        rank = max(int(round(point / 100.0 * len(ordered) + 0.5)) - 1, 0)
+        result[f"p{point}"] = ordered[min(rank, len(ordered) - 1)]
+    return result
+
+def headset_name(prefix: str, index: int) -> str:
+    return f"{prefix}{index:04d}"
+
+async def run_load(headsets: int, bridge_ip: str, bridge_port: int, headset_ip: str, base_port: int, shared: bool,
+                   profile: LoadProfile, duration_sec: float, name_prefix: str = "Headset", seed: int = None):
+    """Run every virtual headset for duration_sec. Returns (aggregate, per-headset reports)."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    clients = []
+    try:
+        for index in range(headsets):
+            bridge_addr = (bridge_ip, bridge_port if shared else bridge_port + index)
+            client = VirtualHeadset(index, headset_name(name_prefix, index), bridge_addr, profile, random.Random(rng.random()))
+            await loop.create_datagram_endpoint(lambda client=client: client, local_addr=(headset_ip, base_port + index if base_port else 0))
+            clients.append(client)
+        await asyncio.gather(*(client.run(duration_sec) for client in clients))
+    finally:
+        for client in clients:
+            if client.transport is not None:
+                client.transport.close()
+    reports = [client.report() for client in clients]
+    aggregate = {key: sum(report[key] for report in reports) for key in clients[0].counters} if clients else {}
+    for key in ("heartbeat_interval", "pose_rtt", "reset_reaction"):
+        aggregate[f"{key}_ms"] = percentiles([sample for client in clients for sample in client.samples[key]])
+    aggregate["headsets"] = headsets
+    aggregate["silent_headsets"] = sum(1 for client in clients if not client.counters["heartbeats"])
+    return aggregate, reports
+
+def write_node(directory: str, headsets: int, bridge_ip: str, bridge_port: int, headset_ip: str, base_port: int,
+               shared: bool, name_prefix: str = "Headset", runtime: str = None) -> str:
+    """Write a node.json and one device config per virtual headset. Returns the node.json path."""
+    os.makedirs(directory, exist_ok=True)
+    nodes = []
+    for index in range(headsets):
+        path = f"{headset_name(name_prefix, index)}.json"
+        config = {
+            "ar_ip": headset_ip,
+            "ar_port": base_port + index,
+            "server_udp_port": bridge_port if shared else bridge_port + index,
+            "player": {"type": "dji", "name": headset_name(name_prefix, index)},
+            "avatars": [],
+            "positioning_speed": {"rotation": 20.0, "move": 0.2},
+            "position": [0.0, 0.0, 0.0],
+            "rotation": [0.0, 0.0, 0.0],
+        }
+        with open(os.path.join(directory, path), "w") as f:
+            json.dump(config, f, indent=4)
+        nodes.append({"type": "device", "path": path})
+    node = {"bridge_ip": bridge_ip, "web_ip": bridge_ip, "ar_port": base_port, "nodes": nodes}
+    if shared:
+        node["shared_udp_port"] = bridge_port
+    if runtime:
+        node["runtime"] = runtime
+    node_path = os.path.join(directory, "node.json")
+    with open(node_path, "w") as f:
+        json.dump(node, f, indent=4)
+    return node_path
+
+def _format_row(name: str, result) -> str:
+    columns = [f"{name:16}", f"{result['heartbeats']:>8}"]
+    for key in ("heartbeat_interval_ms", "pose_rtt_ms", "reset_reaction_ms"):
+        stats = result[key]
+        if stats["count"]:
+            columns.append(f"{stats['p50']:9.1f}{stats['p99']:9.1f}")
+        else:
+            columns.append(f"{'-':>9}{'-':>9}")
+    columns.append(f"{result['dropped_tx'] + result['dropped_rx']:>9}")
+    return "".join(columns)
+
+def print_report(aggregate, reports, show: int):
+    print(f"{'headset':16}{'hb rx':>8}{'hb p50':>9}{'hb p99':>9}{'rtt p50':>9}{'rtt p99':>9}{'rst p50':>9}{'rst p99':>9}{'dropped':>9}")
+    print(_format_row("all", aggregate))
+    # pose_rttのp99が悪い順に表示する (応答のないヘッドセットが先頭)
+    ranked = sorted(reports, key=lambda r: r["pose_rtt_ms"].get("p99", float("inf")), reverse=True)
+    for report in ranked[:show]:
+        print(_format_row(report["name"], report))
+    if aggregate.get("silent_headsets"):
+        print(f"{aggregate['silent_headsets']} headset(s) received no HeartBeatRequest")
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-headset load generator")
+    parser.add_argument('--headsets', type=int, default=100, help="Number of virtual headsets (default: 100)")
+    parser.add_argument('--bridge-ip', type=str, default="127.0.0.1", help="Bridge IP address (default: 127.0.0.1)")
+    parser.add_argument('--bridge-port', type=int, default=48528, help="Bridge port of headset 0, or the shared port (default: 48528)")
+    parser.add_argument('--shared', action='store_true', help="Send every headset to one shared bridge port (routed by device_id)")
+    parser.add_argument('--headset-ip', type=str, default="127.0.0.1", help="IP address the headsets bind to (default: 127.0.0.1)")
+    parser.add_argument('--base-port', type=int, default=38528, help="Receive port of headset 0; headset i uses base + i (default: 38528)")
+    parser.add_argument('--name-prefix', type=str, default="Headset", help="device_id/player name prefix (default: Headset)")
+    parser.add_argument('--heartbeat-rate', type=float, default=1.0, help="HeartBeatResponses per second (default: 1)")
+    parser.add_argument('--position-rate', type=float, default=10.0, help="PositioningRequests per second while positioning (default: 10)")
+    parser.add_argument('--positioning-sec', type=float, default=5.0, help="Positioning time before play_start; 0 disables events (default: 5)")
+    parser.add_argument('--playing-sec', type=float, default=3.0, help="Playing time before reset (default: 3)")
+    parser.add_argument('--loss', type=float, default=0.0, help="Drop probability for each sent and received datagram (default: 0)")
+    parser.add_argument('--codec', type=str, default=CODEC_JSON, choices=[CODEC_JSON, CODEC_BINARY], help="Preferred wire codec (default: json)")
+    parser.add_argument('--sequence', action='store_true', help="Add sequence numbers and send timestamps to every packet")
+    parser.add_argument('--duration', type=float, default=30.0, help="Run time in seconds (default: 30)")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for start offsets and loss")
+    parser.add_argument('--show', type=int, default=10, help="Number of worst headsets to print (default: 10)")
+    parser.add_argument('--output', type=str, default=None, help="Write the aggregate and per-headset results as JSON")
+    parser.add_argument('--write-node', type=str, default=None, metavar="DIR", help="Write a matching bridge node.json and device configs to DIR and exit")
+    parser.add_argument('--runtime', type=str, default=None, choices=["thread", "asyncio"], help="Bridge runtime written to node.json by --write-node")
+    args = parser.parse_args()
+
+    if args.write_node:
+        node_path = write_node(args.write_node, args.headsets, args.bridge_ip, args.bridge_port, args.headset_ip,
+                               args.base_port, args.shared, args.name_prefix, args.runtime)
+        print(f"Wrote {node_path}: python -m asset_lib.main --node {node_path}")
+        return
+
+    profile = LoadProfile(args.heartbeat_rate, args.position_rate, args.positioning_sec, args.playing_sec,
+                          args.loss, args.codec, args.sequence)
+    print(f"Starting {args.headsets} headsets for {args.duration:.0f}s against {args.bridge_ip}:{args.bridge_port}"
+          f"{' (shared)' if args.shared else ''}")
+    aggregate, reports = asyncio.run(run_load(args.headsets, args.bridge_ip, args.bridge_port, args.headset_ip, args.base_port,
+                                              args.shared, profile, args.duration, args.name_prefix, args.seed))
+    print_report(aggregate, reports, args.show)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"aggregate": aggregate, "headsets": reports}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,16 @@ import time
 import threading
 import argparse
 
-from asset_lib.impl.comm.packet import PositioningRequest
+from asset_lib.impl.comm.packet import PositioningRequest, HeartBeatResponse
+from asset_lib.impl.comm.codec import CODECS, CODEC_BINARY, CODEC_JSON, BinaryCodec
+from asset_lib.impl.comm.sequence import SequenceCounter, monotonic_ms
 
 class MockQuest3:
-    def __init__(self, mock_type, recv_ip: str, recv_port: int, send_ip: str, send_port: int):
+    def __init__(self, mock_type, recv_ip: str, recv_port: int, send_ip: str, send_port: int, codec: str = CODEC_JSON, sequence: bool = False):
         self.mock_type = mock_type
+        # binaryを指定した場合はハートビート応答で対応を通知し、ブリッジが対応していればbinaryで送信する
+        self.preferred_codec = codec
+        self.codec = CODECS[CODEC_JSON]
         self.recv_ip = recv_ip
         self.recv_port = recv_port
         self.send_ip = send_ip
@@ -16,27 +21,26 @@ class MockQuest3:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.recv_ip, self.recv_port))
         self.state = "POSITIONING" 
+        self.device_id = None
+        # シーケンス番号と送信時刻のエンベロープを付ける
+        self.sequence = SequenceCounter() if sequence else None
 
-    def send_heartbeat_response(self):
-        """Send periodic heartbeat response to the PC app."""
-        packet = {
-            "type": "data",
-            "data_type": "heartbeat_response",
-            "data": {"status": self.state}
-        }
-        self.sock.sendto(json.dumps(packet).encode('utf-8'), (self.send_ip, self.send_port))
+    def send(self, packet):
+        if self.sequence is not None:
+            data = self.codec.encode_sequenced(packet, self.sequence.next(), monotonic_ms())
+        else:
+            data = self.codec.encode(packet)
+        self.sock.sendto(data, (self.send_ip, self.send_port))
+
+    def send_heartbeat_response(self, nonce=None, ts=None):
+        """Send periodic heartbeat response to the PC app (or the echo of a heartbeat request's nonce/ts)."""
+        codecs = [self.preferred_codec, CODEC_JSON] if self.preferred_codec != CODEC_JSON else None
+        packet = HeartBeatResponse(self.state, codecs, self.device_id, nonce, ts)
+        self.send(packet)
 
     def send_position_data(self, position, orientation):
-        packet = {
-            "type": "data",
-            "data_type": "position",
-            "data": {
-                "frame_type": 'unity',
-                "position": position,
-                "orientation": orientation
-            }
-        }
-        self.sock.sendto(json.dumps(packet).encode('utf-8'), (self.send_ip, self.send_port))
+        packet = PositioningRequest('unity', position, orientation)
+        self.send(packet)
 
     def handle_packet(self, packet):
         """Handle incoming packets and adjust the state accordingly."""
@@ -51,6 +55,14 @@ class MockQuest3:
                 self.state = "POSITIONING"
             print(f"Received position data: {packet['data']}")
         elif packet_type == "data" and data_type == "heartbeat_request":
+            # ブリッジが通知したコーデックから送信コーデックを選択
+            bridge_codecs = packet['data'].get('codecs') or [CODEC_JSON]
+            # 共有ソケットのブリッジが振り分けに使うデバイスIDを応答で返す
+            self.device_id = packet['data'].get('device_id')
+            self.codec = CODECS[self.preferred_codec if self.preferred_codec in bridge_codecs else CODEC_JSON]
+            # RTT計測用のnonce/tsはすぐに返す
+            if packet['data'].get('nonce') is not None:
+                self.send_heartbeat_response(packet['data']['nonce'], packet['data'].get('ts'))
             # ハートビートリクエストを受信した場合、ハートビートレスポンスを返信
             if self.state == "POSITIONING":
                 position = {"x": 0.0, "y": 0.0, "z": 0.0}
@@ -74,8 +86,11 @@ class MockQuest3:
     def receive_loop(self):
         """Receive packets and process them in an infinite loop."""
         while True:
-            data, _ = self.sock.recvfrom(1024)
-            packet = json.loads(data.decode('utf-8'))
+            data, _ = self.sock.recvfrom(65535)
+            if BinaryCodec.is_binary(data):
+                packet = CODECS[CODEC_BINARY].decode(data).to_dict()
+            else:
+                packet = json.loads(data.decode('utf-8'))
             if packet['type'] == 'data' and packet['data_type'] == "position":
                 print(f"Received packet: {packet}")
             self.handle_packet(packet)
@@ -97,12 +112,16 @@ class MockQuest3:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Mock Quest3 device")
     parser.add_argument('--type', type=str, default="device", help="Type of the node (default: device)")
+    parser.add_argument('--codec', type=str, default=CODEC_JSON, choices=[CODEC_JSON, CODEC_BINARY], help="Preferred wire codec (default: json)")
+    parser.add_argument('--recv-port', type=int, default=38528, help="Port to receive on (default: 38528)")
+    parser.add_argument('--send-port', type=int, default=48528, help="Bridge port to send to (default: 48528)")
+    parser.add_argument('--sequence', action='store_true', help="Add sequence numbers and send timestamps to every packet")
     args = parser.parse_args()
     recv_ip = "0.0.0.0"  # 受信側のIPアドレス
-    recv_port = 38528    # 受信ポート番号
+    recv_port = args.recv_port    # 受信ポート番号
     send_ip = "127.0.0.1"  # PCアプリ側のIPアドレス
-    send_port = 48528    # 送信ポート番号
+    send_port = args.send_port    # 送信ポート番号
 
     print(f"Starting MockQuest3 with recv_ip={recv_ip}, recv_port={recv_port}, send_ip={send_ip}, send_port={send_port}")
-    mock_quest3 = MockQuest3(args.type, recv_ip, recv_port, send_ip, send_port)
+    mock_quest3 = MockQuest3(args.type, recv_ip, recv_port, send_ip, send_port, args.codec, args.sequence)
     mock_quest3.start()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from asset_lib.impl import log
+
+logger = log.get_logger("control")
+
+DEFAULT_MAX_PENDING = 4
+DEFAULT_CAPTURE_DELAY_SEC = 0.5
+
+class CameraCaptureWorker:
+    """
+    Takes camera shots off the control loop.
+
+    request() only queues the shot and returns immediately. A worker thread waits until
+    delay_sec after the request (the settle time the control loop used to sleep), fetches
+    the image with simGetImage and writes it to <output_dir>/<prefix>-<timestamp>.png.
+    Existing files are never overwritten. At most max_pending shots wait in the queue;
+    when it is full the oldest request is dropped. Latency is measured from request to
+    the file being written.
+
+    The client must not be used by the control loop at the same time: joystick_control
+    passes a separate connection (SimClient.new_connection).
+    """
+    def __init__(self, client, image_type, output_dir: str = ".", prefix: str = "scene",
+                 camera_name: str = "0", max_pending: int = DEFAULT_MAX_PENDING,
+                 delay_sec: float = DEFAULT_CAPTURE_DELAY_SEC):
+        self.client = client
+        self.image_type = image_type
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.camera_name = camera_name
+        self.delay_sec = delay_sec
+        self.cond = threading.Condition()
+        self.pending = collections.deque(maxlen=max_pending)
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.requested = 0
+        self.captured = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_path: Optional[str] = None
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop after the shots already queued have been taken (or timeout)."""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def request(self) -> bool:
+        """Queue a shot. Returns False if an older pending shot had to be dropped."""
+        with self.cond:
+            self.requested += 1
+            dropped = len(self.pending) == self.pending.maxlen
+            if dropped:
+                self.dropped += 1
+            self.pending.append(time.monotonic())
+            self.cond.notify()
+        return not dropped
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                requested_at = self.pending[0]
+                # 要求からdelay_sec経つまで待つ (待っている間に古い要求が捨てられることがある)
+                remaining = requested_at + self.delay_sec - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self.pending.popleft()
+            self.capture(requested_at)
+
+    def capture(self, requested_at: float):
+        try:
+            png_image = self.client.simGetImage(self.camera_name, self.image_type)
+            if not png_image:
+                self.failed += 1
+                logger.warning("camera capture returned no image")
+                return
+            path = self.write(png_image)
+        except Exception as e:
+            self.failed += 1
+            logger.error("camera capture failed: %s", e)
+            return
+        latency = time.monotonic() - requested_at
+        with self.cond:
+            self.captured += 1
+            self.last_path = path
+            self.last_latency = latency
+            self.total_latency += latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+        logger.info("camera image saved: %s (%.0f ms)", path, latency * 1000)
+
+    def write(self, png_image: bytes) -> str:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        base = os.path.join(self.output_dir, f"{self.prefix}-{stamp}")
+        path = f"{base}.png"
+        suffix = 0
+        while True:
+            try:
+                # 'x'で既存ファイルを上書きしない
+                with open(path, 'xb') as f:
+                    f.write(png_image)
+                return path
+            except FileExistsError:
+                suffix += 1
+                path = f"{base}-{suffix}.png"
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "requested": self.requested,
+                "captured": self.captured,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": len(self.pending),
+                "last_path": self.last_path,
+                "last_latency_ms": self.last_latency * 1000.0,
+                "max_latency_ms": self.max_latency * 1000.0,
+                "mean_latency_ms": self.total_latency / self.captured * 1000.0 if self.captured else 0.0,
+            }
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Any
+
+from asset_lib.playing.sim_client import SimClient, Pose, Vector3r, yaw_to_quaternion
+
+NUM_AXES = 6
+NUM_BUTTONS = 16
+
+# 操作軸 (RcConfig.STICK_* / DroneControllerと同じ並び)
+HEADING_AXIS = 0
+UP_DOWN_AXIS = 1
+ROLL_AXIS = 2
+PITCH_AXIS = 3
+
+MAX_STEP_SEC = 0.02
+
+def _png(width: int = 1, height: int = 1) -> bytes:
+    """Gray PNG image used as the camera frame."""
+    def chunk(tag, payload):
+        return struct.pack(">I", len(payload)) + tag + payload + struct.pack(">I", zlib.crc32(tag + payload) & 0xffffffff)
+    raw = b"".join(b"\x00" + b"\x80" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+class FakeMultirotorClient(SimClient):
+    """
+    In-process stand-in for the Hakoniwa multirotor, for running and profiling the
+    playing path without a Hakoniwa install.
+
+    The joystick data written with putGameJoystickData is integrated into the pose
+    whenever the client is called (in steps of at most MAX_STEP_SEC): positive commands
+    reduce yaw (heading), z (up/down), and the body-frame x (pitch) and y (roll), as
+    DroneController assumes. Horizontal speed follows the command with a first-order lag.
+    Every call sleeps rpc_latency_sec (simGetImage additionally image_latency_sec) and
+    is counted in calls.
+    """
+    SCENE_IMAGE_TYPE = "scene"
+
+    def __init__(self, position=(0.0, 0.0, 0.0), yaw_deg: float = 0.0,
+                 max_speed: float = 5.0, climb_speed: float = 2.0, yaw_rate_deg: float = 90.0,
+                 response_sec: float = 0.5, rpc_latency_sec: float = 0.0, image_latency_sec: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], Any] = time.sleep):
+        self.default_drone_name = "DroneTransporter"
+        self.max_speed = max_speed
+        self.climb_speed = climb_speed
+        self.yaw_rate = math.radians(yaw_rate_deg)
+        self.response_sec = response_sec
+        self.rpc_latency_sec = rpc_latency_sec
+        self.image_latency_sec = image_latency_sec
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.x, self.y, self.z = position
+        self.yaw = math.radians(yaw_deg)
+        self.vx = 0.0
+        self.vy = 0.0
+        self.axis = [0.0] * NUM_AXES
+        self.button = [False] * NUM_BUTTONS
+        self.connected = False
+        self.api_control = False
+        self.armed = False
+        self.last_update = self.clock()
+        self.image = _png(4, 4)
+        self.calls = collections.Counter()
+
+    def _rpc(self, name: str, latency: float = 0.0):
+        self.calls[name] += 1
+        latency += self.rpc_latency_sec
+        if latency > 0:
+            self.sleep(latency)
+        with self.lock:
+            self._advance(self.clock())
+
+    def _advance(self, now: float):
+        remaining = now - self.last_update
+        self.last_update = now
+        while remaining > 0:
+            dt = min(remaining, MAX_STEP_SEC)
+            remaining -= dt
+            self.yaw -= self.axis[HEADING_AXIS] * self.yaw_rate * dt
+            self.yaw = (self.yaw + math.pi) % (2.0 * math.pi) - math.pi
+            self.z -= self.axis[UP_DOWN_AXIS] * self.climb_speed * dt
+            # 機体座標系の指令を世界座標系の目標速度へ
+            pitch = self.axis[PITCH_AXIS]
+            roll = self.axis[ROLL_AXIS]
+            cos_yaw = math.cos(self.yaw)
+            sin_yaw = math.sin(self.yaw)
+            target_vx = -(pitch * cos_yaw - roll * sin_yaw) * self.max_speed
+            target_vy = -(pitch * sin_yaw + roll * cos_yaw) * self.max_speed
+            k = min(dt / self.response_sec, 1.0) if self.response_sec > 0 else 1.0
+            self.vx += (target_vx - self.vx) * k
+            self.vy += (target_vy - self.vy) * k
+            self.x += self.vx * dt
+            self.y += self.vy * dt
+
+    def confirmConnection(self):
+        self._rpc("confirmConnection")
+        self.connected = True
+        return True
+
+    def enableApiControl(self, enable: bool):
+        self._rpc("enableApiControl")
+        self.api_control = enable
+        return True
+
+    def armDisarm(self, arm: bool):
+        self._rpc("armDisarm")
+        self.armed = arm
+        return True
+
+    def getGameJoystickData(self) -> Dict[str, Any]:
+        self._rpc("getGameJoystickData")
+        with self.lock:
+            return {'axis': tuple(self.axis), 'button': tuple(self.button)}
+
+    def putGameJoystickData(self, data: Dict[str, Any]):
+        self._rpc("putGameJoystickData")
+        with self.lock:
+            axis = list(data['axis'])[:NUM_AXES]
+            self.axis[:len(axis)] = [max(min(float(v), 1.0), -1.0) for v in axis]
+            button = list(data['button'])[:NUM_BUTTONS]
+            self.button[:len(button)] = [bool(v) for v in button]
+        return True
+
+    def simGetVehiclePose(self) -> Pose:
+        self._rpc("simGetVehiclePose")
+        with self.lock:
+            return Pose(Vector3r(self.x, self.y, self.z), yaw_to_quaternion(self.yaw))
+
+    def simGetImage(self, camera_name: str, image_type):
+        self._rpc("simGetImage", self.image_latency_sec)
+        return self.image
+
+    def new_connection(self):
+        # 状態はロックで守られ、呼び出しの遅延はロックの外で待つため、
+        # 同じインスタンスを別スレッドから呼んでも別接続と同じく互いを待たせない
+        return self
@@ -2,26 +2,56 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from asset_lib.impl.local.sync_manager_local import SyncManager
-import hakosim
+import threading
+from asset_lib.impl.local.sync_manager_local import SyncManagerLocal
 import pygame
 import time
-from asset_lib.playing.return_to_home import DroneController
+from asset_lib.playing.return_to_home import ReturnToHome
+from asset_lib.playing.camera_capture import CameraCaptureWorker
+from asset_lib.playing.sim_client import LockedSimClient, SimClient, SIMULATOR_HAKOSIM, create_client
 from asset_lib.impl.drivers.rc_utils import RcConfig, StickMonitor
+from asset_lib.impl.rate_loop import RateLoop
+from asset_lib.impl.metrics import ProgressCounter
+from asset_lib.impl import log
 import os
 
-def saveCameraImage(client):
-    png_image = client.simGetImage("0", hakosim.ImageType.Scene)
-    if png_image:
-        with open("scene.png", "wb") as f:
-            f.write(png_image)
+logger = log.get_logger("control")
 
-def joystick_control(client: hakosim.MultirotorClient, stick_monitor: StickMonitor, sync_manager: SyncManager) -> int:
+# 制御ループの周期と、変化が無いときにジョイスティックデータを書き直す間隔
+DEFAULT_CONTROL_RATE_HZ = 100.0
+DEFAULT_KEEPALIVE_SEC = 0.5
+# RTH中にこれ以上スティックを倒すとRTHを中止して手動操作に戻る
+RTH_CANCEL_STICK_VALUE = 0.3
+RTH_PROGRESS_INTERVAL_SEC = 1.0
+
+def joystick_control(client: SimClient, stick_monitor: StickMonitor, sync_manager: SyncManagerLocal,
+                     control_rate_hz: float = DEFAULT_CONTROL_RATE_HZ, keepalive_sec: float = DEFAULT_KEEPALIVE_SEC,
+                     capture_dir: str = ".", stop_event: threading.Event = None, progress: ProgressCounter = None) -> int:
+    loop = RateLoop(control_rate_hz)
+    progress = progress or ProgressCounter()
+    # 撮影(画像取得とファイル書き込み)は別スレッドが別の接続で行い、制御ループを止めない
+    camera_client = client.new_connection()
+    if camera_client is None:
+        # 2本目の接続を開けない場合だけ1つの接続を共有し、呼び出しをロックで直列化する
+        if not isinstance(client, LockedSimClient):
+            client = LockedSimClient(client)
+        camera_client = client
+    camera = CameraCaptureWorker(camera_client, client.SCENE_IMAGE_TYPE, capture_dir)
+    camera.start()
+    # ジョイスティックデータはこのループが保持し、変化したときとkeepalive_secごとにだけ書き込む
+    data = client.getGameJoystickData()
+    data['axis'] = list(data['axis'])
+    data['button'] = list(data['button'])
+    changed = True
+    last_put = 0.0
+    puts = 0
+    rth = ReturnToHome(client, height=2.0, power=0.5, yaw_power=0.8)
+    last_progress = 0.0
     try:
         while True:
-            if sync_manager.get_sync_status() != "PLAYING":
+            if (stop_event is not None and stop_event.is_set()) or sync_manager.get_sync_status() != "PLAYING":
                 return -1
-            data = client.getGameJoystickData()
+            progress.tick()
             for event in pygame.event.get():
                 if event.type == pygame.JOYAXISMOTION:
                     if event.axis < 6:
@@ -29,45 +59,86 @@ def joystick_control(client: hakosim.MultirotorClient, stick_monitor: StickMonit
                             op_index = stick_monitor.rc_config.get_op_index(event.axis)
                             stick_value = stick_monitor.stick_value(event.axis, event.value)
                         except ValueError:
-                            print(f'ERROR: not supported axis index: {event.axis}')
+                            logger.error("not supported axis index: %s", event.axis)
                             continue
-                        data['axis'] = list(data['axis'])
-                        data['axis'][op_index] = stick_value
+                        if data['axis'][op_index] != stick_value:
+                            data['axis'][op_index] = stick_value
+                            changed = True
+                        if rth.active and abs(stick_value) >= RTH_CANCEL_STICK_VALUE:
+                            logger.info("RTH cancelled by stick input")
+                            rth.cancel()
+                            changed = True
                     else:
                         pass
                         #print(f'ERROR: not supported axis index: {event.axis}')
                 elif event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
                     if event.button < 16:
-                        print("button event: ", event.button)
-                        data['button'] = list(data['button'])
                         event_op_index = stick_monitor.rc_config.get_event_op_index(event.button)
                         if event_op_index is not None:
                             event_triggered = stick_monitor.switch_event(event.button, (event.type == pygame.JOYBUTTONDOWN))
-                            print(f"button event: switch_index={event.button} event_op_index={event_op_index} down: {(event.type == pygame.JOYBUTTONDOWN)} event_triggered={event_triggered}")
-                            data['button'][event_op_index] = event_triggered
+                            logger.debug("button event: switch_index=%s event_op_index=%s down: %s event_triggered=%s",
+                                         event.button, event_op_index, event.type == pygame.JOYBUTTONDOWN, event_triggered)
+                            if data['button'][event_op_index] != event_triggered:
+                                data['button'][event_op_index] = event_triggered
+                                changed = True
                             if event_triggered:
                                 if event_op_index == stick_monitor.rc_config.SWITCH_CAMERA_SHOT:
-                                    time.sleep(0.5)
-                                    saveCameraImage(client)
+                                    if not camera.request():
+                                        logger.warning("camera queue full, dropped the oldest shot")
                                 elif event_op_index == stick_monitor.rc_config.SWITCH_RETURN_HOME:
-                                    controller = DroneController(client, default_drone_name=client.default_drone_name, height=2.0, power=0.5, yaw_power=0.8)
-                                    controller.return_to_home()
+                                    # RTHはこのループの中で並行して進める (もう一度押すと中止)
+                                    if rth.active:
+                                        logger.info("RTH cancelled")
+                                        rth.cancel()
+                                        changed = True
+                                    else:
+                                        logger.info("RTH started")
+                                        rth.start()
                         else:
-                            print(f'ERROR: not supported button index: {event.button}')
+                            logger.error("not supported button index: %s", event.button)
                             pygame.event.clear()
                             return -1
                     else:
-                        print(f'ERROR: not supported button index(overflow): {event.button}')
+                        logger.error("not supported button index(overflow): %s", event.button)
                         pygame.event.clear()
                         return -1
-            client.putGameJoystickData(data)
+            now = time.monotonic()
+            if rth.active:
+                commands = rth.step()
+                if commands is not None:
+                    rth_data = dict(data)
+                    rth_data['axis'] = list(data['axis'])
+                    rth_data['axis'][:len(commands)] = commands
+                    client.putGameJoystickData(rth_data)
+                    last_put = now
+                    puts += 1
+                    if not rth.active or now - last_progress >= RTH_PROGRESS_INTERVAL_SEC:
+                        logger.info("%s", rth.progress_text())
+                        last_progress = now
+                if not rth.active:
+                    # RTHが終わった(中止された)ら手動操作の値で書き戻す
+                    changed = True
+            elif changed or now - last_put >= keepalive_sec:
+                client.putGameJoystickData(data)
+                changed = False
+                last_put = now
+                puts += 1
+            loop.wait()
     except KeyboardInterrupt:
         pygame.joystick.quit()
         pygame.quit()
+    finally:
+        camera.stop()
+        logger.info("control loop: puts=%d %s", puts, loop.stats())
+        logger.info("camera: %s", camera.stats())
 
-def do_radio_control(sync_manager: SyncManager, custom_config_path: str, stick_monitor: StickMonitor) -> int:    
-    if not os.path.exists(custom_config_path):
-        print(f"ERROR: Config file not found at '{custom_config_path}'")
+def do_radio_control(sync_manager: SyncManagerLocal, custom_config_path: str, stick_monitor: StickMonitor,
+                     control_rate_hz: float = None, keepalive_sec: float = None, capture_dir: str = None,
+                     simulator: str = None, simulator_options: dict = None, stop_event: threading.Event = None,
+                     progress: ProgressCounter = None) -> int:
+    simulator = simulator or SIMULATOR_HAKOSIM
+    if simulator == SIMULATOR_HAKOSIM and not os.path.exists(custom_config_path):
+        logger.error("Config file not found at '%s'", custom_config_path)
         return -1
 
     pygame.init()
@@ -75,23 +146,25 @@ def do_radio_control(sync_manager: SyncManager, custom_config_path: str, stick_m
 
     # 接続されているジョイスティックの数を取得
     joystick_count = pygame.joystick.get_count()
-    print(f"Number of joysticks: {joystick_count}")
+    logger.info("Number of joysticks: %d", joystick_count)
     try:
         # ジョイスティックのインスタンス生成
         joystick = pygame.joystick.Joystick(0)
         joystick.init()
-        print(f'ジョイスティックの名前: {joystick.get_name()}')
-        print(f'ボタン数 : {joystick.get_numbuttons()}')
+        logger.info("ジョイスティックの名前: %s", joystick.get_name())
+        logger.info("ボタン数 : %d", joystick.get_numbuttons())
     except pygame.error:
-        print('ジョイスティックが接続されていません')
+        logger.error("ジョイスティックが接続されていません")
         pygame.joystick.quit()
         pygame.quit()
         return -1
-    # connect to the HakoSim simulator
-    client = hakosim.MultirotorClient(custom_config_path)
-    client.default_drone_name = "DroneTransporter"
+    # connect to the HakoSim simulator (or the in-process fake)
+    client = create_client(simulator, custom_config_path, "DroneTransporter", simulator_options)
     client.confirmConnection()
     client.enableApiControl(True)
     client.armDisarm(True)
-    return joystick_control(client, stick_monitor, sync_manager)
+    return joystick_control(client, stick_monitor, sync_manager,
+                            control_rate_hz or DEFAULT_CONTROL_RATE_HZ,
+                            keepalive_sec if keepalive_sec is not None else DEFAULT_KEEPALIVE_SEC,
+                            capture_dir or ".", stop_event, progress)
 
@@ -2,12 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import hakosim
-import hako_pdu
 import math
 import os
-import hakopy
 import time
+from asset_lib.impl.rate_loop import RateLoop
+from asset_lib.playing.sim_client import quaternion_to_yaw
+
+DEFAULT_RTH_RATE_HZ = 20.0
+DEFAULT_RTH_TIMEOUT_SEC = 120.0
 
 class DroneController:
     HEADING_AXIS = 0
@@ -16,8 +18,6 @@ class DroneController:
     PITCH_AXIS = 3
     YAW_TOLERANCE = 0.01
     POSITION_TOLERANCE = 0.2
-    CLOSE_YAW_RANGE = 10
-    CLOSE_RANGE = 30
 
     def __init__(self, client, default_drone_name="DroneTransporter", height=3.0, power=0.1, yaw_power=0.9):
         self.client = client
@@ -34,75 +34,214 @@ class DroneController:
     def _get_pose(self):
         return self.client.simGetVehiclePose()
 
-    def _update_joystick(self, axis, value):
-        data = self.client.getGameJoystickData()
-        data['axis'] = list(data['axis'])
-        data['axis'][axis] = value
-        self.client.putGameJoystickData(data)
-
     def debug_pos(self):
         pose = self._get_pose()
         print(f"POS  : {pose.position.x_val} {pose.position.y_val} {pose.position.z_val}")
+        import hakosim
         roll, pitch, yaw = hakosim.hakosim_types.Quaternionr.quaternion_to_euler(pose.orientation)
         print(f"ANGLE: {math.degrees(roll)} {math.degrees(pitch)} {math.degrees(yaw)}")
 
-    def adjust_heading(self):
-        while True:
-            pose = self._get_pose()
-            _, _, yaw = hakosim.hakosim_types.Quaternionr.quaternion_to_euler(pose.orientation)
-            yaw_deg = math.degrees(yaw)
-            if abs(yaw_deg) <= self.YAW_TOLERANCE:
-                break
-            power = 0.05 if abs(yaw_deg) < self.CLOSE_YAW_RANGE else self.power
-            self._update_joystick(self.HEADING_AXIS, power if yaw_deg > 0 else -power)
-            self._print_progress(f"Adjusting Heading... yaw_val: {yaw_deg:.5f} power: {power}")
-
-        self._update_joystick(self.HEADING_AXIS, 0.0)
-        self._print_progress("Heading adjustment complete\n")
-
-    def move_z(self):
-        while self._get_pose().position.z_val > self.height - 0.1:
-            z_val = self._get_pose().position.z_val
-            self._update_joystick(self.UP_DOWN_AXIS, self.power)
-            self._print_progress(f"Moving to target height... z_val: {z_val:.2f}, power: {self.power}")
-
-        self._update_joystick(self.UP_DOWN_AXIS, 0.0)
-        self._print_progress("Reached target height\n")
-
-    def move_x(self, target_x=0.0):
-        while abs(self._get_pose().position.x_val - target_x) > self.POSITION_TOLERANCE:
-            x_val = self._get_pose().position.x_val
-            power = 0.05 if abs(x_val - target_x) < self.CLOSE_RANGE else self.power
-            self._update_joystick(self.PITCH_AXIS, power if x_val > target_x else -power)
-            self._print_progress(f"Moving to target X... x_val: {x_val:.2f}, power: {power}")
-
-        self._update_joystick(self.PITCH_AXIS, 0.0)
-        self._print_progress("X position reached\n")
-
-    def move_y(self, target_y=0.0):
-        while abs(self._get_pose().position.y_val - target_y) > self.POSITION_TOLERANCE:
-            y_val = self._get_pose().position.y_val
-            power = 0.05 if abs(y_val - target_y) < self.CLOSE_RANGE else self.power
-            self._update_joystick(self.ROLL_AXIS, power if y_val > target_y else -power)
-            self._print_progress(f"Moving to target Y... y_val: {y_val:.2f}, power: {power}")
-
-        self._update_joystick(self.ROLL_AXIS, 0.0)
-        self._print_progress("Y position reached\n")
-
     def return_to_home(self):
-        self.adjust_heading()
-        self.move_x()
-        self.move_y()
-        self.move_z()
+        """ReturnToHome をこのスレッドで完了まで実行する"""
+        rth = ReturnToHome(self.client, height=self.height, power=self.power, yaw_power=self.yaw_power)
+        loop = RateLoop(rth.rate_hz)
+        data = self.client.getGameJoystickData()
+        data['axis'] = list(data['axis'])
+        rth.start()
+        while rth.active:
+            commands = rth.step()
+            if commands is not None:
+                data['axis'][:len(commands)] = commands
+                self.client.putGameJoystickData(data)
+                self._print_progress(rth.progress_text())
+            loop.wait()
+        self._print_progress(rth.progress_text() + "\n")
+        return rth.state == ReturnToHome.DONE
+
+class Pid:
+    """PID controller with output limit and integral anti-windup."""
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, limit: float = 1.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error: float, dt: float) -> float:
+        derivative = 0.0
+        if self.last_error is not None and dt > 0:
+            derivative = (error - self.last_error) / dt
+        self.last_error = error
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        # 出力が飽和している間は積分しない
+        if abs(output) < self.limit and dt > 0:
+            self.integral += error * dt
+        return max(min(output, self.limit), -self.limit)
+
+class ReturnToHome:
+    """
+    Return-to-home engine that drives heading, X, Y and height at the same time.
+
+    step() is called from a fixed-rate loop (e.g. joystick_control) and acts at most
+    rate_hz times per second: it reads the vehicle pose once, updates one PID per axis and
+    returns the stick commands [heading, up/down, roll, pitch] (positive commands reduce
+    yaw, z, y and x, as in DroneController). The X/Y error is rotated into the body frame,
+    and translation starts once the heading is within HEADING_GATE_DEG. As before, the
+    height is only approached from above. cancel() stops it at the next step.
+    """
+    IDLE = "idle"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    TIMEOUT = "timeout"
+
+    HEADING_GATE_DEG = 30.0
+    ETA_SMOOTHING = 0.2
+
+    def __init__(self, client, height: float = 2.0, power: float = 0.5, yaw_power: float = 0.8,
+                 target_x: float = 0.0, target_y: float = 0.0,
+                 rate_hz: float = DEFAULT_RTH_RATE_HZ, timeout_sec: float = DEFAULT_RTH_TIMEOUT_SEC,
+                 clock=time.monotonic):
+        self.client = client
+        self.height = height
+        self.target_x = target_x
+        self.target_y = target_y
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.timeout_sec = timeout_sec
+        self.clock = clock
+        self.yaw_pid = Pid(kp=0.02, ki=0.002, kd=0.005, limit=yaw_power)
+        self.x_pid = Pid(kp=0.15, ki=0.01, kd=0.1, limit=power)
+        self.y_pid = Pid(kp=0.15, ki=0.01, kd=0.1, limit=power)
+        self.z_pid = Pid(kp=0.3, ki=0.02, kd=0.1, limit=power)
+        self.state = self.IDLE
+        self.reset_progress()
+
+    def reset_progress(self):
+        self.start_time = 0.0
+        self.last_step = None
+        self.initial_distance = None
+        self.distance = None
+        self.yaw_error = None
+        self.last_distance = None
+        self.speed = 0.0
+        self.steps = 0
+
+    @property
+    def active(self) -> bool:
+        return self.state == self.RUNNING
+
+    def start(self):
+        for pid in (self.yaw_pid, self.x_pid, self.y_pid, self.z_pid):
+            pid.reset()
+        self.reset_progress()
+        self.start_time = self.clock()
+        self.state = self.RUNNING
+
+    def cancel(self):
+        if self.state == self.RUNNING:
+            self.state = self.CANCELLED
+
+    def step(self):
+        """Returns the stick commands, [0, 0, 0, 0] when finished, or None if it is not time to act yet."""
+        if self.state != self.RUNNING:
+            return None
+        now = self.clock()
+        if self.last_step is not None and now - self.last_step < self.period:
+            return None
+        dt = now - self.last_step if self.last_step is not None else 0.0
+        self.last_step = now
+        self.steps += 1
+
+        # 1周期に1回だけ姿勢を読む
+        pose = self.client.simGetVehiclePose()
+        yaw = quaternion_to_yaw(pose.orientation)
+        yaw_error = (math.degrees(yaw) + 180.0) % 360.0 - 180.0
+        ex = pose.position.x_val - self.target_x
+        ey = pose.position.y_val - self.target_y
+        # 高さは従来通り上側からのみ合わせる
+        ez = max(pose.position.z_val - (self.height - 0.1), 0.0)
+        self.update_progress(now, dt, math.hypot(ex, ey) + ez, yaw_error)
+
+        if (abs(yaw_error) <= DroneController.YAW_TOLERANCE and abs(ex) <= DroneController.POSITION_TOLERANCE
+                and abs(ey) <= DroneController.POSITION_TOLERANCE and ez <= 0.0):
+            self.state = self.DONE
+            return [0.0, 0.0, 0.0, 0.0]
+        if now - self.start_time > self.timeout_sec:
+            self.state = self.TIMEOUT
+            return [0.0, 0.0, 0.0, 0.0]
+
+        heading = self.yaw_pid.update(yaw_error, dt)
+        up_down = max(self.z_pid.update(ez, dt), 0.0)
+        roll = 0.0
+        pitch = 0.0
+        if abs(yaw_error) <= self.HEADING_GATE_DEG:
+            # 機体座標系へ回転 (yaw=0でpitch→X、roll→Y)
+            cos_yaw = math.cos(yaw)
+            sin_yaw = math.sin(yaw)
+            pitch = self.x_pid.update(ex * cos_yaw + ey * sin_yaw, dt)
+            roll = self.y_pid.update(-ex * sin_yaw + ey * cos_yaw, dt)
+        return [heading, up_down, roll, pitch]
+
+    def update_progress(self, now: float, dt: float, distance: float, yaw_error: float):
+        if self.initial_distance is None:
+            self.initial_distance = distance
+        if self.last_distance is not None and dt > 0:
+            speed = (self.last_distance - distance) / dt
+            self.speed += (speed - self.speed) * self.ETA_SMOOTHING
+        self.last_distance = distance
+        self.distance = distance
+        self.yaw_error = yaw_error
+
+    def progress(self):
+        """Progress report: state, remaining distance [m] and heading error [deg], progress (0..1), ETA [s]."""
+        progress = None
+        if self.initial_distance:
+            progress = max(min(1.0 - self.distance / self.initial_distance, 1.0), 0.0)
+        elif self.initial_distance == 0.0:
+            progress = 1.0
+        eta = None
+        if self.state == self.DONE:
+            eta = 0.0
+        elif self.state == self.RUNNING and self.distance is not None and self.speed > 1e-3:
+            eta = self.distance / self.speed
+        return {
+            "state": self.state,
+            "elapsed_sec": (self.last_step - self.start_time) if self.last_step is not None else 0.0,
+            "distance": self.distance,
+            "yaw_error": self.yaw_error,
+            "progress": progress,
+            "eta_sec": eta,
+        }
+
+    def progress_text(self) -> str:
+        p = self.progress()
+        if p["distance"] is None:
+            return f"RTH {p['state']}"
+        eta = f"{p['eta_sec']:.1f}s" if p["eta_sec"] is not None else "--"
+        return (f"RTH {p['state']}: distance {p['distance']:.2f}m yaw {p['yaw_error']:.2f}deg "
+                f"progress {p['progress'] * 100:.0f}% ETA {eta}")
 
 def main():
     if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <config_path>")
+        print(f"Usage: {sys.argv[0]} <config_path>|--fake")
         return 1
 
-    client = hakosim.MultirotorClient(sys.argv[1])
-    hako_binary_path = os.getenv('HAKO_BINARY_PATH', '/usr/local/lib/hakoniwa/hako_binary/offset')
-    client.pdu_manager = hako_pdu.HakoPduManager(hako_binary_path, sys.argv[1])
+    if sys.argv[1] == "--fake":
+        # Hakoniwa無しで動作確認する (離れた位置・向きから戻す)
+        from asset_lib.playing.fake_multirotor import FakeMultirotorClient
+        client = FakeMultirotorClient(position=(20.0, -10.0, 6.0), yaw_deg=45.0)
+    else:
+        import hakosim
+        import hako_pdu
+        import hakopy
+        client = hakosim.MultirotorClient(sys.argv[1])
+        hako_binary_path = os.getenv('HAKO_BINARY_PATH', '/usr/local/lib/hakoniwa/hako_binary/offset')
+        client.pdu_manager = hako_pdu.HakoPduManager(hako_binary_path, sys.argv[1])
 
     client.confirmConnection()
     client.enableApiControl(True)
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+SIMULATOR_HAKOSIM = "hakosim"
+SIMULATOR_FAKE = "fake"
+
+class Vector3r:
+    __slots__ = ('x_val', 'y_val', 'z_val')
+
+    def __init__(self, x_val: float = 0.0, y_val: float = 0.0, z_val: float = 0.0):
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+
+class Quaternionr:
+    __slots__ = ('w_val', 'x_val', 'y_val', 'z_val')
+
+    def __init__(self, w_val: float = 1.0, x_val: float = 0.0, y_val: float = 0.0, z_val: float = 0.0):
+        self.w_val = w_val
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+
+class Pose:
+    __slots__ = ('position', 'orientation')
+
+    def __init__(self, position: Vector3r, orientation: Quaternionr):
+        self.position = position
+        self.orientation = orientation
+
+def yaw_to_quaternion(yaw: float) -> Quaternionr:
+    return Quaternionr(math.cos(yaw / 2.0), 0.0, 0.0, math.sin(yaw / 2.0))
+
+def quaternion_to_yaw(q) -> float:
+    """Yaw [rad] of a quaternion with w_val/x_val/y_val/z_val (hakosim or Quaternionr), ZYX order."""
+    return math.atan2(2.0 * (q.w_val * q.z_val + q.x_val * q.y_val),
+                      1.0 - 2.0 * (q.y_val * q.y_val + q.z_val * q.z_val))
+
+class SimClient(ABC):
+    """
+    The part of the simulator API used by the playing subsystem (rc_custom, return_to_home).
+
+    Joystick data is a dict with 'axis' (stick values indexed by RcConfig.STICK_*) and
+    'button' (indexed by RcConfig.SWITCH_*). Poses have position.x_val/y_val/z_val and a
+    quaternion orientation (w_val/x_val/y_val/z_val).
+    """
+    # simGetImageに渡すシーン画像の種類 (実装ごとに定義する)
+    SCENE_IMAGE_TYPE: Any = None
+
+    default_drone_name: Optional[str] = None
+
+    @abstractmethod
+    def confirmConnection(self):
+        pass
+
+    @abstractmethod
+    def enableApiControl(self, enable: bool):
+        pass
+
+    @abstractmethod
+    def armDisarm(self, arm: bool):
+        pass
+
+    @abstractmethod
+    def getGameJoystickData(self) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    def putGameJoystickData(self, data: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    def simGetVehiclePose(self):
+        pass
+
+    @abstractmethod
+    def simGetImage(self, camera_name: str, image_type) -> Optional[bytes]:
+        pass
+
+    def new_connection(self) -> Optional['SimClient']:
+        """
+        Open another connected client to the same simulator and vehicle, for use from
+        another thread. None if this client cannot open one.
+        """
+        return None
+
+class HakoSimClient(SimClient):
+    """SimClient backed by hakosim.MultirotorClient (hakosim is imported only when this is used)."""
+    def __init__(self, custom_config_path: str, default_drone_name: str = None):
+        import hakosim
+        self.custom_config_path = custom_config_path
+        self.client = hakosim.MultirotorClient(custom_config_path)
+        self.SCENE_IMAGE_TYPE = hakosim.ImageType.Scene
+        if default_drone_name is not None:
+            self.default_drone_name = default_drone_name
+
+    @property
+    def default_drone_name(self):
+        return self.client.default_drone_name
+
+    @default_drone_name.setter
+    def default_drone_name(self, name):
+        self.client.default_drone_name = name
+
+    def confirmConnection(self):
+        return self.client.confirmConnection()
+
+    def enableApiControl(self, enable: bool):
+        return self.client.enableApiControl(enable)
+
+    def armDisarm(self, arm: bool):
+        return self.client.armDisarm(arm)
+
+    def getGameJoystickData(self):
+        return self.client.getGameJoystickData()
+
+    def putGameJoystickData(self, data):
+        return self.client.putGameJoystickData(data)
+
+    def simGetVehiclePose(self):
+        return self.client.simGetVehiclePose()
+
+    def simGetImage(self, camera_name, image_type):
+        return self.client.simGetImage(camera_name, image_type)
+
+    def new_connection(self):
+        client = HakoSimClient(self.custom_config_path, self.default_drone_name)
+        client.confirmConnection()
+        return client
+
+class LockedSimClient(SimClient):
+    """
+    Wraps a SimClient so that its calls are serialized with one lock.
+
+    The simulator clients are not thread-safe. The control loop and the
+    CameraCaptureWorker thread normally use separate connections (new_connection); only a
+    client that cannot open a second one is shared through this wrapper, and then a shot
+    delays the control calls by the image fetch time.
+    """
+    def __init__(self, client: SimClient):
+        self.client = client
+        self.lock = threading.Lock()
+        self.SCENE_IMAGE_TYPE = client.SCENE_IMAGE_TYPE
+
+    @property
+    def default_drone_name(self):
+        return self.client.default_drone_name
+
+    @default_drone_name.setter
+    def default_drone_name(self, name):
+        self.client.default_drone_name = name
+
+    def confirmConnection(self):
+        with self.lock:
+            return self.client.confirmConnection()
+
+    def enableApiControl(self, enable: bool):
+        with self.lock:
+            return self.client.enableApiControl(enable)
+
+    def armDisarm(self, arm: bool):
+        with self.lock:
+            return self.client.armDisarm(arm)
+
+    def getGameJoystickData(self):
+        with self.lock:
+            return self.client.getGameJoystickData()
+
+    def putGameJoystickData(self, data):
+        with self.lock:
+            return self.client.putGameJoystickData(data)
+
+    def simGetVehiclePose(self):
+        with self.lock:
+            return self.client.simGetVehiclePose()
+
+    def simGetImage(self, camera_name, image_type):
+        with self.lock:
+            return self.client.simGetImage(camera_name, image_type)
+
+def create_client(simulator: str, custom_config_path: str = None, default_drone_name: str = None,
+                  options: Optional[Dict[str, Any]] = None) -> SimClient:
+    """Create the simulator client selected by the local config ("simulator": "hakosim" | "fake")."""
+    if simulator == SIMULATOR_HAKOSIM:
+        return HakoSimClient(custom_config_path, default_drone_name)
+    elif simulator == SIMULATOR_FAKE:
+        from asset_lib.playing.fake_multirotor import FakeMultirotorClient
+        client = FakeMultirotorClient(**(options or {}))
+        if default_drone_name is not None:
+            client.default_drone_name = default_drone_name
+        return client
+    raise ValueError(f"Unknown simulator: {simulator}")
@@ -0,0 +1,50 @@
+"""
+Encode/decode throughput of every packet type in packet.py, for each wire codec.
+
+encode is PacketCodec.encode_uncached (full serialization; the per-packet cache would
+make repeated encodes free), decode is decode_datagram, the path UdpComm receives on.
+
+    python -m benchmarks.bench_codec [--duration 0.5]
+"""
+import argparse
+
+from asset_lib.impl.comm.codec import CODECS, decode_datagram
+from asset_lib.impl.comm.packet import EventRequest, HeartBeatRequest, HeartBeatResponse, PositioningRequest
+from benchmarks.common import rate
+
+def make_packets():
+    pose = {"frame_type": "unity", "position": {"x": 0.5, "y": 1.5, "z": -0.25}, "orientation": {"x": 0.0, "y": 45.0, "z": 0.0}}
+    avatars = [{"type": "dji", "name": f"Avatar{i}"} for i in range(4)]
+    return {
+        "heartbeat_request": HeartBeatRequest("127.0.0.1", 48528, {"rotation": 20.0, "move": 0.2}, pose,
+                                              {"type": "dji", "name": "Drone1"}, avatars, ["binary", "json"], "Drone1"),
+        "heartbeat_response": HeartBeatResponse("POSITIONING", ["binary", "json"], "Drone1"),
+        "event": EventRequest("play_start"),
+        "position": PositioningRequest("unity", pose["position"], pose["orientation"]),
+    }
+
+def run(quick: bool = False, duration: float = None):
+    duration = duration or (0.1 if quick else 0.5)
+    results = {}
+    for name, packet in make_packets().items():
+        for codec_name, codec in CODECS.items():
+            data = codec.encode_uncached(packet)
+            decoded = decode_datagram(data)
+            assert decoded is not None, f"{name}/{codec_name} did not round-trip"
+            results[f"{name}/{codec_name}"] = {
+                "bytes": len(data),
+                "encode_per_sec": rate(lambda: codec.encode_uncached(packet), duration),
+                "decode_per_sec": rate(lambda: decode_datagram(data), duration),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet codec benchmark")
+    parser.add_argument('--duration', type=float, default=0.5, help="Seconds per measurement (default: 0.5)")
+    args = parser.parse_args()
+    print(f"{'packet/codec':32}{'bytes':>7}{'encode/s':>12}{'decode/s':>12}")
+    for name, result in run(duration=args.duration).items():
+        print(f"{name:32}{result['bytes']:7d}{result['encode_per_sec']:12.0f}{result['decode_per_sec']:12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Receive + decode throughput of UdpComm on a loopback UDP stream.
+
+Compares the legacy receive path (BasePacket.from_json to find the type, then
+packet_class.from_json on the same string again, dict-of-dicts packets) with the
+single-pass typed decoder used by UdpComm.handle_datagram.
+
+    python -m benchmarks.bench_decode [--duration 2.0]
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+from asset_lib.impl.comm.packet import HeartBeatResponse, EventRequest, PositioningRequest
+from asset_lib.impl.comm.udp_comm import UdpComm
+
+def make_stream():
+    """Typical headset traffic: mostly positions, some heartbeats and events."""
+    stream = []
+    for i in range(100):
+        stream.append(PositioningRequest("unity", {"x": i * 0.01, "y": 1.5, "z": -i * 0.02}, {"x": 0.0, "y": i * 0.5, "z": 0.0}))
+    for _ in range(8):
+        stream.append(HeartBeatResponse("POSITIONING"))
+    stream.append(EventRequest("play_start"))
+    stream.append(EventRequest("reset"))
+    return [packet.to_json().encode('utf-8') for packet in stream]
+
+class _LegacyPacket:
+    def __init__(self, packet_type, data_type=None, event_type=None, data=None):
+        self.type = packet_type
+        self.data_type = data_type
+        self.event_type = event_type
+        self.data = data
+
+def _legacy_from_json(json_str):
+    data = json.loads(json_str)
+    packet_data = data.get("data", {})
+    if data.get("data_type") == "position":
+        return _LegacyPacket("data", "position", data={
+            "frame_type": packet_data["frame_type"],
+            "position": packet_data["position"],
+            "orientation": packet_data["orientation"]})
+    if data.get("data_type") == "heartbeat_response":
+        return _LegacyPacket("data", "heartbeat_response", data={"status": packet_data["status"]})
+    return _LegacyPacket(data.get("type"), data.get("data_type"), data.get("event_type"), packet_data)
+
+def legacy_receive(sock, lock, buffer, data):
+    """Replica of the receive_loop body before the single-pass decoder."""
+    json_data = data.decode('utf-8')
+    base_packet = _legacy_from_json(json_data)
+    if base_packet.type == "data":
+        queue_name = base_packet.data_type
+    elif base_packet.type == "event":
+        queue_name = base_packet.event_type
+    else:
+        return
+    packet = _legacy_from_json(json_data)
+    with lock:
+        buffer[queue_name] = packet
+
+def run_stream(handler, recv_sock, send_addr, stream, duration):
+    stop = threading.Event()
+
+    def sender():
+        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        while not stop.is_set():
+            for datagram in stream:
+                send_sock.sendto(datagram, send_addr)
+        send_sock.close()
+
+    recv_sock.settimeout(0.2)
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    processed = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        try:
+            data, _ = recv_sock.recvfrom(1024)
+        except socket.timeout:
+            continue
+        handler(data)
+        processed += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    # 残りのデータグラムを捨てる
+    recv_sock.setblocking(False)
+    try:
+        while True:
+            recv_sock.recvfrom(1024)
+    except BlockingIOError:
+        pass
+    recv_sock.setblocking(True)
+    return processed / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="UdpComm decode benchmark")
+    parser.add_argument('--duration', type=float, default=2.0, help="Seconds per variant (default: 2.0)")
+    args = parser.parse_args()
+
+    stream = make_stream()
+    comm = UdpComm(recv_ip="127.0.0.1", recv_port=0)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    addr = sock.getsockname()
+
+    lock = threading.Lock()
+    buffer = {}
+    before = run_stream(lambda data: legacy_receive(sock, lock, buffer, data), sock, addr, stream, args.duration)
+    after = run_stream(comm.handle_datagram, sock, addr, stream, args.duration)
+    sock.close()
+
+    print(f"legacy double-parse : {before:12.0f} packets/sec")
+    print(f"single-pass typed   : {after:12.0f} packets/sec")
+    print(f"speedup             : {after / before:12.2f} x")
+    print(f"unknown packets     : {comm.unknown_packets}")
+
+if __name__ == "__main__":
+    main()
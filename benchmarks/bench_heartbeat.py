@@ -0,0 +1,92 @@
+"""
+Heartbeat fan-out cost vs number of device nodes in HakoniwaARBridgeServiceContainer.
+
+A container is built from a generated node.json with N device nodes, each paired with
+a MockQuest3 peer on 127.0.0.1 that has answered with a HeartBeatResponse (so every node
+is connected). One round runs the heartbeat of every node once (what the scheduler's
+heartbeat and liveness jobs do every interval: send the HeartBeatRequest, check the
+timeout, update the state). Reports the round time in microseconds, per node cost and the number of
+receive threads, with one socket per node and with shared_udp_port.
+
+    python -m benchmarks.bench_heartbeat [--nodes 1,8,32,128] [--rounds 200]
+"""
+import argparse
+import threading
+import time
+
+from asset_lib.main import HakoniwaARBridgeServiceContainer
+from benchmarks.common import device_config, drain, free_port, make_peer, percentiles, quiet, temp_dir, wait_until, write_node
+
+def measure(num_nodes: int, rounds: int, shared: bool):
+    peers = []
+    configs = []
+    shared_port = free_port() if shared else None
+    for index in range(num_nodes):
+        port = shared_port or free_port()
+        peer = make_peer(port)
+        # 共有ソケットの振り分けに使うデバイスID (= player.name)
+        peer.device_id = f"Bench{index}"
+        peers.append(peer)
+        configs.append(device_config(port, peer.recv_port, peer.device_id))
+
+    with temp_dir() as directory:
+        options = {"shared_udp_port": shared_port} if shared else {}
+        threads_before = threading.active_count()
+        with quiet():
+            container = HakoniwaARBridgeServiceContainer(write_node(directory, configs, **options))
+            for service in container.services:
+                service.sync_manager.udp_service.start_receiving()
+        receive_threads = threading.active_count() - threads_before
+        heartbeats = [service.sync_manager.service for service in container.services]
+        try:
+            for peer in peers:
+                peer.send_heartbeat_response()
+            comms = [service.sync_manager.udp_service for service in container.services]
+            connected = wait_until(lambda: all(comm.get_last_recv_time() > 0 for comm in comms))
+            round_times = []
+            with quiet():
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    for heartbeat in heartbeats:
+                        heartbeat.run()
+                    round_times.append((time.perf_counter() - start) * 1e6)
+                    for peer in peers:
+                        drain(peer)
+            states = {service.sync_manager.get_sync_status() for service in container.services}
+        finally:
+            with quiet():
+                for service in container.services:
+                    service.sync_manager.udp_service.stop()
+            for peer in peers:
+                peer.sock.close()
+    result = percentiles(round_times)
+    result.update({
+        "nodes": num_nodes,
+        "per_node_us": result["mean"] / num_nodes,
+        "receive_threads": receive_threads,
+        "all_connected": connected and states == {"POSITIONING"},
+    })
+    return result
+
+def run(quick: bool = False, nodes=None, rounds: int = None):
+    nodes = nodes or ((1, 8, 32) if quick else (1, 8, 32, 128))
+    rounds = rounds or (50 if quick else 200)
+    results = {}
+    for shared in (False, True):
+        for num_nodes in nodes:
+            results[f"{'shared' if shared else 'per_node'}/{num_nodes}"] = measure(num_nodes, rounds, shared)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Heartbeat fan-out benchmark")
+    parser.add_argument('--nodes', type=str, default="1,8,32,128", help="Comma separated node counts (default: 1,8,32,128)")
+    parser.add_argument('--rounds', type=int, default=200, help="Heartbeat rounds per measurement (default: 200)")
+    args = parser.parse_args()
+    nodes = tuple(int(n) for n in args.nodes.split(","))
+    print(f"{'mode/nodes':16}{'p50 us':>10}{'p99 us':>10}{'per node us':>13}{'recv threads':>14}{'connected':>11}")
+    for name, result in run(nodes=nodes, rounds=args.rounds).items():
+        print(f"{name:16}{result['p50']:10.1f}{result['p99']:10.1f}{result['per_node_us']:13.1f}"
+              f"{result['receive_threads']:14d}{str(result['all_connected']):>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+UdpComm loopback latency: MockQuest3 send -> packet buffered in UdpComm.
+
+One PositioningRequest is in flight at a time; the time from the peer's sendto until
+the subscriber callback (called right after the packet is buffered) is recorded. Runs the
+thread runtime (receive thread) and the asyncio runtime (DatagramProtocol endpoint), in
+both codecs. Percentiles are in microseconds.
+
+    python -m benchmarks.bench_latency [--samples 2000]
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from asset_lib.impl.comm.codec import CODECS, CODEC_BINARY, CODEC_JSON
+from asset_lib.impl.comm.udp_comm import UdpComm
+from benchmarks.common import LOOPBACK, free_port, make_peer, percentiles, quiet
+
+POSITION = ({"x": 0.5, "y": 1.5, "z": -0.25}, {"x": 0.0, "y": 45.0, "z": 0.0})
+
+def measure_thread(codec: str, samples: int):
+    port = free_port()
+    peer = make_peer(port)
+    peer.codec = CODECS[codec]
+    comm = UdpComm(LOOPBACK, port, LOOPBACK, peer.recv_port)
+    arrived = threading.Event()
+    arrival = [0.0]
+
+    def on_position(packet):
+        arrival[0] = time.perf_counter()
+        arrived.set()
+
+    comm.subscribe("position", on_position)
+    with quiet():
+        comm.start_receiving()
+    latencies = []
+    try:
+        for _ in range(samples):
+            arrived.clear()
+            sent = time.perf_counter()
+            peer.send_position_data(*POSITION)
+            if arrived.wait(1.0):
+                latencies.append((arrival[0] - sent) * 1e6)
+    finally:
+        with quiet():
+            comm.stop()
+        peer.sock.close()
+    return percentiles(latencies)
+
+async def _measure_async(codec: str, samples: int):
+    port = free_port()
+    peer = make_peer(port)
+    peer.codec = CODECS[codec]
+    comm = UdpComm(LOOPBACK, port, LOOPBACK, peer.recv_port)
+    loop = asyncio.get_running_loop()
+    waiter = [None]
+
+    def on_position(packet):
+        if waiter[0] is not None and not waiter[0].done():
+            waiter[0].set_result(time.perf_counter())
+
+    comm.subscribe("position", on_position)
+    with quiet():
+        await comm.start_receiving_async()
+    latencies = []
+    try:
+        for _ in range(samples):
+            waiter[0] = loop.create_future()
+            sent = time.perf_counter()
+            peer.send_position_data(*POSITION)
+            try:
+                arrival = await asyncio.wait_for(waiter[0], 1.0)
+            except asyncio.TimeoutError:
+                continue
+            latencies.append((arrival - sent) * 1e6)
+    finally:
+        with quiet():
+            comm.stop()
+        peer.sock.close()
+    return percentiles(latencies)
+
+def run(quick: bool = False, samples: int = None):
+    samples = samples or (200 if quick else 2000)
+    results = {}
+    for codec in (CODEC_JSON, CODEC_BINARY):
+        results[f"thread/{codec}"] = measure_thread(codec, samples)
+        results[f"asyncio/{codec}"] = asyncio.run(_measure_async(codec, samples))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="UdpComm loopback latency benchmark")
+    parser.add_argument('--samples', type=int, default=2000, help="Packets per runtime/codec (default: 2000)")
+    args = parser.parse_args()
+    print(f"{'runtime/codec':20}{'p50 us':>9}{'p90 us':>9}{'p99 us':>9}{'max us':>9}")
+    for name, result in run(samples=args.samples).items():
+        print(f"{name:20}{result['p50']:9.1f}{result['p90']:9.1f}{result['p99']:9.1f}{result['max']:9.1f}")
+
+if __name__ == "__main__":
+    main()
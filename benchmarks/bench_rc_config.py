@@ -0,0 +1,103 @@
+"""
+Per-frame controller mapping cost for every shipped rc_config profile.
+
+One frame is what JoystickInputHandler.handle_input_position / rc_custom.joystick_control
+do per poll: get_op_index + StickMonitor.stick_value for every axis, plus
+get_event_op_index + switch_event for one button. Compares a replica of the legacy
+lookups (maps rebuilt from the nested JSON on every call, defaults written back into
+the config dicts) with the tables RcConfig compiles at load time.
+
+    python -m benchmarks.bench_rc_config [--frames 20000]
+"""
+import argparse
+import glob
+import os
+import time
+
+from asset_lib.impl.drivers.rc_utils import RcConfig, StickMonitor
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "..", "asset_lib", "impl", "drivers", "rc_config")
+
+class _LegacyRcConfig(RcConfig):
+    """Replica of the lookups before the compiled tables."""
+    EVENT_NAMES = ('RadioControlEnable', 'GrabBaggage', 'Camera', 'CameraMoveUp', 'CameraMoveDown', 'ReturnHome')
+
+    def get_event_op_index(self, switch_index):
+        # 旧実装はReturnHomeの無いプロファイルでKeyErrorになるため、存在する項目だけで作る
+        event_op_map = {self.config['Event'][name]['index']: op for name, op in self.EVENT_OPS if name in self.config['Event']}
+        return event_op_map.get(switch_index, None)
+
+    def get_switch_feature(self, switch_index):
+        feature_map = {self.config['Event'][name]['index']: self.config['Event'][name] for name in self.EVENT_NAMES if name in self.config['Event']}
+        feature = feature_map.get(switch_index, None)
+        if feature:
+            feature['type'] = feature.get('type', 'toggle')
+            feature['off'] = feature.get('off', 'up')
+            feature['on'] = feature.get('on', 'down')
+        return feature
+
+    def get_op_index(self, stick_index):
+        if self.config['mode'] == 2:
+            op_map = {
+                self.config['stick']['Left']['LR']['index']: self.STICK_TURN_LR,
+                self.config['stick']['Left']['UD']['index']: self.STICK_UP_DOWN,
+                self.config['stick']['Right']['LR']['index']: self.STICK_MOVE_LR,
+                self.config['stick']['Right']['UD']['index']: self.STICK_MOVE_FB
+            }
+        else:
+            op_map = {
+                self.config['stick']['Left']['LR']['index']: self.STICK_TURN_LR,
+                self.config['stick']['Left']['UD']['index']: self.STICK_MOVE_FB,
+                self.config['stick']['Right']['LR']['index']: self.STICK_MOVE_LR,
+                self.config['stick']['Right']['UD']['index']: self.STICK_UP_DOWN
+            }
+        return op_map.get(stick_index, None)
+
+    def get_stick_feature(self, stick_index):
+        feature_map = {
+            self.config['stick']['Left']['LR']['index']: self.config['stick']['Left']['LR'],
+            self.config['stick']['Left']['UD']['index']: self.config['stick']['Left']['UD'],
+            self.config['stick']['Right']['LR']['index']: self.config['stick']['Right']['LR'],
+            self.config['stick']['Right']['UD']['index']: self.config['stick']['Right']['UD']
+        }
+        feature = feature_map.get(stick_index, None)
+        if feature:
+            feature['conversion'] = feature.get('conversion', None)
+            feature['discretize'] = feature.get('discretize', None)
+            feature['average'] = feature.get('average', False)
+            feature['valueInverse'] = feature.get('valueInverse', False)
+        else:
+            raise ValueError(f"Feature for stick index {stick_index} not found.")
+        return feature
+
+def run_frames(rc_config, frames):
+    monitor = StickMonitor(rc_config)
+    axes = [index for index in range(8) if rc_config.get_op_index(index) is not None]
+    button = next(index for index in range(16) if rc_config.get_event_op_index(index) is not None)
+    outputs = []
+    start = time.perf_counter()
+    for frame in range(frames):
+        value = ((frame % 200) - 100) / 100.0
+        for axis in range(8):
+            if rc_config.get_op_index(axis) is not None:
+                outputs.append(monitor.stick_value(axis, value))
+        if rc_config.get_event_op_index(button) is not None:
+            monitor.switch_event(button, frame % 2 == 0)
+    elapsed = time.perf_counter() - start
+    return frames / elapsed, outputs, len(axes)
+
+def main():
+    parser = argparse.ArgumentParser(description="RcConfig lookup benchmark")
+    parser.add_argument('--frames', type=int, default=20000, help="Frames per profile (default: 20000)")
+    args = parser.parse_args()
+
+    print(f"{'profile':32}{'axes':>5}{'legacy frames/s':>18}{'compiled frames/s':>20}{'speedup':>9}")
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json"))):
+        legacy_rate, legacy_out, axes = run_frames(_LegacyRcConfig(path), args.frames)
+        compiled_rate, compiled_out, _ = run_frames(RcConfig(path), args.frames)
+        # 変換結果が旧実装と一致すること
+        assert legacy_out == compiled_out, f"output mismatch for {path}"
+        print(f"{os.path.basename(path):32}{axes:5d}{legacy_rate:18.0f}{compiled_rate:20.0f}{compiled_rate / legacy_rate:9.2f}")
+
+if __name__ == "__main__":
+    main()
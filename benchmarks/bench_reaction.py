@@ -0,0 +1,161 @@
+"""
+State-transition reaction time of a device node: event arrival -> SyncStateManagement change.
+
+A container with one device node is driven by a MockQuest3 peer on 127.0.0.1. Each cycle
+connects the node (HeartBeatResponse + one heartbeat round), then times play_start
+(POSITIONING -> PLAYING) and reset (PLAYING -> WAITING) from the peer's sendto until the
+state management method has run. The node's service loop is the body of
+HakoniwaARBridgeServiceDevice.run / run_async (wait for the state's packet types, then
+step), run in a thread or on an event loop. Percentiles are in microseconds.
+
+    python -m benchmarks.bench_reaction [--cycles 200]
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from asset_lib.impl.comm.packet import EventRequest
+from asset_lib.main import HakoniwaARBridgeServiceContainer
+from benchmarks.common import device_config, drain, free_port, make_peer, percentiles, quiet, temp_dir, wait_until, write_node
+
+class _Node:
+    """One device node of a container, with its state transitions timestamped."""
+    def __init__(self, directory: str):
+        port = free_port()
+        self.peer = make_peer(port)
+        self.container = HakoniwaARBridgeServiceContainer(write_node(directory, [device_config(port, self.peer.recv_port, "Bench0")]))
+        self.service = self.container.services[0]
+        self.comm = self.service.sync_manager.udp_service
+        self.heartbeat = self.service.sync_manager.service
+        self.transitions = {}
+        self.on_transition = None
+        state_management = self.service.sync_manager.state_management
+        for name in ("start_play", "disconnect_or_reset"):
+            self._instrument(state_management, name)
+
+    def _instrument(self, state_management, name):
+        original = getattr(state_management, name)
+
+        def timed():
+            original()
+            self.transitions[name] = time.perf_counter()
+            if self.on_transition is not None:
+                self.on_transition(name)
+        setattr(state_management, name, timed)
+
+    def connect(self):
+        self.peer.send_heartbeat_response()
+        self.heartbeat.run()
+        drain(self.peer)
+        return self.service.sync_manager.get_sync_status() == "POSITIONING"
+
+    def close(self):
+        self.comm.stop()
+        self.peer.sock.close()
+
+def measure_thread(cycles: int):
+    play, reset = [], []
+    with temp_dir() as directory, quiet():
+        node = _Node(directory)
+        node.comm.start_receiving()
+        running = [True]
+
+        def service_loop():
+            while running[0]:
+                node.comm.wait_for(node.service.wait_packet_types(), node.service.IDLE_TIMEOUT_SEC)
+                node.service.step()
+        thread = threading.Thread(target=service_loop, daemon=True)
+        thread.start()
+        try:
+            for _ in range(cycles):
+                node.peer.send_heartbeat_response()
+                if not wait_until(lambda: node.comm.get_last_recv_time() > 0) or not node.connect():
+                    continue
+                node.transitions.clear()
+                sent = time.perf_counter()
+                node.peer.send(EventRequest("play_start"))
+                if wait_until(lambda: "start_play" in node.transitions, 1.0):
+                    play.append((node.transitions["start_play"] - sent) * 1e6)
+                sent = time.perf_counter()
+                node.peer.send(EventRequest("reset"))
+                if wait_until(lambda: "disconnect_or_reset" in node.transitions, 1.0):
+                    reset.append((node.transitions["disconnect_or_reset"] - sent) * 1e6)
+        finally:
+            running[0] = False
+            node.comm.wakeup()
+            thread.join(2.0)
+            node.close()
+    return {"play_start": percentiles(play), "reset": percentiles(reset)}
+
+async def _measure_async(cycles: int):
+    play, reset = [], []
+    loop = asyncio.get_running_loop()
+    with temp_dir() as directory, quiet():
+        node = _Node(directory)
+        await node.comm.start_receiving_async()
+        waiters = {}
+
+        def on_transition(name):
+            future = waiters.get(name)
+            if future is not None and not future.done():
+                future.set_result(node.transitions[name])
+        node.on_transition = on_transition
+
+        async def service_loop():
+            while True:
+                await node.comm.wait_for_async(node.service.wait_packet_types(), node.service.IDLE_TIMEOUT_SEC)
+                node.service.step()
+        task = asyncio.ensure_future(service_loop())
+
+        async def timed(event_type, transition):
+            waiters[transition] = loop.create_future()
+            sent = time.perf_counter()
+            node.peer.send(EventRequest(event_type))
+            try:
+                return (await asyncio.wait_for(waiters[transition], 1.0) - sent) * 1e6
+            except asyncio.TimeoutError:
+                return None
+
+        try:
+            for _ in range(cycles):
+                node.peer.send_heartbeat_response()
+                for _ in range(1000):
+                    if node.comm.get_last_recv_time() > 0:
+                        break
+                    await asyncio.sleep(0.001)
+                if not node.connect():
+                    continue
+                latency = await timed("play_start", "start_play")
+                if latency is not None:
+                    play.append(latency)
+                latency = await timed("reset", "disconnect_or_reset")
+                if latency is not None:
+                    reset.append(latency)
+        finally:
+            task.cancel()
+            node.close()
+    return {"play_start": percentiles(play), "reset": percentiles(reset)}
+
+def run(quick: bool = False, cycles: int = None):
+    cycles = cycles or (30 if quick else 200)
+    return {
+        "thread": measure_thread(cycles),
+        "asyncio": asyncio.run(_measure_async(cycles)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="State transition reaction benchmark")
+    parser.add_argument('--cycles', type=int, default=200, help="play_start/reset cycles per runtime (default: 200)")
+    args = parser.parse_args()
+    print(f"{'runtime/event':22}{'count':>7}{'p50 us':>9}{'p90 us':>9}{'p99 us':>9}{'max us':>9}")
+    for runtime, events in run(cycles=args.cycles).items():
+        for event, result in events.items():
+            if not result["count"]:
+                print(f"{runtime + '/' + event:22}{0:7d}")
+                continue
+            print(f"{runtime + '/' + event:22}{result['count']:7d}{result['p50']:9.1f}{result['p90']:9.1f}"
+                  f"{result['p99']:9.1f}{result['max']:9.1f}")
+
+if __name__ == "__main__":
+    main()
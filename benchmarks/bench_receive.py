@@ -0,0 +1,116 @@
+"""
+Receive path of UdpSocket on a loopback UDP stream.
+
+Compares the legacy receive loop (sock.recvfrom(1024): one new bytes object per
+datagram, silently truncating anything above 1 KiB) with UdpSocket.receive_batch
+(recv_into preallocated buffers, draining all pending datagrams per wakeup).
+
+The stream (binary positions plus a >1 KiB JSON heartbeat) is queued on the socket
+before each timed drain. Reports datagrams/sec, datagrams per wakeup, bytes allocated
+per datagram (tracemalloc peak growth while receiving) and truncated datagrams.
+
+    python -m benchmarks.bench_receive [--duration 2.0]
+"""
+import argparse
+import socket
+import time
+import tracemalloc
+
+from asset_lib.impl.comm.codec import CODECS, CODEC_BINARY
+from asset_lib.impl.comm.packet import HeartBeatRequest, PositioningRequest
+from asset_lib.impl.comm.udp_socket import UdpSocket
+
+def make_stream():
+    binary = CODECS[CODEC_BINARY]
+    stream = []
+    for i in range(64):
+        packet = PositioningRequest("unity", {"x": i * 0.01, "y": 1.5, "z": -i * 0.02}, {"x": 0.0, "y": i * 0.5, "z": 0.0})
+        stream.append(binary.encode(packet))
+    # アバターの多いハートビートは1KiBを超える
+    avatars = [{"type": "dji", "name": f"Avatar{i:03d}"} for i in range(40)]
+    heartbeat = HeartBeatRequest("192.168.2.100", 48528, {"rotation": 20.0, "move": 0.2},
+                                 {"frame_type": "unity", "position": {"x": 0, "y": 0, "z": 0}, "orientation": {"x": 0, "y": 0, "z": 0}},
+                                 {"type": "dji", "name": "Drone1"}, avatars)
+    stream.append(heartbeat.to_json().encode('utf-8'))
+    return stream
+
+def _handler(data, addr):
+    pass
+
+def legacy_receive_one(sock, stats):
+    """Replica of the receive_loop body before the batched receive path."""
+    data, addr = sock.recvfrom(1024)
+    if len(data) == 1024:
+        stats["truncated"] += 1
+    _handler(data, addr)
+    return 1
+
+def measure(receive, sock, stream, rounds, trace=False):
+    """
+    Queue the stream on the socket, then time only the receive calls that drain it
+    (no sender thread competing for the GIL). With trace=True the tracemalloc peak growth
+    of each receive call is summed instead.
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = sock.getsockname()
+    elapsed = 0.0
+    allocated = 0
+    received = 0
+    calls = 0
+    for _ in range(rounds):
+        for datagram in stream:
+            sender.sendto(datagram, addr)
+        pending = len(stream)
+        while pending > 0:
+            if trace:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                n = receive()
+                _, peak = tracemalloc.get_traced_memory()
+                allocated += peak - before
+            else:
+                start = time.perf_counter()
+                n = receive()
+                elapsed += time.perf_counter() - start
+            pending -= n
+            received += n
+            calls += 1
+    sender.close()
+    return {"rate": received / elapsed if elapsed else 0.0, "per_call": received / calls, "alloc": allocated / received}
+
+def run_variant(receive, sock, stream, duration):
+    # 1ラウンドあたりの時間を見積もってからラウンド数を決める
+    probe = measure(receive, sock, stream, 10)
+    rounds = max(10, int(duration * probe["rate"] / len(stream)))
+    result = measure(receive, sock, stream, rounds)
+    tracemalloc.start()
+    result["alloc"] = measure(receive, sock, stream, 20, trace=True)["alloc"]
+    tracemalloc.stop()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="UdpSocket receive path benchmark")
+    parser.add_argument('--duration', type=float, default=2.0, help="Seconds per variant (default: 2.0)")
+    args = parser.parse_args()
+    stream = make_stream()
+
+    legacy_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    legacy_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)
+    legacy_sock.bind(("127.0.0.1", 0))
+    legacy_stats = {"truncated": 0}
+    legacy = run_variant(lambda: legacy_receive_one(legacy_sock, legacy_stats), legacy_sock, stream, args.duration)
+    legacy_sock.close()
+
+    endpoint = UdpSocket("127.0.0.1", 0, _handler, so_rcvbuf=1 << 21)
+    endpoint.open()
+    batched = run_variant(endpoint.receive_batch, endpoint.sock, stream, args.duration)
+    endpoint.close()
+
+    print(f"{'':24}{'legacy recvfrom':>18}{'batched recv_into':>20}")
+    print(f"{'datagrams/sec':24}{legacy['rate']:18.0f}{batched['rate']:20.0f}")
+    print(f"{'datagrams/wakeup':24}{legacy['per_call']:18.2f}{batched['per_call']:20.2f}")
+    print(f"{'alloc bytes/datagram':24}{legacy['alloc']:18.1f}{batched['alloc']:20.1f}")
+    print(f"{'truncated datagrams':24}{legacy_stats['truncated']:18d}{endpoint.truncated_datagrams:20d}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Stick processing cost: StickMonitor per sample vs the vectorized StickFrameProcessor.
+
+For every shipped rc_config profile a random walk of axis samples (including values
+outside [-1, 1]) is fed through the per-axis path (stick_value per mapped axis),
+StickMonitor.stick_frame (one sample per call, as JoystickInputHandler uses it) and
+StickFrameProcessor.process_block (--block samples per call, i.e. input sampled at a
+higher rate than it is consumed); the outputs must be identical.
+
+stick_frame uses the scalar path, so it costs the same as the per-axis loop. With only a
+handful of axes a NumPy call costs more than that; the vectorized pass pays off only
+with blocks of samples.
+
+    python -m benchmarks.bench_stick_frame [--frames 20000] [--block 16]
+"""
+import argparse
+import glob
+import os
+import random
+import time
+
+from asset_lib.impl.drivers.rc_utils import RcConfig, StickMonitor
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "..", "asset_lib", "impl", "drivers", "rc_config")
+NUM_AXES = 6
+
+def make_samples(frames, seed=1):
+    rng = random.Random(seed)
+    values = [0.0] * NUM_AXES
+    samples = []
+    for _ in range(frames):
+        values = [max(min(v + rng.uniform(-0.2, 0.2), 1.05), -1.05) for v in values]
+        samples.append(list(values))
+    return samples
+
+def run_per_axis(rc_config, samples):
+    monitor = StickMonitor(rc_config)
+    outputs = []
+    start = time.perf_counter()
+    for values in samples:
+        ops = [0.0] * 4
+        for axis, value in enumerate(values):
+            op_index = rc_config.get_op_index(axis)
+            if op_index is not None:
+                ops[op_index] = monitor.stick_value(axis, value)
+        outputs.append(ops)
+    return len(samples) / (time.perf_counter() - start), outputs
+
+def run_frame(rc_config, samples):
+    monitor = StickMonitor(rc_config)
+    outputs = []
+    start = time.perf_counter()
+    for values in samples:
+        outputs.append(monitor.stick_frame(values))
+    return len(samples) / (time.perf_counter() - start), outputs
+
+def run_block(rc_config, samples, block):
+    # NumPyはベンチマーク用の依存 (benchmarks/requirements.txt) なので使う時に読み込む
+    from asset_lib.impl.drivers.stick_frame import StickFrameProcessor
+    processor = StickFrameProcessor(rc_config)
+    # 初回呼び出しのコストを計測から外す
+    processor.process_block(samples[:1])
+    processor.reset()
+    blocks = [samples[i:i + block] for i in range(0, len(samples), block)]
+    results = []
+    start = time.perf_counter()
+    for rows in blocks:
+        results.append(processor.process_block(rows))
+    rate = len(samples) / (time.perf_counter() - start)
+    op_indices = processor.op_indices.tolist()
+    outputs = []
+    for result in results:
+        for row in result.tolist():
+            ops = [0.0] * 4
+            for op_index, value in zip(op_indices, row):
+                ops[op_index] = value
+            outputs.append(ops)
+    return rate, outputs
+
+def run(quick: bool = False, frames: int = None, block: int = 16, profile: str = "ps4-control.json"):
+    """Per-sample cost [us] of each path for one profile (used by benchmarks.suite)."""
+    frames = frames or (2000 if quick else 20000)
+    samples = make_samples(frames)
+    path = os.path.join(PROFILE_DIR, profile)
+    axis_rate, axis_out = run_per_axis(RcConfig(path), samples)
+    frame_rate, frame_out = run_frame(RcConfig(path), samples)
+    block_rate, block_out = run_block(RcConfig(path), samples, block)
+    assert axis_out == frame_out == block_out, f"output mismatch for {path}"
+    return {
+        "profile": profile,
+        "per_axis_us": 1e6 / axis_rate,
+        "frame_us": 1e6 / frame_rate,
+        f"block{block}_us": 1e6 / block_rate,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="StickMonitor frame processing benchmark")
+    parser.add_argument('--frames', type=int, default=20000, help="Samples per profile (default: 20000)")
+    parser.add_argument('--block', type=int, default=16, help="Samples per process_block call (default: 16)")
+    args = parser.parse_args()
+
+    samples = make_samples(args.frames)
+    print(f"{'profile':32}{'per-axis/s':>12}{'frame/s':>10}{'block/s':>10}{'speedup':>9}")
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json"))):
+        axis_rate, axis_out = run_per_axis(RcConfig(path), samples)
+        frame_rate, frame_out = run_frame(RcConfig(path), samples)
+        block_rate, block_out = run_block(RcConfig(path), samples, args.block)
+        # 変換結果がper-axis実装と一致すること
+        assert axis_out == frame_out, f"frame output mismatch for {path}"
+        assert axis_out == block_out, f"block output mismatch for {path}"
+        print(f"{os.path.basename(path):32}{axis_rate:12.0f}{frame_rate:10.0f}{block_rate:10.0f}"
+              f"{block_rate / axis_rate:9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Helpers shared by the benchmark suite: loopback ports, MockQuest3 peers, temporary
+node/device configs and summary statistics.
+"""
+import contextlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+
+from asset_lib.impl import log
+from asset_lib.impl.comm.codec import CODEC_JSON
+from asset_lib.mock.mock import MockQuest3
+
+LOOPBACK = "127.0.0.1"
+
+def free_port() -> int:
+    """A currently unused UDP port on the loopback interface."""
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) as sock:
+        sock.bind((LOOPBACK, 0))
+        return sock.getsockname()[1]
+
+def make_peer(bridge_port: int, codec: str = CODEC_JSON, sequence: bool = False) -> MockQuest3:
+    """MockQuest3 bound to an ephemeral loopback port, sending to the bridge at bridge_port."""
+    peer = MockQuest3("device", LOOPBACK, 0, LOOPBACK, bridge_port, codec, sequence)
+    peer.recv_port = peer.sock.getsockname()[1]
+    peer.sock.setblocking(False)
+    return peer
+
+def drain(peer: MockQuest3) -> int:
+    """Discard what the bridge sent to the peer. Returns the number of datagrams."""
+    count = 0
+    while True:
+        try:
+            peer.sock.recv(65535)
+        except BlockingIOError:
+            return count
+        count += 1
+
+def device_config(server_udp_port: int, ar_port: int, name: str):
+    return {
+        "ar_ip": LOOPBACK,
+        "ar_port": ar_port,
+        "server_udp_port": server_udp_port,
+        "player": {"type": "dji", "name": name},
+        "avatars": [],
+        "positioning_speed": {"rotation": 20.0, "move": 0.2},
+        "position": [0.0, 0.0, 0.0],
+        "rotation": [0.0, 0.0, 0.0],
+        "save_debounce_sec": 60.0,
+    }
+
+def write_node(directory: str, device_configs, **node_options) -> str:
+    """Write a node.json with one device node per config into directory. Returns its path."""
+    nodes = []
+    for index, config in enumerate(device_configs):
+        path = f"device{index}.json"
+        with open(os.path.join(directory, path), "w") as f:
+            json.dump(config, f)
+        nodes.append({"type": "device", "path": path})
+    node = {"bridge_ip": LOOPBACK, "web_ip": LOOPBACK, "ar_port": 0, "nodes": nodes}
+    node.update(node_options)
+    node_path = os.path.join(directory, "node.json")
+    with open(node_path, "w") as f:
+        json.dump(node, f)
+    return node_path
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the bridge's progress prints and logs while a benchmark runs."""
+    # ログは別スレッドで書かれるので、stdoutの差し替えではなくレベルで止める
+    bridge_logger = logging.getLogger(log.ROOT)
+    level = bridge_logger.level
+    bridge_logger.setLevel(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        bridge_logger.setLevel(level)
+
+def temp_dir():
+    return tempfile.TemporaryDirectory(prefix="hakoniwa-bench-")
+
+def wait_until(predicate, timeout: float = 2.0, interval: float = 0.0005) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles plus min/max/mean, in the unit of samples."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    result = {"count": len(ordered), "min": ordered[0], "max": ordered[-1], "mean": sum(ordered) / len(ordered)}
+    for point in points:
+        rank = max(int(round(point / 100.0 * len(ordered) + 0.5)) - 1, 0)
+        result[f"p{point}"] = ordered[min(rank, len(ordered) - 1)]
+    return result
+
+def rate(fn, duration: float, batch: int = 100):
+    """Calls of fn per second, measured over roughly duration seconds."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            fn()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return calls / elapsed
@@ -0,0 +1,122 @@
+"""
+Runs the bridge benchmark suite and writes machine-readable results.
+
+Cases (each also runs on its own as python -m benchmarks.bench_<case>):
+    codec      encode/decode throughput for every packet type and codec
+    latency    UdpComm loopback send -> buffer latency percentiles
+    heartbeat  heartbeat fan-out cost vs number of device nodes in the container
+    reaction   play_start/reset arrival -> SyncStateManagement change
+    stick      StickMonitor per-sample cost
+
+All traffic comes from MockQuest3 peers on 127.0.0.1. Results are written as JSON with the
+commit and environment they were measured on; --compare prints the ratio of every metric
+of two result files (new / base).
+
+    python -m benchmarks.suite [--quick] [--only codec,latency] [--output results.json]
+    python -m benchmarks.suite --compare base.json new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import bench_codec, bench_heartbeat, bench_latency, bench_reaction, bench_stick_frame
+
+CASES = {
+    "codec": bench_codec.run,
+    "latency": bench_latency.run,
+    "heartbeat": bench_heartbeat.run,
+    "reaction": bench_reaction.run,
+    "stick": bench_stick_frame.run,
+}
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def environment(quick: bool):
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": quick,
+    }
+
+def flatten(results, prefix=""):
+    """{"a": {"b": 1}} -> {"a/b": 1} for the numeric leaves."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base: {base['environment'].get('commit')}  new: {new['environment'].get('commit')}")
+    base_metrics = flatten(base["results"])
+    new_metrics = flatten(new["results"])
+    print(f"{'metric':60}{'base':>14}{'new':>14}{'new/base':>10}")
+    for name, value in new_metrics.items():
+        if name not in base_metrics:
+            continue
+        old = base_metrics[name]
+        ratio = f"{value / old:10.3f}" if old else f"{'-':>10}"
+        print(f"{name:60}{old:14.4g}{value:14.4g}{ratio}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Hakoniwa AR bridge benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="Shorter runs (smoke test)")
+    parser.add_argument('--only', type=str, default=None, help=f"Comma separated cases (default: all of {','.join(CASES)})")
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    report = {"environment": environment(args.quick), "results": {}, "durations_sec": {}}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        start = time.perf_counter()
+        report["results"][name] = CASES[name](quick=args.quick)
+        report["durations_sec"][name] = time.perf_counter() - start
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())